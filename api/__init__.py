@@ -2,13 +2,18 @@ import logging
 from config import Config
 from flask import Flask, g
 from flask_restful import Api, Resource, abort, reqparse, request
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_marshmallow import Marshmallow
 from flask_httpauth import HTTPBasicAuth
 from flask_apispec.extension import FlaskApiSpec
 # from flask_mail import Mail, Message
 from flask_babel import Babel
+from helpers.auth_cache import CredentialCache, TokenRevocationCache
+from helpers.database import RoutingSQLAlchemy, init_sqlite_pragmas
+from helpers.derivatives import DerivativePipeline
+from helpers.metrics import RequestMetrics, section
+from helpers.response_cache import ResponseCache
+from sqlalchemy import event
 
 
 app = Flask(__name__, static_folder=Config.UPLOAD_FOLDER)
@@ -16,13 +21,30 @@ app.config.from_object(Config)
 
 
 api = Api(app)
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+db = RoutingSQLAlchemy(app)
+init_sqlite_pragmas(app)
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    # таблицы FTS5 (api.models.search) создаются миграцией вручную - autogenerate их не удаляет
+    return not (type_ == "table" and name.startswith("note_fts"))
+
+
+migrate = Migrate(app, db, include_object=include_object)
 ma = Marshmallow(app)
 auth = HTTPBasicAuth()
 # swagger = Swagger(app)
 docs = FlaskApiSpec(app)
 babel = Babel(app)
+credential_cache = CredentialCache(Config.SECRET_KEY,
+                                   maxsize=Config.AUTH_CACHE_SIZE,
+                                   ttl=Config.AUTH_CACHE_TTL)
+token_revocations = TokenRevocationCache(max_token_age=Config.AUTH_TOKEN_EXPIRATION)
+request_metrics = RequestMetrics()
+request_metrics.init_app(app)  # до кэша ответов, чтобы учитывать и попадания в кэш
+response_cache = ResponseCache(locale_selector=lambda: get_locale())
+response_cache.init_app(app)
+derivatives = DerivativePipeline()
 # mail = Mail(app)
 
 # msg = Message('test subject', sender = Config.ADMINS[0], recipients = Config.ADMINS)
@@ -32,18 +54,29 @@ babel = Babel(app)
 #    mail.send(msg)
 
 
+@event.listens_for(db.metadata, 'after_drop')
+def invalidate_response_cache(*args, **kwargs):
+    response_cache.invalidate("users", "notes", "tags")
+
+
 @auth.verify_password
 def verify_password(username_or_token, password):
     from api.models.user import UserModel
     # сначала проверяем authentication token
     # print("username_or_token = ", username_or_token)
     # print("password = ", password)
-    user = UserModel.verify_auth_token(username_or_token)
-    if not user:
-        # потом авторизация
-        user = UserModel.query.filter_by(username=username_or_token).first()
-        if not user or not user.verify_password(password):
-            return False
+    with section("auth"):
+        user = UserModel.verify_auth_token(username_or_token)
+        if not user:
+            # потом авторизация
+            user = UserModel.query.filter_by(username=username_or_token).first()
+            if not user:
+                return False
+            # медленный pwd_context.verify вызываем только при промахе кэша
+            if not credential_cache.lookup(username_or_token, password, user):
+                if not user.verify_password(password):
+                    return False
+                credential_cache.store(username_or_token, password, user)
     g.user = user
     return True
 
@@ -0,0 +1,126 @@
+import json
+from datetime import datetime
+from api import db, response_cache
+from api.models.blob import BlobModel, BlobRefModel
+from api.models.note import NoteModel, tags
+from api.models.tag import TagModel, tag_registry
+from api.models.user import UserModel
+
+# Холодное хранилище заметок (NOTE_COLD_STORAGE): архивные заметки переносятся из note_model
+# в note_archive с теми же id, чтобы таблица активных заметок и ее индексы не росли.
+
+note_archive_tags = db.Table('note_archive_tags',
+                             db.Column('tag_id', db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'),
+                                       primary_key=True),
+                             db.Column('note_id', db.Integer, db.ForeignKey('note_archive.id', ondelete='CASCADE'),
+                                       primary_key=True),
+                             db.Index('ix_note_archive_tags_note_id_tag_id', 'note_id', 'tag_id'),
+                             )
+
+
+class NoteArchiveTagModel(db.Model):
+    __table__ = note_archive_tags
+
+
+class NoteArchiveModel(db.Model):
+    """
+    Заметка в холодном хранилище. Сериализуется NoteSchema так же, как NoteModel.
+    Ссылки на файлы (BlobRefModel) хранятся в blob_refs и возвращаются при восстановлении;
+    ref_count их blob'ов при переносе не меняется
+    """
+    __tablename__ = 'note_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    author_id = db.Column(db.Integer, db.ForeignKey(UserModel.id))
+    text = db.Column(db.String(255), nullable=False)
+    private = db.Column(db.Boolean(), nullable=False)
+    blob_refs = db.Column(db.Text)  # [[digest, user_id], ...]
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    author = db.relationship(UserModel)
+    tags = db.relationship(TagModel, secondary=note_archive_tags, lazy='select')
+    tag_links = db.relationship(NoteArchiveTagModel, viewonly=True, order_by=NoteArchiveTagModel.tag_id)
+
+    archive = True
+
+    @property
+    def registry_tags(self):
+        return tag_registry.resolve([link.tag_id for link in self.tag_links])
+
+    # заметок, переносимых одной пачкой запросов: SQLite ограничивает число параметров
+    CHUNK = 400
+
+    @staticmethod
+    def move_to_archive(note_ids):
+        """
+        Переносит заметки note_ids в note_archive: INSERT ... SELECT и DELETE пачками, без ORM-объектов.
+        Ссылки на файлы переезжают в blob_refs, а ref_count не уменьшается: пока заметка в архиве,
+        ее blob'ы заняты и blobs-gc их не трогает. Ссылки освобождает только bulk_delete.
+        Коммит - на вызывающей стороне
+        """
+        note_ids = sorted(note_ids)
+        for start in range(0, len(note_ids), NoteArchiveModel.CHUNK):
+            chunk = note_ids[start:start + NoteArchiveModel.CHUNK]
+            refs = {}
+            for note_id, digest, user_id in db.session.query(
+                    BlobRefModel.note_id, BlobRefModel.blob_digest, BlobRefModel.user_id) \
+                    .filter(BlobRefModel.note_id.in_(chunk)):
+                refs.setdefault(note_id, []).append([digest, user_id])
+            notes = NoteModel.__table__
+            db.session.execute(NoteArchiveModel.__table__.insert().from_select(
+                ['id', 'author_id', 'text', 'private', 'archived_at'],
+                db.select([notes.c.id, notes.c.author_id, notes.c.text, notes.c.private,
+                           db.literal(datetime.utcnow(), db.DateTime)]).where(notes.c.id.in_(chunk))))
+            db.session.execute(note_archive_tags.insert().from_select(
+                ['tag_id', 'note_id'],
+                db.select([tags.c.tag_id, tags.c.note_model_id]).where(tags.c.note_model_id.in_(chunk))))
+            for note_id, note_refs in refs.items():
+                db.session.execute(NoteArchiveModel.__table__.update()
+                                   .where(NoteArchiveModel.id == note_id).values(blob_refs=json.dumps(note_refs)))
+            db.session.execute(BlobRefModel.__table__.delete().where(BlobRefModel.note_id.in_(chunk)))
+            NoteModel.bulk_delete(chunk)
+        response_cache.invalidate("notes")
+
+    @staticmethod
+    def restore(note_ids):
+        """
+        Возвращает заметки note_ids из note_archive в note_model. Коммит - на вызывающей стороне
+        """
+        note_ids = sorted(note_ids)
+        archive = NoteArchiveModel.__table__
+        for start in range(0, len(note_ids), NoteArchiveModel.CHUNK):
+            chunk = note_ids[start:start + NoteArchiveModel.CHUNK]
+            refs = [{"blob_digest": digest, "user_id": user_id, "note_id": note_id}
+                    for note_id, blob_refs in db.session.query(NoteArchiveModel.id, NoteArchiveModel.blob_refs)
+                    .filter(NoteArchiveModel.id.in_(chunk), NoteArchiveModel.blob_refs.isnot(None))
+                    for digest, user_id in json.loads(blob_refs)]
+            db.session.execute(NoteModel.__table__.insert().from_select(
+                ['id', 'author_id', 'text', 'private', 'archive'],
+                db.select([archive.c.id, archive.c.author_id, archive.c.text, archive.c.private,
+                           db.false()]).where(archive.c.id.in_(chunk))))
+            db.session.execute(tags.insert().from_select(
+                ['tag_id', 'note_model_id'],
+                db.select([note_archive_tags.c.tag_id, note_archive_tags.c.note_id])
+                .where(note_archive_tags.c.note_id.in_(chunk))))
+            if refs:
+                db.session.execute(BlobRefModel.__table__.insert(), refs)
+            NoteArchiveModel._delete_rows(chunk)
+        response_cache.invalidate("notes")
+
+    @staticmethod
+    def bulk_delete(note_ids):
+        """
+        Удаляет архивные заметки, освобождая их ссылки на файлы. Коммит - на вызывающей стороне
+        """
+        if not note_ids:
+            return
+        released = {}
+        for (blob_refs,) in db.session.query(NoteArchiveModel.blob_refs) \
+                .filter(NoteArchiveModel.id.in_(note_ids), NoteArchiveModel.blob_refs.isnot(None)):
+            for digest, user_id in json.loads(blob_refs):
+                released[digest] = released.get(digest, 0) + 1
+        BlobModel.release(db.session, released)
+        NoteArchiveModel._delete_rows(note_ids)
+
+    @staticmethod
+    def _delete_rows(note_ids):
+        db.session.execute(note_archive_tags.delete().where(note_archive_tags.c.note_id.in_(note_ids)))
+        db.session.execute(NoteArchiveModel.__table__.delete().where(NoteArchiveModel.id.in_(note_ids)))
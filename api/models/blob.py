@@ -0,0 +1,150 @@
+import os
+from datetime import datetime, timedelta
+from api import db
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from api.models.user import UserModel
+from api.models.note import NoteModel
+from helpers.derivatives import variant_path
+from helpers.uploads import blob_path
+
+
+class BlobModel(db.Model):
+    """
+    Загруженный файл, хранящийся один раз под своим sha256 (helpers.uploads.blob_path).
+    ref_count - число ссылок BlobRefModel и ссылок заметок в холодном хранилище
+    (NoteArchiveModel.blob_refs), поддерживается инкрементально.
+    orphaned_at - с какого момента у blob'а нет ссылок (для нового - момент создания);
+    сборщик мусора удаляет blob только через BLOB_GC_GRACE секунд после этого
+    """
+    __tablename__ = 'blob'
+    digest = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    mimetype = db.Column(db.String(128))
+    ref_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    orphaned_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    @property
+    def path(self):
+        return blob_path(self.digest)
+
+    @staticmethod
+    def get_or_create(digest, size, mimetype=None):
+        blob = BlobModel.query.get(digest)
+        if blob is None:
+            try:
+                blob = BlobModel(digest=digest, size=size, mimetype=mimetype)
+                db.session.add(blob)
+                db.session.commit()
+            except IntegrityError:  # тот же файл параллельно загрузил другой запрос
+                db.session.rollback()
+                blob = BlobModel.query.get(digest)
+        elif blob.ref_count <= 0:
+            # файл загрузили заново до ссылки на него - отодвигаем сборку мусора
+            blob.orphaned_at = datetime.utcnow()
+            db.session.commit()
+        return blob
+
+    def add_ref(self, user_id=None, note_id=None):
+        """
+        Связывает blob с пользователем и/или заметкой; повторная такая же ссылка не создается.
+        Ссылка без пользователя и заметки - анонимная загрузка, она не освобождается никогда
+        """
+        exists = BlobRefModel.query.filter_by(blob_digest=self.digest, user_id=user_id, note_id=note_id).first()
+        if exists is None:
+            db.session.add(BlobRefModel(blob_digest=self.digest, user_id=user_id, note_id=note_id))
+            db.session.query(BlobModel).filter_by(digest=self.digest) \
+                .update({BlobModel.ref_count: BlobModel.ref_count + 1, BlobModel.orphaned_at: None},
+                        synchronize_session=False)
+            db.session.commit()
+            db.session.refresh(self)
+
+    @staticmethod
+    def release(connection, counts):
+        """
+        Уменьшает ref_count blob'ов на counts (digest --> число ссылок); у blob'ов, оставшихся
+        без ссылок, отмечает orphaned_at
+        """
+        blobs = BlobModel.__table__
+        now = datetime.utcnow()
+        for digest, count in counts.items():
+            connection.execute(blobs.update().where(blobs.c.digest == digest).values(
+                ref_count=blobs.c.ref_count - count,
+                orphaned_at=db.case([(blobs.c.ref_count - count <= 0, now)], else_=blobs.c.orphaned_at)))
+
+    @staticmethod
+    def collect_garbage():
+        """
+        Удаляет blob'ы, оставшиеся без ссылок дольше BLOB_GC_GRACE секунд, вместе с файлами
+        и уменьшенными копиями. Возвращает число удаленных
+        """
+        folder = current_app.config['UPLOAD_FOLDER']
+        cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['BLOB_GC_GRACE'])
+        blobs = BlobModel.__table__
+        orphaned = (blobs.c.ref_count <= 0) & (blobs.c.orphaned_at < cutoff)
+        removed = 0
+        for (digest,) in db.session.query(BlobModel.digest).filter(orphaned).all():
+            # условный DELETE: если на blob успели сослаться, строка и файл остаются
+            deleted = db.session.execute(blobs.delete().where((blobs.c.digest == digest) & orphaned)).rowcount
+            db.session.commit()
+            if not deleted:
+                continue
+            path = os.path.join(folder, blob_path(digest))
+            # файл сначала убираем в сторону и перепроверяем строку: если тот же файл загрузили
+            # заново (загрузка коммитит ссылку, затем проверяет файл), возвращаем его на место
+            trash = path + '.gc'
+            try:
+                os.replace(path, trash)
+            except FileNotFoundError:
+                trash = None
+            if db.session.query(BlobModel.digest).filter_by(digest=digest).scalar() is not None:
+                if trash is not None:
+                    if os.path.exists(path):
+                        os.unlink(trash)
+                    else:
+                        os.replace(trash, path)
+                db.session.commit()
+                continue
+            db.session.commit()
+            paths = ([trash] if trash else []) + [os.path.join(folder, variant_path(variant, digest))
+                                                  for variant in current_app.config['IMAGE_VARIANTS']]
+            for path in paths:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            removed += 1
+        return removed
+
+
+class BlobRefModel(db.Model):
+    __tablename__ = 'blob_ref'
+    id = db.Column(db.Integer, primary_key=True)
+    blob_digest = db.Column(db.String(64), db.ForeignKey(BlobModel.digest), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(UserModel.id), index=True)
+    note_id = db.Column(db.Integer, db.ForeignKey(NoteModel.id), index=True)
+
+
+def release_refs(connection, column, object_ids):
+    """
+    Удаляет ссылки пользователей или заметок object_ids и уменьшает ref_count их blob'ов
+    """
+    refs = BlobRefModel.__table__
+    condition = refs.c[column].in_(object_ids)
+    rows = connection.execute(db.select([refs.c.blob_digest, db.func.count()])
+                              .where(condition).group_by(refs.c.blob_digest)).fetchall()
+    if not rows:
+        return
+    connection.execute(refs.delete().where(condition))
+    BlobModel.release(connection, dict(rows))
+
+
+@event.listens_for(UserModel, 'before_delete')
+def _release_user_refs(mapper, connection, target):
+    release_refs(connection, 'user_id', [target.id])
+
+
+@event.listens_for(NoteModel, 'before_delete')
+def _release_note_refs(mapper, connection, target):
+    release_refs(connection, 'note_id', [target.id])
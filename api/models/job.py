@@ -0,0 +1,137 @@
+import json
+import logging
+from datetime import datetime, timedelta
+from api import db
+from flask import current_app
+from sqlalchemy import and_, or_
+
+logger = logging.getLogger(__name__)
+
+tasks = {}  # имя задачи --> функция(job, **payload)
+
+
+def task(name):
+    """
+    Регистрирует функцию как задачу очереди: JobModel.enqueue(name, ...) выполнит ее в `flask worker`
+    """
+    def decorator(func):
+        tasks[name] = func
+        return func
+    return decorator
+
+
+class JobModel(db.Model):
+    """
+    Задача фоновой очереди, хранящаяся в БД.
+
+    queued --> running --> done; при ошибке задача возвращается в queued с экспоненциальной
+    задержкой, после max_attempts попыток - failed. Захваченная задача невидима для других
+    воркеров до locked_until (visibility timeout); если воркер упал, ее подберет другой.
+    """
+    __tablename__ = 'job'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(16), nullable=False, default='queued', server_default='queued', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    locked_until = db.Column(db.DateTime)
+    progress = db.Column(db.Text)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    user_id = db.Column(db.Integer, index=True)  # без внешнего ключа: задача может удалять пользователя
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    @property
+    def result_data(self):
+        return json.loads(self.result) if self.result else None
+
+    @property
+    def progress_data(self):
+        return json.loads(self.progress) if self.progress else None
+
+    def set_progress(self, progress):
+        """
+        Сохраняется вместе с ближайшим коммитом задачи
+        """
+        self.progress = json.dumps(progress)
+
+    @staticmethod
+    def enqueue(name, payload=None, user_id=None, max_attempts=None):
+        if name not in tasks:
+            raise KeyError(f"Unknown task {name}")
+        job = JobModel(name=name, payload=json.dumps(payload or {}), user_id=user_id,
+                       max_attempts=max_attempts or current_app.config['JOB_MAX_ATTEMPTS'])
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    @staticmethod
+    def claim():
+        """
+        Захватывает следующую готовую к выполнению задачу или возвращает None.
+        Захват - условный UPDATE, поэтому одну задачу не получат два воркера
+        """
+        while True:
+            now = datetime.utcnow()
+            available = or_(and_(JobModel.status == 'queued', JobModel.run_at <= now),
+                            and_(JobModel.status == 'running', JobModel.locked_until < now))
+            job_id = db.session.query(JobModel.id).filter(available) \
+                .order_by(JobModel.run_at, JobModel.id).limit(1).scalar()
+            if job_id is None:
+                return None
+            locked_until = now + timedelta(seconds=current_app.config['JOB_VISIBILITY_TIMEOUT'])
+            claimed = JobModel.query.filter(JobModel.id == job_id, available) \
+                .update({JobModel.status: 'running', JobModel.locked_until: locked_until,
+                         JobModel.attempts: JobModel.attempts + 1}, synchronize_session=False)
+            db.session.commit()
+            if not claimed:  # задачу перехватил другой воркер
+                continue
+            job = JobModel.query.get(job_id)
+            if job.attempts > job.max_attempts:  # воркеры падали на ней, не завершив
+                job._finish('failed', error=job.error or "Visibility timeout expired")
+                continue
+            return job
+
+    def run(self):
+        job_id, name = self.id, self.name
+        try:
+            result = tasks[name](self, **json.loads(self.payload))
+        except Exception as error:
+            logger.exception("Job %s (%s) failed", job_id, name)
+            db.session.rollback()
+            job = JobModel.query.get(job_id)
+            message = f"{type(error).__name__}: {error}"
+            if job.attempts >= job.max_attempts:
+                job._finish('failed', error=message)
+            else:
+                delay = current_app.config['JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+                job.status, job.error, job.locked_until = 'queued', message, None
+                job.run_at = datetime.utcnow() + timedelta(seconds=delay)
+                db.session.commit()
+            return job
+        job = JobModel.query.get(job_id)
+        job._finish('done', result=result)
+        return job
+
+    def _finish(self, status, result=None, error=None):
+        self.status, self.error, self.locked_until = status, error, None
+        self.result = json.dumps(result) if result is not None else None
+        self.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    @staticmethod
+    def run_pending(limit=None):
+        """
+        Выполняет готовые задачи, пока они есть (не больше limit). Возвращает число выполненных
+        """
+        count = 0
+        while limit is None or count < limit:
+            job = JobModel.claim()
+            if job is None:
+                break
+            job.run()
+            count += 1
+        return count
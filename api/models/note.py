@@ -1,29 +1,208 @@
-from api import db
+from api import db, response_cache
+from sqlalchemy import DDL, and_, case, event, func
 from sqlalchemy.sql import expression
 from api.models.user import UserModel
-from api.models.tag import TagModel
+from api.models.tag import TagModel, tag_registry
 
 tags = db.Table('tags',
                 db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
-                db.Column('note_model_id', db.Integer, db.ForeignKey('note_model.id'), primary_key=True)
+                db.Column('note_model_id', db.Integer, db.ForeignKey('note_model.id'), primary_key=True),
+                # PK начинается с tag_id - для тегов заметки нужен индекс с note_model_id впереди
+                db.Index('ix_tags_note_model_id_tag_id', 'note_model_id', 'tag_id'),
                 )
 
+# TagModel.notes_count - число публичных (private = false) активных (archive = false) заметок
+# с тегом; только такие заметки видны всем, поэтому /tags/cloud можно отдавать без авторизации.
+# Счетчик поддерживается триггерами, так он верен для любых изменений, включая bulk-операции:
+# - связь tags учитывается, если ее заметка публичная и активная;
+# - смена private/archive заметки прибавляет или вычитает ее теги;
+# - удаленная заметка вычитается (если ее связи удаляют после нее, а не до).
+# Заметки в холодном хранилище (note_archive) не активны: их связи при переносе удаляются
+# из tags и вычитаются, при восстановлении - вставляются заново и учитываются.
+TAG_COUNT_SQLITE_DDL = [
+    "CREATE TRIGGER IF NOT EXISTS tags_notes_count_ai AFTER INSERT ON tags "
+    "WHEN EXISTS (SELECT 1 FROM note_model WHERE id = new.note_model_id AND private = 0 AND archive = 0) BEGIN "
+    "UPDATE tag SET notes_count = notes_count + 1 WHERE id = new.tag_id; END",
+    "CREATE TRIGGER IF NOT EXISTS tags_notes_count_ad AFTER DELETE ON tags "
+    "WHEN EXISTS (SELECT 1 FROM note_model WHERE id = old.note_model_id AND private = 0 AND archive = 0) BEGIN "
+    "UPDATE tag SET notes_count = notes_count - 1 WHERE id = old.tag_id; END",
+]
+NOTE_TAG_COUNT_SQLITE_DDL = [
+    "CREATE TRIGGER IF NOT EXISTS note_model_notes_count_au AFTER UPDATE OF private, archive ON note_model "
+    "WHEN (old.private = 0 AND old.archive = 0) <> (new.private = 0 AND new.archive = 0) BEGIN "
+    "UPDATE tag SET notes_count = notes_count + CASE WHEN new.private = 0 AND new.archive = 0 THEN 1 ELSE -1 END "
+    "WHERE id IN (SELECT tag_id FROM tags WHERE note_model_id = new.id); END",
+    "CREATE TRIGGER IF NOT EXISTS note_model_notes_count_ad AFTER DELETE ON note_model "
+    "WHEN old.private = 0 AND old.archive = 0 BEGIN "
+    "UPDATE tag SET notes_count = notes_count - 1 "
+    "WHERE id IN (SELECT tag_id FROM tags WHERE note_model_id = old.id); END",
+]
+TAG_COUNT_POSTGRES_DDL = [
+    "CREATE OR REPLACE FUNCTION tags_notes_count() RETURNS trigger AS $$ BEGIN "
+    "IF TG_OP = 'INSERT' THEN UPDATE tag SET notes_count = notes_count + 1 WHERE id = NEW.tag_id "
+    "AND EXISTS (SELECT 1 FROM note_model WHERE id = NEW.note_model_id AND NOT private AND NOT archive); "
+    "ELSE UPDATE tag SET notes_count = notes_count - 1 WHERE id = OLD.tag_id "
+    "AND EXISTS (SELECT 1 FROM note_model WHERE id = OLD.note_model_id AND NOT private AND NOT archive); END IF; "
+    "RETURN NULL; END $$ LANGUAGE plpgsql",
+    "CREATE TRIGGER tags_notes_count AFTER INSERT OR DELETE ON tags "
+    "FOR EACH ROW EXECUTE PROCEDURE tags_notes_count()",
+]
+NOTE_TAG_COUNT_POSTGRES_DDL = [
+    "CREATE OR REPLACE FUNCTION note_model_notes_count() RETURNS trigger AS $$ BEGIN "
+    "IF TG_OP = 'UPDATE' THEN "
+    "IF (NOT OLD.private AND NOT OLD.archive) <> (NOT NEW.private AND NOT NEW.archive) THEN "
+    "UPDATE tag SET notes_count = notes_count + CASE WHEN NOT NEW.private AND NOT NEW.archive THEN 1 ELSE -1 END "
+    "WHERE id IN (SELECT tag_id FROM tags WHERE note_model_id = NEW.id); END IF; "
+    "ELSIF NOT OLD.private AND NOT OLD.archive THEN "
+    "UPDATE tag SET notes_count = notes_count - 1 WHERE id IN (SELECT tag_id FROM tags WHERE note_model_id = OLD.id); "
+    "END IF; RETURN NULL; END $$ LANGUAGE plpgsql",
+    "CREATE TRIGGER note_model_notes_count AFTER UPDATE OF private, archive OR DELETE ON note_model "
+    "FOR EACH ROW EXECUTE PROCEDURE note_model_notes_count()",
+]
+
+# триггеры note_model тоже создаются после tags: create_all создает tags последней из трех таблиц
+for statement in TAG_COUNT_SQLITE_DDL + NOTE_TAG_COUNT_SQLITE_DDL:
+    event.listen(tags, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+for statement in TAG_COUNT_POSTGRES_DDL + NOTE_TAG_COUNT_POSTGRES_DDL:
+    event.listen(tags, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+
+class NoteTagModel(db.Model):
+    """
+    Строка таблицы связей tags: для чтения id тегов заметки без загрузки TagModel
+    """
+    __table__ = tags
+
 
 class NoteModel(db.Model):
+    # AUTOINCREMENT: id заметок, перенесенных в холодное хранилище (api.models.archive), не переиспользуются
+    __table_args__ = {'sqlite_autoincrement': True}
     id = db.Column(db.Integer, primary_key=True)
     author_id = db.Column(db.Integer, db.ForeignKey(UserModel.id))
     text = db.Column(db.String(255), unique=False, nullable=False)
     private = db.Column(db.Boolean(), default=True, nullable=False)
-    tags = db.relationship(TagModel, secondary=tags, lazy='subquery',
+    tags = db.relationship(TagModel, secondary=tags, lazy='select',
                            backref=db.backref('notes', lazy=True),
                            cascade="all, delete")
+    # для сериализации: id тегов из таблицы связей, имена - из tag_registry
+    tag_links = db.relationship(NoteTagModel, viewonly=True, order_by=NoteTagModel.tag_id)
     archive = db.Column(db.Boolean(), default=False, server_default=expression.false(), nullable=False)
 
+    @property
+    def registry_tags(self):
+        return tag_registry.resolve([link.tag_id for link in self.tag_links])
+
+
+    # строк в одном INSERT ... VALUES и id в одном IN: SQLite ограничивает число параметров запроса
+    TAGS_INSERT_CHUNK = 400
 
     def save(self):
         db.session.add(self)
         db.session.commit()
+        response_cache.invalidate("notes")
+
+    def add_tags(self, tag_ids):
+        """
+        Привязывает к заметке теги из tag_ids: SELECT по связям и многострочный INSERT
+        только отсутствующих связей, порциями по TAGS_INSERT_CHUNK. Возвращает неизвестные id.
+        """
+        tag_ids = set(tag_ids)
+        known = self._known_tag_ids(tag_ids)
+        existing = set()
+        for chunk in self._chunks(sorted(known)):
+            existing.update(tag_id for (tag_id,) in db.session.query(tags.c.tag_id).filter(
+                tags.c.note_model_id == self.id, tags.c.tag_id.in_(chunk)))
+        rows = [{"tag_id": tag_id, "note_model_id": self.id} for tag_id in sorted(known - existing)]
+        for chunk in self._chunks(rows):
+            db.session.execute(tags.insert().values(chunk))
+        db.session.commit()
+        db.session.expire(self, ['tags', 'tag_links'])
+        response_cache.invalidate("notes")
+        return sorted(tag_ids - known)
+
+    def remove_tags(self, tag_ids):
+        """
+        Отвязывает теги DELETE порциями по TAGS_INSERT_CHUNK. Возвращает id, которых нет среди тегов
+        """
+        tag_ids = set(tag_ids)
+        known = self._known_tag_ids(tag_ids)
+        for chunk in self._chunks(sorted(known)):
+            db.session.execute(tags.delete().where(
+                (tags.c.note_model_id == self.id) & tags.c.tag_id.in_(chunk)))
+        db.session.commit()
+        db.session.expire(self, ['tags', 'tag_links'])
+        response_cache.invalidate("notes")
+        return sorted(tag_ids - known)
+
+    @staticmethod
+    def bulk_create(rows):
+        """
+        Вставляет заметки из словарей rows без ORM-объектов; id проставляются в rows.
+        Коммит - на вызывающей стороне
+        """
+        db.session.bulk_insert_mappings(NoteModel, rows, return_defaults=True)
+
+    @staticmethod
+    def bulk_delete(note_ids):
+        """
+        Удаляет заметки note_ids двумя DELETE: сначала связи с тегами, потом сами заметки
+        """
+        if not note_ids:
+            return
+        db.session.execute(tags.delete().where(tags.c.note_model_id.in_(note_ids)))
+        db.session.execute(NoteModel.__table__.delete().where(NoteModel.id.in_(note_ids)))
+
+    @classmethod
+    def _chunks(cls, items):
+        for start in range(0, len(items), cls.TAGS_INSERT_CHUNK):
+            yield items[start:start + cls.TAGS_INSERT_CHUNK]
+
+    @staticmethod
+    def _known_tag_ids(tag_ids):
+        if not tag_ids:
+            return set()
+        return tag_registry.known(tag_ids)
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        response_cache.invalidate("notes")
+
+
+def filter_by_tags(query, tags_all=(), tags_any=(), tags_none=()):
+    """
+    Ограничивает query заметками, у которых есть все теги tags_all, хотя бы один из tags_any
+    и нет ни одного из tags_none: один JOIN с tags и GROUP BY/HAVING по заметке
+    """
+    tags_all, tags_any, tags_none = set(tags_all), set(tags_any), set(tags_none)
+    wanted = tags_all | tags_any | tags_none
+    if not wanted:
+        return query
+
+    def matched(tag_ids):
+        return func.sum(case([(tags.c.tag_id.in_(tag_ids), 1)], else_=0))
+
+    conditions = []
+    if tags_all:
+        conditions.append(matched(tags_all) == len(tags_all))
+    if tags_any:
+        conditions.append(matched(tags_any) > 0)
+    if tags_none:
+        conditions.append(matched(tags_none) == 0)
+    # без tags_all/tags_any подходят и заметки совсем без тегов - нужен LEFT JOIN
+    return query.join(tags, and_(tags.c.note_model_id == NoteModel.id, tags.c.tag_id.in_(wanted)),
+                      isouter=not (tags_all or tags_any)) \
+        .group_by(NoteModel.id).having(and_(*conditions))
+
+
+# Индексы под запросы заметок (проверка: flask db-explain):
+# заметки автора по возрастанию id (архив, удаление пользователя)
+db.Index('ix_note_model_author_id_id', NoteModel.author_id, NoteModel.id)
+# активные заметки автора (NotesListResource): архивные в частичный индекс не попадают
+db.Index('ix_note_model_active_author_id_id', NoteModel.author_id, NoteModel.id,
+         sqlite_where=NoteModel.archive == expression.false(),
+         postgresql_where=NoteModel.archive == expression.false())
+# публичные активные заметки автора (NoteFilterResource)
+db.Index('ix_note_model_public_author_id_id', NoteModel.author_id, NoteModel.id,
+         sqlite_where=(NoteModel.private == expression.false()) & (NoteModel.archive == expression.false()),
+         postgresql_where=(NoteModel.private == expression.false()) & (NoteModel.archive == expression.false()))
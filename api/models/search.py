@@ -0,0 +1,275 @@
+import bisect
+import heapq
+import re
+import threading
+import time
+from collections import defaultdict
+from api import db, Config
+from api.models.note import NoteModel
+from api.models.user import UserModel
+from sqlalchemy import DDL, event, func, literal_column, table, column, text
+from sqlalchemy.orm import object_session
+
+# Полнотекстовый индекс по NoteModel.text.
+# SQLite: external content таблица FTS5 note_fts, синхронизируется триггерами на note_model.
+# Postgres: GIN-индекс по выражению to_tsvector(...), синхронизируется самим Postgres.
+# Триггеры и индекс работают для любых изменений заметок, включая bulk-операции.
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5(text, content='note_model', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS note_fts_ai AFTER INSERT ON note_model BEGIN "
+    "INSERT INTO note_fts(rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS note_fts_ad AFTER DELETE ON note_model BEGIN "
+    "INSERT INTO note_fts(note_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS note_fts_au AFTER UPDATE OF text ON note_model BEGIN "
+    "INSERT INTO note_fts(note_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO note_fts(rowid, text) VALUES (new.id, new.text); END",
+]
+SQLITE_DROP_DDL = ["DROP TABLE IF EXISTS note_fts"]
+POSTGRES_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_note_model_text_tsv ON note_model "
+    f"USING gin (to_tsvector('{Config.SEARCH_TS_CONFIG}', text))",
+]
+
+for statement in SQLITE_DDL:
+    event.listen(NoteModel.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+for statement in SQLITE_DROP_DDL:
+    event.listen(NoteModel.__table__, 'before_drop', DDL(statement).execute_if(dialect='sqlite'))
+for statement in POSTGRES_DDL:
+    event.listen(NoteModel.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+note_fts = table('note_fts', column('rowid'), column('rank'))
+
+
+def escape_like(value):
+    """
+    Экранирует спецсимволы LIKE в пользовательском вводе (для ilike(..., escape='\\'))
+    """
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_notes(query, words):
+    """
+    Ограничивает query заметками, содержащими все слова words, и сортирует по релевантности
+    """
+    if db.engine.dialect.name == 'sqlite':
+        # каждое слово в кавычках, чтобы пользовательский ввод не разбирался как синтаксис FTS5
+        match = " ".join('"{}"'.format(word.replace('"', '""')) for word in words)
+        return query.join(note_fts, note_fts.c.rowid == NoteModel.id) \
+            .filter(text("note_fts MATCH :match").bindparams(match=match)) \
+            .order_by(note_fts.c.rank, NoteModel.id)
+    if db.engine.dialect.name == 'postgresql':
+        vector = func.to_tsvector(literal_column(f"'{Config.SEARCH_TS_CONFIG}'"), NoteModel.text)
+        ts_query = func.plainto_tsquery(literal_column(f"'{Config.SEARCH_TS_CONFIG}'"), " ".join(words))
+        return query.filter(vector.op('@@')(ts_query)) \
+            .order_by(func.ts_rank(vector, ts_query).desc(), NoteModel.id)
+    # прочие СУБД: без индекса, поиск подстрок
+    for word in words:
+        query = query.filter(NoteModel.text.ilike(f"%{escape_like(word)}%", escape='\\'))
+    return query.order_by(NoteModel.id)
+
+
+def split_words(search_string):
+    return re.findall(r"\w+", search_string)
+
+
+class TrigramIndex:
+    """
+    Индекс имен пользователей в памяти процесса: триграмма --> множество id.
+
+    Поиск подстроки пересекает множества триграмм запроса и проверяет кандидатов,
+    поиск префикса идет бинарным поиском по отсортированному списку имен.
+    Используется на СУБД без pg_trgm (SQLite); обновляется событиями UserModel
+    после коммита и полностью перечитывается из БД раз в ttl секунд,
+    чтобы увидеть изменения из других воркеров.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._reload_lock = threading.Lock()  # перечитывает один поток, поиск его не ждет
+        self._changes = None  # изменения, пришедшие во время перечитывания: (id, имя или None)
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._names = {}  # id --> имя в нижнем регистре
+            self._postings = defaultdict(set)  # триграмма --> id
+            self._short = set()  # id имен короче трех символов
+            self._sorted = []  # (имя, id) по возрастанию
+            self.loaded_at = None
+
+    @staticmethod
+    def trigrams(name):
+        return {name[i:i + 3] for i in range(len(name) - 2)}
+
+    def ensure_loaded(self, rows_loader):
+        """
+        Перечитывает индекс, если он устарел. Запрос к БД и построение идут без блокировки -
+        поиск в это время работает по старому индексу; под блокировкой только подмена структур
+        """
+        if self._fresh():
+            return
+        with self._reload_lock:
+            with self._lock:
+                if self._fresh():  # перечитал другой поток, пока ждали
+                    return
+                self._changes = []
+            try:
+                rows = rows_loader()
+                names, postings, short = {}, defaultdict(set), set()
+                for user_id, username in rows:
+                    if username is None:
+                        continue
+                    name = names[user_id] = username.lower()
+                    grams = self.trigrams(name)
+                    for gram in grams:
+                        postings[gram].add(user_id)
+                    if not grams:
+                        short.add(user_id)
+                ordered = sorted((name, user_id) for user_id, name in names.items())
+            except BaseException:
+                with self._lock:
+                    self._changes = None
+                raise
+            with self._lock:
+                changes, self._changes = self._changes, None
+                self._names, self._postings, self._short, self._sorted = names, postings, short, ordered
+                self.loaded_at = time.monotonic()
+                # строки могли быть прочитаны до этих изменений
+                for user_id, username in changes:
+                    self._remove(user_id)
+                    self._add(user_id, username)
+
+    def _fresh(self):
+        with self._lock:
+            return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    def add(self, user_id, username):
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((user_id, username))
+            if self.loaded_at is not None:
+                self._remove(user_id)
+                self._add(user_id, username)
+
+    def remove(self, user_id):
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((user_id, None))
+            if self.loaded_at is not None:
+                self._remove(user_id)
+
+    def _add(self, user_id, username):
+        if username is None:
+            return
+        name = username.lower()
+        self._names[user_id] = name
+        grams = self.trigrams(name)
+        for gram in grams:
+            self._postings[gram].add(user_id)
+        if not grams:
+            self._short.add(user_id)
+        bisect.insort(self._sorted, (name, user_id))
+
+    def _remove(self, user_id):
+        name = self._names.pop(user_id, None)
+        if name is None:
+            return
+        for gram in self.trigrams(name):
+            self._postings[gram].discard(user_id)
+            if not self._postings[gram]:
+                del self._postings[gram]
+        self._short.discard(user_id)
+        index = bisect.bisect_left(self._sorted, (name, user_id))
+        if index < len(self._sorted) and self._sorted[index] == (name, user_id):
+            del self._sorted[index]
+
+    def search_substring(self, query, limit):
+        query = query.lower()
+        with self._lock:
+            grams = self.trigrams(query)
+            if grams:
+                postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+                candidates = set.intersection(*postings)
+            else:
+                # короткий запрос: объединяем триграммы, которые его содержат
+                candidates = set(self._short)
+                for gram, ids in self._postings.items():
+                    if query in gram:
+                        candidates |= ids
+            matches = ((self._names[user_id], user_id) for user_id in candidates
+                       if query in self._names[user_id])
+            return [user_id for name, user_id in heapq.nsmallest(limit, matches)]
+
+    def search_prefix(self, query, limit):
+        query = query.lower()
+        with self._lock:
+            start = bisect.bisect_left(self._sorted, (query,))
+            result = []
+            for name, user_id in self._sorted[start:start + limit]:
+                if not name.startswith(query):
+                    break
+                result.append(user_id)
+            return result
+
+
+username_index = TrigramIndex(ttl=Config.USER_SEARCH_INDEX_TTL)
+
+POSTGRES_USER_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_user_model_username_trgm ON user_model USING gin (username gin_trgm_ops)",
+]
+for statement in POSTGRES_USER_DDL:
+    event.listen(UserModel.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+event.listen(UserModel.__table__, 'after_drop', lambda *args, **kwargs: username_index.clear())
+
+
+# Изменения имен копятся в session.info и применяются к индексу только после коммита
+@event.listens_for(UserModel, 'after_insert')
+@event.listens_for(UserModel, 'after_update')
+def _remember_username(mapper, connection, target):
+    session = object_session(target)
+    session.info.setdefault('username_index', []).append((target.id, target.username))
+
+
+@event.listens_for(UserModel, 'after_delete')
+def _remember_deleted_user(mapper, connection, target):
+    session = object_session(target)
+    session.info.setdefault('username_index', []).append((target.id, None))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_username_changes(session):
+    for user_id, username in session.info.pop('username_index', []):
+        if username is None:
+            username_index.remove(user_id)
+        else:
+            username_index.add(user_id, username)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_username_changes(session):
+    session.info.pop('username_index', None)
+
+
+def search_users(query, prefix, limit):
+    """
+    До limit пользователей, имя которых содержит query (или начинается с query при prefix),
+    упорядоченных по имени
+    """
+    if db.engine.dialect.name == 'postgresql':
+        # ILIKE по подстроке использует GIN-индекс pg_trgm, по префиксу - его же
+        escaped = escape_like(query)
+        pattern = f"{escaped}%" if prefix else f"%{escaped}%"
+        return UserModel.query.filter(UserModel.username.ilike(pattern, escape='\\')) \
+            .order_by(UserModel.username).limit(limit).all()
+    username_index.ensure_loaded(lambda: db.session.query(UserModel.id, UserModel.username).all())
+    if prefix:
+        ids = username_index.search_prefix(query, limit)
+    else:
+        ids = username_index.search_substring(query, limit)
+    if not ids:
+        return []
+    users = {user.id: user for user in UserModel.query.filter(UserModel.id.in_(ids))}
+    return [users[user_id] for user_id in ids if user_id in users]
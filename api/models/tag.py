@@ -1,4 +1,6 @@
-from api import db
+from api import db, response_cache
+from helpers.tag_registry import TagRegistry
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError
 
 # class BaseModel(db.Model):
@@ -13,6 +15,8 @@ class TagModel(db.Model):
    __tablename__ = 'tag'
    id = db.Column(db.Integer, primary_key=True)
    name = db.Column(db.String(64), unique=True, nullable=False)
+   # число публичных неархивных заметок с тегом, ведется триггерами на tags и note_model (api.models.note)
+   notes_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
    def save(self):
       try:
@@ -20,7 +24,61 @@ class TagModel(db.Model):
          db.session.commit()
       except IntegrityError:  # Обработка ошибки "создание пользователя с НЕ уникальным именем"
          db.session.rollback()
+      response_cache.invalidate("tags")
 
    def delete(self):
       db.session.delete(self)
-      db.session.commit()
\ No newline at end of file
+      db.session.commit()
+      response_cache.invalidate("tags")
+
+
+class RegistryVersionModel(db.Model):
+   """
+   Версии реестров в памяти процессов (helpers.tag_registry): name --> version
+   """
+   __tablename__ = 'registry_version'
+   name = db.Column(db.String(64), primary_key=True)
+   version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+   @staticmethod
+   def get(name):
+      table = RegistryVersionModel.__table__
+      return primary_connection().execute(db.select([table.c.version]).where(table.c.name == name)).scalar() or 0
+
+   @staticmethod
+   def bump(connection, name):
+      """
+      Увеличивает версию в текущей транзакции connection
+      """
+      table = RegistryVersionModel.__table__
+      updated = connection.execute(table.update().where(table.c.name == name)
+                                   .values(version=table.c.version + 1)).rowcount
+      if not updated:
+         connection.execute(table.insert().values(name=name, version=1))
+
+
+def primary_connection():
+   """
+   Соединение сессии с основной БД, даже в GET-запросе: версия и теги реестра читаются только
+   оттуда, иначе реплики с разным отставанием давали бы разные версии и лишние перечитывания
+   """
+   return db.session.connection(bind=db.engine)
+
+
+tag_registry = TagRegistry(lambda: RegistryVersionModel.get("tags"),
+                           lambda: primary_connection().execute(
+                              db.select([TagModel.__table__.c.id, TagModel.__table__.c.name])).fetchall())
+
+
+# любое изменение тегов через ORM (в том числе каскадное удаление) увеличивает версию реестра
+@event.listens_for(TagModel, 'after_insert')
+@event.listens_for(TagModel, 'after_update')
+@event.listens_for(TagModel, 'after_delete')
+def bump_tag_registry(mapper, connection, target):
+   RegistryVersionModel.bump(connection, "tags")
+   tag_registry.invalidate()
+
+
+@event.listens_for(db.metadata, 'after_drop')
+def invalidate_tag_registry(*args, **kwargs):
+   tag_registry.invalidate()
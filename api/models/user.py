@@ -1,4 +1,6 @@
-from api import db, Config, ma, auth
+import time
+from api import db, Config, ma, auth, abort, credential_cache, token_revocations, response_cache
+from flask import current_app
 from passlib.apps import custom_app_context as pwd_context
 from itsdangerous import (TimedJSONWebSignatureSerializer
                           as Serializer, BadSignature, SignatureExpired)
@@ -21,6 +23,8 @@ class UserModel(db.Model):
 
     def hash_password(self, password):
         self.password_hash = pwd_context.hash(password)
+        if self.username:
+            credential_cache.invalidate(self.username)
 
     def verify_password(self, password):
         return pwd_context.verify(password, self.password_hash)
@@ -29,20 +33,30 @@ class UserModel(db.Model):
     def get_roles(self):
         return self.role
 
-    def generate_auth_token(self, expiration=600):
+    def generate_auth_token(self, expiration=Config.AUTH_TOKEN_EXPIRATION):
         s = Serializer(Config.SECRET_KEY, expires_in=expiration)
-        return s.dumps({'id': self.id})
+        # claims нужны для проверки токена без обращения к БД (AUTH_TOKEN_STATELESS)
+        return s.dumps({'id': self.id, 'username': self.username, 'role': self.role, 'iat': time.time()})
 
     def save(self):
+        # смена пароля, роли или имени отзывает ранее выданные токены
+        state = db.inspect(self)
+        if self.id and any(state.attrs[name].history.has_changes()
+                           for name in ('password_hash', 'role', 'username')):
+            token_revocations.revoke(self.id)
         try:
             db.session.add(self)
             db.session.commit()
         except IntegrityError:  # Обработка ошибки "создание пользователя с НЕ уникальным именем"
             db.session.rollback()
+        response_cache.invalidate("users")
 
     def delete(self):
+        token_revocations.revoke(self.id)
         db.session.delete(self)
         db.session.commit()
+        credential_cache.invalidate(self.username)
+        response_cache.invalidate("users", "notes")
 
     @staticmethod
     def verify_auth_token(token):
@@ -53,5 +67,51 @@ class UserModel(db.Model):
             return None  # valid token, but expired
         except BadSignature:
             return None  # invalid token
+        if current_app.config['AUTH_TOKEN_STATELESS'] and 'role' in data:
+            if token_revocations.is_revoked(data['id'], data.get('iat', 0)):
+                return None
+            return TokenUser(data)
         user = UserModel.query.get(data['id'])
         return user
+
+
+class TokenUser:
+    """
+    Пользователь, восстановленный из claims токена.
+
+    id, username и role берутся из токена; строка UserModel загружается из БД
+    только при обращении к остальным атрибутам (например, g.user.notes).
+    """
+
+    def __init__(self, claims):
+        self.id = claims['id']
+        self.username = claims['username']
+        self.role = claims['role']
+        self._user = None
+
+    @property
+    def instance(self):
+        if self._user is None:
+            self._user = UserModel.query.get(self.id)
+            if self._user is None:
+                abort(401, error="User not found")
+        return self._user
+
+    def get_roles(self):
+        return self.role
+
+    def generate_auth_token(self, expiration=Config.AUTH_TOKEN_EXPIRATION):
+        return UserModel.generate_auth_token(self, expiration)
+
+    def __getattr__(self, name):
+        # вызывается только для атрибутов, которых нет в claims
+        return getattr(self.instance, name)
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.id)
@@ -0,0 +1,64 @@
+from api import db, response_cache, token_revocations
+from api.models.archive import NoteArchiveModel
+from api.models.blob import release_refs
+from api.models.job import task
+from api.models.note import NoteModel
+from api.models.user import UserModel
+from flask import current_app
+
+
+def delete_user(user_id, chunk_size=None, progress=None):
+    """
+    Удаляет пользователя и его заметки порциями по chunk_size заметок, каждая в своей транзакции:
+    ссылки на файлы, связи с тегами, затем сами заметки - set-based DELETE без загрузки объектов.
+    Сами теги не удаляются: они общие для заметок разных пользователей.
+
+    progress(deleted, total) вызывается перед коммитом каждой порции.
+    Возвращает число удаленных заметок или None, если пользователя нет
+    (в том числе если его удалили параллельно, пока удалялись заметки).
+    """
+    chunk_size = chunk_size or current_app.config['USER_DELETE_CHUNK_SIZE']
+    user = UserModel.query.get(user_id)
+    if user is None:
+        return None
+    token_revocations.revoke(user_id)  # пока идет удаление, пользователь не может войти по токену
+    notes = db.session.query(NoteModel.id).filter(NoteModel.author_id == user_id)
+    total = notes.count()
+    deleted = 0
+    while True:
+        note_ids = [note_id for (note_id,) in notes.order_by(NoteModel.id).limit(chunk_size)]
+        if not note_ids:
+            break
+        release_refs(db.session.connection(), 'note_id', note_ids)
+        NoteModel.bulk_delete(note_ids)
+        deleted += len(note_ids)
+        if progress is not None:
+            progress(deleted, max(total, deleted))
+        db.session.commit()
+        response_cache.invalidate("notes")
+    archived = db.session.query(NoteArchiveModel.id).filter(NoteArchiveModel.author_id == user_id)
+    while True:
+        note_ids = [note_id for (note_id,) in archived.order_by(NoteArchiveModel.id).limit(chunk_size)]
+        if not note_ids:
+            break
+        NoteArchiveModel.bulk_delete(note_ids)
+        db.session.commit()
+    user = UserModel.query.get(user_id)
+    if user is None:  # пользователя удалил параллельный запрос
+        return None
+    # заметок не осталось, каскад UserModel.notes ничего не загружает
+    user.delete()
+    return deleted
+
+
+def count_notes(user_id):
+    return db.session.query(NoteModel.id).filter(NoteModel.author_id == user_id).count()
+
+
+@task("users.delete")
+def delete_user_task(job, user_id):
+    def progress(deleted, total):
+        job.set_progress({"deleted_notes": deleted, "total_notes": total})
+
+    deleted = delete_user(user_id, progress=progress)
+    return {"deleted": deleted is not None, "deleted_notes": deleted or 0}
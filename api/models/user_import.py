@@ -0,0 +1,172 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from api import db, response_cache
+from api.models.job import task
+from api.models.search import username_index
+from api.models.user import UserModel, pwd_context
+from api.schemas.user import UserRequestSchema
+from flask import current_app
+from marshmallow import ValidationError
+from sqlalchemy.exc import IntegrityError
+
+# имен в одном IN (...): SQLite ограничивает число параметров запроса
+LOOKUP_CHUNK = 400
+
+
+def _hash_password(password):
+    # выполняется в процессе пула
+    return pwd_context.hash(password)
+
+
+def _map(executor, passwords, workers):
+    return list(executor.map(_hash_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    Хэширует пароли в пуле из workers процессов, созданном на время вызова (flask users import);
+    при одном процессе или одном пароле - в текущем
+    """
+    workers = workers or current_app.config['USER_IMPORT_WORKERS']
+    if workers <= 1 or len(passwords) <= 1:
+        return [_hash_password(password) for password in passwords]
+    with ProcessPoolExecutor(max_workers=min(workers, len(passwords))) as executor:
+        return _map(executor, passwords, workers)
+
+
+class PasswordHasher:
+    """
+    Хэширование паролей для /users/bulk в пуле из USER_BULK_WORKERS процессов, общем для всех
+    запросов воркера: пул создается при первом запросе, а не на каждый. Процессы пула выполняют
+    только _hash_password и не трогают унаследованные от воркера соединения с БД.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self, config):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=config['USER_BULK_WORKERS'])
+            return self._executor
+
+    def hash(self, passwords):
+        workers = current_app.config['USER_BULK_WORKERS']
+        if workers <= 1 or len(passwords) <= 1:
+            return [_hash_password(password) for password in passwords]
+        return _map(self._pool(current_app.config), passwords, workers)
+
+
+password_hasher = PasswordHasher()
+
+
+def existing_usernames(usernames):
+    usernames = list(usernames)
+    existing = set()
+    for start in range(0, len(usernames), LOOKUP_CHUNK):
+        existing.update(username for (username,) in db.session.query(UserModel.username)
+                        .filter(UserModel.username.in_(usernames[start:start + LOOKUP_CHUNK])))
+    return existing
+
+
+def import_users(rows, batch_size=None, workers=None, hasher=None, progress=None):
+    """
+    Создает пользователей из словарей rows (username, password, role).
+
+    Занятые имена и повторы внутри rows отсеиваются до хэширования запросом по всем именам,
+    пароли остальных хэшируются в пуле процессов: общем hasher (PasswordHasher), если он задан,
+    иначе - в пуле из workers процессов на время вызова. Строки вставляются порциями по batch_size,
+    каждая в своей транзакции; progress(inserted, total) вызывается перед коммитом каждой порции.
+    Возвращает результат по каждой строке в порядке rows:
+    {"username", "status": 201 | 409 | 422, "id" или "error"/"errors"}.
+    """
+    batch_size = batch_size or current_app.config['USER_IMPORT_BATCH_SIZE']
+    schema = UserRequestSchema()
+    results = []
+    valid = []  # (результат, данные)
+    for row in rows:
+        result = {"username": row.get("username") if isinstance(row, dict) else None}
+        results.append(result)
+        try:
+            data = schema.load(row)
+        except ValidationError as err:
+            result.update(status=422, errors=err.messages)
+            continue
+        valid.append((result, data))
+
+    taken = existing_usernames({data["username"] for result, data in valid})
+    new = []
+    for result, data in valid:
+        if data["username"] in taken:
+            _conflict(result, data["username"])
+            continue
+        taken.add(data["username"])
+        new.append((result, data))
+
+    passwords = [data["password"] for result, data in new]
+    password_hashes = hasher.hash(passwords) if hasher else hash_passwords(passwords, workers)
+    for start in range(0, len(new), batch_size):
+        batch = [(result, {"username": data["username"], "password_hash": password_hash,
+                           "role": data.get("role") or "simple_user"})
+                 for (result, data), password_hash in zip(new[start:start + batch_size],
+                                                          password_hashes[start:start + batch_size])]
+        if progress is not None:
+            progress(start + len(batch), len(new))
+        _insert_batch(batch)
+    response_cache.invalidate("users")
+    return results
+
+
+def _insert_batch(batch):
+    try:
+        _insert_rows(batch)
+    except IntegrityError:  # имя заняли после проверки - проверяем порцию еще раз
+        db.session.rollback()
+        taken = existing_usernames(values["username"] for result, values in batch)
+        for result, values in batch:
+            if values["username"] in taken:
+                _conflict(result, values["username"])
+        rest = [(result, values) for result, values in batch if values["username"] not in taken]
+        try:
+            _insert_rows(rest)
+        except IntegrityError:  # имя снова заняли параллельно - вставляем по одному
+            db.session.rollback()
+            for result, values in rest:
+                try:
+                    _insert_rows([(result, values)])
+                except IntegrityError:
+                    db.session.rollback()
+                    _conflict(result, values["username"])
+
+
+def _conflict(result, username):
+    result.update(status=409, error=f"User with username:{username} already exist")
+
+
+def _insert_rows(batch):
+    if not batch:
+        return
+    table = UserModel.__table__
+    for start in range(0, len(batch), LOOKUP_CHUNK):
+        db.session.execute(table.insert().values([values for result, values in batch[start:start + LOOKUP_CHUNK]]))
+    ids = {}
+    usernames = [values["username"] for result, values in batch]
+    for start in range(0, len(usernames), LOOKUP_CHUNK):
+        ids.update(db.session.query(UserModel.username, UserModel.id)
+                   .filter(UserModel.username.in_(usernames[start:start + LOOKUP_CHUNK])))
+    db.session.commit()
+    for result, values in batch:
+        result.update(status=201, id=ids[values["username"]])
+        # вставка в обход ORM - события UserModel не срабатывают
+        username_index.add(ids[values["username"]], values["username"])
+
+
+@task("users.import")
+def import_users_task(job, users):
+    def progress(inserted, total):
+        job.set_progress({"inserted": inserted, "total": total})
+
+    results = import_users(users, progress=progress)
+    job.payload = '{}'  # пароли в открытом виде не храним дольше, чем нужно
+    return {"created": sum(result["status"] == 201 for result in results), "results": results}
@@ -1,4 +1,4 @@
-from api import Resource, g, auth
+from api import Resource, g, auth, credential_cache
 
 
 class TokenResource(Resource):
@@ -6,3 +6,9 @@ class TokenResource(Resource):
     def get(self):
         token = g.user.generate_auth_token()
         return {'token': token.decode('ascii')}
+
+
+class AuthCacheResource(Resource):
+    @auth.login_required(role="admin")
+    def get(self):
+        return credential_cache.stats()
@@ -1,9 +1,13 @@
 import os
 from config import Config, ma_plugin
-from api import api
+from api import api, abort, auth, g, derivatives
+from api.models.blob import BlobModel
+from api.models.note import NoteModel
+from flask import request, url_for
 from flask_apispec.views import MethodResource
 from flask_apispec import marshal_with, doc, use_kwargs
 from marshmallow import fields
+from helpers.uploads import receive_stream, store_blob, UploadTooLarge
 
 
 @ma_plugin.map_to_openapi_type('file', None)
@@ -13,13 +17,91 @@ class FileField(fields.Raw):
 @api.resource('/upload') #PUT
 @doc(tags=['Files'])
 class UploadPictureResource(MethodResource):
-    @use_kwargs({"image": FileField(required=True)}, location="files")
-    def put(self, **kwargs):
-        uploaded_file = kwargs["image"]
-        if Config.UPLOAD_FOLDER:
-            target = os.path.join(Config.UPLOAD_FOLDER, uploaded_file.filename)
+    @auth.login_required(optional=True)
+    @doc(security=[{"basicAuth": []}])
+    @doc(description="multipart/form-data with an image field, or a raw application/octet-stream body "
+                     "which is streamed to disk without buffering. Files are stored once per content "
+                     "and served at a stable /uploads/<sha256> URL. The upload is linked to the "
+                     "authenticated user and, with note_id, to the user's note.")
+    @doc(responses={403: {"description": "Forbidden for this User"}})
+    @doc(responses={413: {"description": "File is too large"}})
+    @use_kwargs({"image": FileField()}, location="files")
+    @use_kwargs({"note_id": fields.Int()}, location="query")
+    def put(self, image=None, note_id=None):
+        user = g.get("user")
+        if note_id is not None:
+            note = NoteModel.query.get(note_id)
+            if note is None:
+                abort(404, error=f"Note with id={note_id} not found")
+            if user is None or note.author_id != user.id:
+                abort(403, error="Forbidden for this User")
+        if request.max_content_length and (request.content_length or 0) > request.max_content_length:
+            abort(413, error="File is too large")
+        if image is not None:
+            stream, mimetype = image.stream, image.mimetype
+        elif request.mimetype == 'application/octet-stream':
+            stream, mimetype = request.stream, None
         else:
-            pass #TODO: Make folder automaticaly
-        uploaded_file.save(target)
+            abort(422, error="image file or application/octet-stream body is required")
+        try:
+            temp_path, sha256, size = receive_stream(stream)
+        except UploadTooLarge:
+            abort(413, error="File is too large")
+        try:
+            blob = BlobModel.get_or_create(sha256, size, mimetype)
+            # анонимная загрузка получает вечную ссылку без владельца, иначе ее файл удалил бы blobs-gc
+            blob.add_ref(user_id=user.id if user else None, note_id=note_id)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        # файл кладется только после коммита ссылки: если blobs-gc успел удалить прежний blob,
+        # его файла уже нет и на место встанет временный (см. BlobModel.collect_garbage)
+        store_blob(temp_path, sha256)
         return {"msg": "uploaded image successfully",
-                "url": os.path.join(Config.UPLOAD_FOLDER_NAME, uploaded_file.filename)}, 200
+                "url": url_for('download_file', filename=sha256),
+                "sha256": sha256,
+                "size": size,
+                "derivatives": {"status": derivatives.submit(sha256, blob.mimetype),
+                                "job": url_for('uploadjobresource', sha256=sha256)}}, 200
+
+
+@api.resource('/upload/jobs/<sha256>') #GET, POST
+@doc(tags=['Files'])
+class UploadJobResource(MethodResource):
+    @doc(summary="Status of resized variants generation for an uploaded file")
+    @doc(description="status: queued, running, done or failed. Variants are served at "
+                     "/uploads/<sha256>?variant=<name> once done.")
+    @doc(responses={404: {"description": "No job for this file"}})
+    def get(self, sha256):
+        status = derivatives.status(sha256)
+        if status is None:
+            abort(404, error=f"No job for {sha256}")
+        return self._job(sha256, status), 200
+
+    @doc(summary="Queue resized variants generation for an uploaded file")
+    @doc(responses={202: {"description": "Job queued"}})
+    @doc(responses={404: {"description": "File not found"}})
+    @doc(responses={422: {"description": "File is not an image"}})
+    @doc(responses={503: {"description": "Too many pending jobs, retry later"}})
+    def post(self, sha256):
+        blob = BlobModel.query.get(sha256)
+        if blob is None:
+            abort(404, error=f"File {sha256} not found")
+        status = derivatives.submit(sha256, blob.mimetype)
+        if status == "unsupported":
+            abort(422, error=f"File {sha256} is not an image")
+        if status == "rejected":
+            return {"error": "Too many pending jobs, retry later"}, 503, {"Retry-After": "5"}
+        if status == "unavailable":
+            abort(501, error="Image variants are not available")
+        return self._job(sha256, derivatives.status(sha256) or {"status": status, "error": None}), 202
+
+    @staticmethod
+    def _job(sha256, status):
+        job = {"sha256": sha256, "status": status["status"]}
+        if status["error"]:
+            job["error"] = status["error"]
+        if status["status"] == "done":
+            job["variants"] = {variant: url_for('download_file', filename=sha256, variant=variant)
+                               for variant in Config.IMAGE_VARIANTS}
+        return job
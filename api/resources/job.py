@@ -0,0 +1,31 @@
+from api import abort, auth, g
+from api.models.job import JobModel
+from api.schemas.job import JobSchema, job_schema
+from flask import url_for
+from flask_apispec.views import MethodResource
+from flask_apispec import marshal_with, doc
+
+
+def accepted(job):
+    """
+    Ответ 202 на поставленную в очередь задачу: ресурс задачи и Location для опроса статуса
+    """
+    return job_schema.dump(job), 202, {"Location": url_for('jobresource', job_id=job.id)}
+
+
+@doc(description='Background jobs.', tags=['Jobs'])
+class JobResource(MethodResource):
+    @auth.login_required
+    @doc(security=[{"basicAuth": []}])
+    @doc(summary="Get background job status",
+         description="status: queued, running, done or failed; result is set when the job is done")
+    @doc(responses={403: {"description": "Forbidden for this User"}})
+    @doc(responses={404: {"description": "Job not found"}})
+    @marshal_with(JobSchema, code=200)
+    def get(self, job_id):
+        job = JobModel.query.get(job_id)
+        if job is None:
+            abort(404, error=f"Job with id={job_id} not found")
+        if job.user_id != g.user.id and g.user.role != "admin":
+            abort(403, error="Forbidden for this User")
+        return job, 200
@@ -0,0 +1,8 @@
+from api import Resource, auth, db
+from helpers.database import pool_stats
+
+
+class PoolMetricsResource(Resource):
+    @auth.login_required(role="admin")
+    def get(self):
+        return pool_stats(db.engine)
@@ -1,12 +1,25 @@
-from api import auth, abort, g, Resource, reqparse, api
-from api.models.note import NoteModel
+from api import auth, abort, g, Resource, reqparse, api, db, response_cache
+from api.models.note import NoteModel, filter_by_tags
+from api.models.archive import NoteArchiveModel
+from api.models.user import UserModel
 from api.models.tag import TagModel
-from api.schemas.note import NoteSchema, NoteRequestSchema, NoteEditSchema, note_schema, notes_schema
+from api.models.search import search_notes, split_words
+from api.models.blob import release_refs
+from api.schemas.note import NoteSchema, NoteRequestSchema, NoteEditSchema, NotesPageSchema, NoteTagsSchema, \
+    NoteBatchRequestSchema, NoteBatchResultSchema, note_schema, notes_schema
 from webargs import fields
 from flask_apispec import marshal_with, use_kwargs, doc
 from flask_apispec.views import MethodResource
 from helpers.shortcuts import get_or_404
+from helpers.pagination import paginate, pagination_args, paginate_offset, offset_pagination_args
+from helpers.loading import load_for
+from helpers.serialization import fast_response
+from helpers.response_cache import cached_resource
+from flask import current_app
 from flask_babel import _
+from sqlalchemy import false
+from sqlalchemy.orm import selectinload
+from marshmallow import ValidationError
 
 @doc(description="API for Notes", tags=["Notes"])
 class NoteResource(MethodResource):
@@ -26,7 +39,7 @@ class NoteResource(MethodResource):
         if not note:
             # abort(404, error=f"Note with id={note_id} not found")
             abort(404, error=_("Note with id=%(note_id)s not found", note_id=note_id))
-        if note.author.id != author.id:
+        if note.author_id != author.id:
             abort(403, error="Forbidden for this User")
         return note, 200
 
@@ -45,7 +58,7 @@ class NoteResource(MethodResource):
         note = NoteModel.query.get(note_id)
         if note is None:
             abort(404, error=f"Note with id={note_id} not found")
-        if note.author != author:
+        if note.author_id != author.id:
             abort(403, error=f"Forbidden for this User")
         note.text = kwargs.get("text") or note.text
         note.private = kwargs.get("private") or note.private
@@ -65,21 +78,40 @@ class NoteResource(MethodResource):
         note = NoteModel.query.get(note_id)
         if note is None:
             abort(404, error=f"Note with id={note_id} not found")
-        if author.id != note.author.id:
+        if author.id != note.author_id:
             abort(403, error="Forbidden for this User")
         note.delete()
         return "Note was deleted", 200
 
+# Фильтр заметок по тегам: id через запятую
+tag_filter_args = {
+    name: fields.DelimitedList(fields.Int(), load_default=list, metadata={"description": description})
+    for name, description in (("tags_all", "Notes having all of these tags"),
+                              ("tags_any", "Notes having at least one of these tags"),
+                              ("tags_none", "Notes having none of these tags"))
+}
+
+
 @doc(description="API for Notes", tags=["Notes"])
 class NotesListResource(MethodResource):
 
     @auth.login_required()
     @doc(security=[{"basicAuth": []}])
-    @doc(summary="Get all Users notes")
-    @marshal_with(NoteSchema(many=True), code=200)
-    def get(self):
-        notes = g.user.notes
-        return notes, 200
+    @doc(summary="Get all Users notes",
+         description="Archived notes are listed at /notes/archive. Keyset pagination: follow _links.next. "
+                     "Tag filters take comma-separated tag ids: tags_all=1,2&tags_any=3&tags_none=4. "
+                     "With include_public=true public notes of other users are listed too.")
+    @marshal_with(NotesPageSchema, code=200)
+    @use_kwargs({**tag_filter_args, "include_public": fields.Bool(load_default=False), **pagination_args},
+                location=('query'))
+    def get(self, limit, include_public, tags_all, tags_any, tags_none, after=None):
+        notes = NoteModel.query.filter_by(archive=False)
+        if include_public:
+            notes = notes.filter((NoteModel.author_id == g.user.id) | (NoteModel.private == False))
+        else:
+            notes = notes.filter_by(author_id=g.user.id)
+        notes = load_for(NoteSchema, filter_by_tags(notes, tags_all, tags_any, tags_none))
+        return fast_response(NotesPageSchema, paginate(notes, NoteModel.id, limit, after), 200)
 
     @auth.login_required
     @doc(security=[{"basicAuth": []}])
@@ -92,6 +124,80 @@ class NotesListResource(MethodResource):
         note.save()
         return note, 201
 
+@doc(description="API for Notes", tags=["Notes"])
+class NotesBatchResource(MethodResource):
+    operation_schemas = {
+        "create": NoteRequestSchema(),
+        "edit": NoteEditSchema(),
+        "delete": NoteEditSchema(only=()),
+    }
+
+    @auth.login_required
+    @doc(security=[{"basicAuth": []}])
+    @doc(summary="Create, edit and delete many notes in one transaction",
+         description="Operations: create (text, private), edit (id, text, private), delete (id). "
+                     "Invalid operations are reported in results and skipped, the rest are committed together.")
+    @marshal_with(NoteBatchResultSchema, code=200)
+    @use_kwargs(NoteBatchRequestSchema, location=("json"))
+    def post(self, operations):
+        author = g.user
+        results = []
+        creates, changes = [], []
+        for item in operations:
+            op = item.get("op")
+            result = {"op": op}
+            results.append(result)
+            schema = self.operation_schemas.get(op)
+            if schema is None:
+                result.update(status=422, errors={"op": ["Must be one of: create, edit, delete."]})
+                continue
+            try:
+                data = schema.load({key: value for key, value in item.items() if key not in ("op", "id")})
+            except ValidationError as err:
+                result.update(status=422, errors=err.messages)
+                continue
+            if op == "create":
+                data["author_id"] = author.id
+                creates.append((result, data))
+            elif "id" not in item:
+                result.update(status=422, errors={"id": ["Missing data for required field."]})
+            elif type(item["id"]) is not int:  # bool - подкласс int, true/false за id не считаем
+                result.update(status=422, errors={"id": ["Not a valid integer."]})
+            else:
+                result["id"] = item["id"]
+                changes.append((result, data))
+
+        # заметки для edit/delete загружаются одним запросом
+        ids = {result["id"] for result, data in changes}
+        notes = {note.id: note for note in
+                 NoteModel.query.filter(NoteModel.id.in_(ids))} if ids else {}
+        deleted = set()
+        for result, data in changes:
+            note = notes.get(result["id"])
+            if note is None or note.id in deleted:
+                result.update(status=404, error=f"Note with id={result['id']} not found")
+            elif note.author_id != author.id:
+                result.update(status=403, error="Forbidden for this User")
+            elif result["op"] == "delete":
+                deleted.add(note.id)
+                result["status"] = 200
+            else:
+                for key, value in data.items():
+                    setattr(note, key, value)
+                result["status"] = 200
+
+        NoteModel.bulk_create([data for result, data in creates])
+        for result, data in creates:
+            result.update(status=201, id=data["id"])
+        db.session.flush()
+        if deleted:
+            release_refs(db.session.connection(), 'note_id', deleted)
+        NoteModel.bulk_delete(deleted)
+        db.session.commit()
+        response_cache.invalidate("notes")
+        return {"results": results}, 200
+
+
 @doc(tags=['Notes'])
 class NoteSetTagsResource(MethodResource):
     @auth.login_required()
@@ -100,20 +206,16 @@ class NoteSetTagsResource(MethodResource):
     @doc(responses={403: "Forbidden for this user"})
     @doc(responses={404: "Note not found"})
     @use_kwargs({"tags": fields.List(fields.Int())}, location=('json'))
-    @marshal_with(NoteSchema, code=201)
+    @marshal_with(NoteTagsSchema, code=201)
     def put(self, note_id, **kwargs):
         author = g.user
+        # связи читаются и меняются запросами к таблице tags - коллекцию не загружаем
         note = NoteModel.query.get(note_id)
         if not note:
             abort(404, error=f"note {note_id} not found")
-        if note.author != author:
+        if note.author_id != author.id:
             abort(403, error="Forbidden for this User")
-        for tag_id in kwargs["tags"]:
-            tag = TagModel.query.get(tag_id)
-            if tag is None:
-                continue
-            note.tags.append(tag)
-        note.save()
+        note.unknown_tags = note.add_tags(kwargs["tags"])
         return note, 201
 
     @auth.login_required()
@@ -122,43 +224,98 @@ class NoteSetTagsResource(MethodResource):
     @doc(responses={403: "Forbidden for this user"})
     @doc(responses={404: "Note not found"})
     @use_kwargs({"tags": fields.List(fields.Int())}, location=('json'))
-    @marshal_with(NoteSchema, code=200)
+    @marshal_with(NoteTagsSchema, code=200)
     def delete(self, note_id, **kwargs):
         author = g.user
+        # связи читаются и меняются запросами к таблице tags - коллекцию не загружаем
         note = NoteModel.query.get(note_id)
         if not note:
             abort(404, error=f"note {note_id} not found")
-        if note.author != author:
+        if note.author_id != author.id:
             abort(403, error="Forbidden for this User")
-        for tag_id in kwargs["tags"]:
-            tag = TagModel.query.get(tag_id)
-            if tag is None:
-                continue
-            try:
-                note.tags.remove(tag)
-            except ValueError:
-                pass
-        note.save()
+        note.unknown_tags = note.remove_tags(kwargs["tags"])
         return note, 200
 
 
+@cached_resource("notes", "users", "tags")
 @doc(tags=['Notes'])
 class NoteFilterResource(MethodResource):
-    @doc(summary="Get all public notes of unique User")
-    @marshal_with(NoteSchema(many=True), code=200)
-    @use_kwargs({"username": fields.Str()}, location=('query'))
-    def get(self, **kwargs):
-        notes = NoteModel.query.filter_by(private = False).filter(NoteModel.author.has(**kwargs)).all()
-        return notes, 200
+    @doc(summary="Get all public notes of unique User", description="Keyset pagination: follow _links.next")
+    @marshal_with(NotesPageSchema, code=200)
+    @use_kwargs({"username": fields.Str(), **pagination_args}, location=('query'))
+    def get(self, limit, after=None, **kwargs):
+        # JOIN вместо author.has(): с коррелированным EXISTS SQLite не использует индекс по author_id
+        notes = NoteModel.query.filter_by(private=False, archive=False) \
+            .join(UserModel, NoteModel.author_id == UserModel.id).filter_by(**kwargs)
+        notes = load_for(NoteSchema, notes)
+        return fast_response(NotesPageSchema, paginate(notes, NoteModel.id, limit, after), 200)
+
+
+@doc(tags=['Notes'])
+class NoteSearchResource(MethodResource):
+    @auth.login_required(optional=True)
+    @doc(security=[{"basicAuth": []}])
+    @doc(summary="Full-text search over notes",
+         description="Returns notes containing all words of q, most relevant first. "
+                     "Anonymous users see public notes only, authenticated users also see their own. "
+                     "Archived notes are skipped unless archive=true.")
+    @marshal_with(NotesPageSchema, code=200)
+    @use_kwargs({"q": fields.Str(required=True), "archive": fields.Bool(load_default=False),
+                 **offset_pagination_args}, location=('query'))
+    def get(self, q, archive, limit, offset):
+        user = g.get("user")
+        notes = NoteModel.query
+        if user is None:
+            notes = notes.filter(NoteModel.private == False)
+        else:
+            notes = notes.filter((NoteModel.private == False) | (NoteModel.author_id == user.id))
+        if not archive:
+            notes = notes.filter(NoteModel.archive == False)
+        words = split_words(q)
+        if not words:
+            notes = notes.filter(false())
+        else:
+            notes = search_notes(notes, words)
+        notes = load_for(NoteSchema, notes)
+        return fast_response(NotesPageSchema, paginate_offset(notes, limit, offset), 200)
+
+
+@doc(tags=['Notes'])
+class NotesArchiveResource(MethodResource):
+    @auth.login_required()
+    @doc(security=[{"basicAuth": []}])
+    @doc(summary="Get archived notes of User", description="Keyset pagination: follow _links.next")
+    @marshal_with(NotesPageSchema, code=200)
+    @use_kwargs(pagination_args, location=('query'))
+    def get(self, limit, after=None):
+        if current_app.config['NOTE_COLD_STORAGE']:
+            notes = NoteArchiveModel.query.filter_by(author_id=g.user.id) \
+                .options(selectinload(NoteArchiveModel.author), selectinload(NoteArchiveModel.tag_links))
+            page = paginate(notes, NoteArchiveModel.id, limit, after)
+        else:
+            notes = load_for(NoteSchema, NoteModel.query.filter_by(author_id=g.user.id, archive=True))
+            page = paginate(notes, NoteModel.id, limit, after)
+        return fast_response(NotesPageSchema, page, 200)
 
 
 @api.resource('/notes/<int:note_id>/archive') #DELETE
 @doc(tags=['Notes'])
 class NoteToArchive(MethodResource):
-    @doc(summary="Move Note to archive")
+    @auth.login_required
+    @doc(security=[{"basicAuth": []}])
+    @doc(summary="Move Note to archive",
+         description="With NOTE_COLD_STORAGE the note is moved to the archive table.")
+    @doc(responses={403: {"description": "Forbidden for this User"}})
+    @doc(responses={404: {"description": "Note not found"}})
     @marshal_with(NoteSchema, code=200)
     def delete(self, note_id):
         note = get_or_404(NoteModel, note_id)
+        if note.author_id != g.user.id:
+            abort(403, error="Forbidden for this User")
+        if current_app.config['NOTE_COLD_STORAGE']:
+            NoteArchiveModel.move_to_archive([note_id])
+            db.session.commit()
+            return NoteArchiveModel.query.get(note_id), 200
         note.archive = True
         note.save()
         return note, 200
@@ -166,13 +323,23 @@ class NoteToArchive(MethodResource):
 @api.resource('/notes/<int:note_id>/restore') #PUT
 @doc(tags=['Notes'])
 class NoteFromArchive(MethodResource):
+    @auth.login_required
+    @doc(security=[{"basicAuth": []}])
     @doc(summary="Restore Note from archive")
+    @doc(responses={403: {"description": "Forbidden for this User"}})
+    @doc(responses={404: {"description": "Note not found"}})
     @marshal_with(NoteSchema, code=200)
     def put(self, note_id):
-        # author = g.user
-        note = get_or_404(NoteModel, note_id)
-        # if note.author != author:
-        #     abort(403, error="Forbidden for this User")
+        note = NoteModel.query.get(note_id)
+        if note is None:  # заметка может быть в холодном хранилище
+            note = get_or_404(NoteArchiveModel, note_id)
+            if note.author_id != g.user.id:
+                abort(403, error="Forbidden for this User")
+            NoteArchiveModel.restore([note_id])
+            db.session.commit()
+            note = NoteModel.query.get(note_id)
+        elif note.author_id != g.user.id:
+            abort(403, error="Forbidden for this User")
         note.archive = False
         note.save()
         return note, 200
\ No newline at end of file
@@ -1,10 +1,14 @@
 from api import Resource, abort, reqparse, auth
-from api.models.tag import TagModel
-from api.schemas.tag import TagSchema, TagRequestSchema, tag_schema, tags_schema
+from api.models.tag import TagModel, tag_registry
+from api.schemas.tag import TagSchema, TagCountSchema, TagRequestSchema, TagsPageSchema, tag_schema, tags_schema
 from flask_apispec.views import MethodResource
 from flask_apispec import marshal_with, use_kwargs, doc
 from webargs import fields
+from helpers.pagination import paginate, pagination_args
+from helpers.serialization import fast_response
+from helpers.response_cache import cached_resource
 
+@cached_resource("tags")
 @doc(description='Api for tag.', tags=['Tags'])
 class TagResource(MethodResource):
 
@@ -12,7 +16,7 @@ class TagResource(MethodResource):
     @doc(responses={404: "Tag not found"})
     @marshal_with(TagSchema, code=200)
     def get(self, tag_id):
-        tag = TagModel.query.get(tag_id)
+        tag = tag_registry.get(tag_id)
         if tag is None:
             abort(404, error=f"Tag with id={tag_id} not found")
         return tag, 200
@@ -43,13 +47,14 @@ class TagResource(MethodResource):
         return f"Tag with id={tag_id} was deleted", 200
 
 
+@cached_resource("tags")
 @doc(description='Api for tag.', tags=['Tags'])
 class TagListResource(MethodResource):
-    @doc(summary="Get all tags")
-    @marshal_with(TagSchema(many=True), code=200)
-    def get(self):
-        tags = TagModel.query.all()
-        return tags, 200
+    @doc(summary="Get all tags", description="Keyset pagination: follow _links.next")
+    @marshal_with(TagsPageSchema, code=200)
+    @use_kwargs(pagination_args, location=('query'))
+    def get(self, limit, after=None):
+        return fast_response(TagsPageSchema, paginate(TagModel.query, TagModel.id, limit, after), 200)
 
     @auth.login_required(role="admin")
     @doc(security=[{"basicAuth": []}])
@@ -63,3 +68,16 @@ class TagListResource(MethodResource):
         if not tag.id:
             abort(400, error=f"Tag with tagname:{tag.name} already exist")
         return tag, 201
+
+
+@cached_resource("tags", "notes")
+@doc(description='Api for tag.', tags=['Tags'])
+class TagCloudResource(MethodResource):
+    @doc(summary="Get most used tags",
+         description="Tags ordered by number of public notes that are not archived (private notes and "
+                     "notes in the archive, including cold storage, are not counted). notes_count is kept "
+                     "up to date by the database, so the list is read without counting notes.")
+    @use_kwargs({"limit": pagination_args["limit"]}, location=('query'))
+    @marshal_with(TagCountSchema(many=True), code=200)
+    def get(self, limit):
+        return TagModel.query.order_by(TagModel.notes_count.desc(), TagModel.id).limit(limit).all(), 200
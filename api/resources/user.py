@@ -1,11 +1,22 @@
 from api import Resource, abort, reqparse, auth, g
 from api.models.user import UserModel
-from api.schemas.user import user_schema, users_schema, UserSchema, UserRequestSchema
+from api.models.job import JobModel
+from api.models.user_deletion import count_notes, delete_user
+from api.models.user_import import import_users, password_hasher
+from api.resources.job import accepted
+from api.models.search import search_users
+from api.schemas.user import user_schema, users_schema, UserSchema, UserRequestSchema, UsersPageSchema, \
+    UserBulkRequestSchema, UserBulkResultSchema
 from flask_apispec.views import MethodResource
 from flask_apispec import marshal_with, use_kwargs, doc
 from webargs import fields
+from flask import current_app
 from flask_babel import _
+from helpers.pagination import paginate, pagination_args
+from helpers.serialization import fast_response
+from helpers.response_cache import cached_resource
 
+@cached_resource("users")
 @doc(description='Api for users.', tags=['Users'])
 class UserResource(MethodResource):
     @doc(summary="Get User by id", description="Return User with unique id")
@@ -34,27 +45,36 @@ class UserResource(MethodResource):
 
     @auth.login_required
     @doc(security=[{"basicAuth": []}])
-    @doc(summary="Delete user by id", description="Delete unique user")
+    @doc(summary="Delete user by id",
+         description="Delete unique user with their notes, in chunks. With background=true, "
+                     "or when the user has more than USER_DELETE_SYNC_MAX_NOTES notes, the deletion "
+                     "is queued and 202 with the job resource (including progress) is returned.")
     @doc(responses={200: {"description": "User Deleted"}})
+    @doc(responses={202: {"description": "Deletion queued"}})
     @doc(responses={401: {"description": "Not authorization"}})
     @doc(responses={404: {"description": "User not found"}})
-    def delete(self, user_id):
+    @use_kwargs({"background": fields.Bool(load_default=False)}, location="query")
+    def delete(self, user_id, background):
         user = UserModel.query.get(user_id)
         if user is None:
             abort(404, error=_("User with id=%(user_id)s not found", user_id=user_id))
         if user_id != g.user.id and g.user.role != "admin":
             abort(401, error="Not authorization")
-        user.delete()
+        if background or count_notes(user_id) > current_app.config['USER_DELETE_SYNC_MAX_NOTES']:
+            return accepted(JobModel.enqueue("users.delete", {"user_id": user_id}, user_id=g.user.id))
+        if delete_user(user_id) is None:  # удален параллельным запросом
+            abort(404, error=_("User with id=%(user_id)s not found", user_id=user_id))
         return f"User with id={user_id} was deleted", 200
 
 
+@cached_resource("users")
 @doc(description='Api for users.', tags=['Users'])
 class UsersListResource(MethodResource):
-    @doc(summary="Get list of all users")
-    @marshal_with(UserSchema(many=True), code=200)
-    def get(self):
-        users = UserModel.query.all()
-        return users, 200
+    @doc(summary="Get list of all users", description="Keyset pagination: follow _links.next")
+    @marshal_with(UsersPageSchema, code=200)
+    @use_kwargs(pagination_args, location=('query'))
+    def get(self, limit, after=None):
+        return fast_response(UsersPageSchema, paginate(UserModel.query, UserModel.id, limit, after), 200)
 
     @doc(summary="Create new User")
     @doc(responses={400: {"description": "User already exist"}})
@@ -67,14 +87,38 @@ class UsersListResource(MethodResource):
             abort(400, error=f"User with username:{user.username} already exist")
         return user, 201
 
+@doc(description='Api for users.', tags=['Users'])
+class UsersBulkResource(MethodResource):
+    @auth.login_required(role="admin")
+    @doc(security=[{"basicAuth": []}])
+    @doc(summary="Create many users",
+         description="Each user is reported in results: 201 with id, 409 if the username is taken "
+                     "(or repeated in the request), 422 if invalid. Passwords are hashed in a process pool "
+                     "shared by requests and users are inserted in batches. With background=true or more "
+                     "than USER_BULK_SYNC_MAX_SIZE users the import is queued and 202 with the job resource "
+                     "is returned; the job result has the same shape. Larger imports: flask users import.")
+    @doc(responses={202: {"description": "Import queued"}})
+    @marshal_with(UserBulkResultSchema, code=200)
+    @use_kwargs(UserBulkRequestSchema, location=("json"))
+    @use_kwargs({"background": fields.Bool(load_default=False)}, location="query")
+    def post(self, users, background):
+        if background or len(users) > current_app.config['USER_BULK_SYNC_MAX_SIZE']:
+            # хэширование тысяч паролей заняло бы веб-воркер дольше таймаута запроса
+            return accepted(JobModel.enqueue("users.import", {"users": users}, user_id=g.user.id))
+        results = import_users(users, hasher=password_hasher)
+        return {"created": sum(result["status"] == 201 for result in results), "results": results}, 200
+
 @doc(description='Api for users.', tags=['Users'])
 class UsersSearchResource(MethodResource):
-    @doc(summary="Get list of all users by search")
-    @use_kwargs({"username": fields.Str()}, location=('query'))
+    @doc(summary="Get list of all users by search",
+         description="Case-insensitive substring (or prefix=true) match on username, ordered by username. "
+                     "Uses pg_trgm on Postgres and an in-process trigram index otherwise.")
+    @use_kwargs({"username": fields.Str(), "prefix": fields.Bool(load_default=False),
+                 "limit": pagination_args["limit"]}, location=('query'))
     @marshal_with(UserSchema(many=True), code=200)
-    def get(self, **kwargs):
+    def get(self, prefix, limit, **kwargs):
         if kwargs.get("username"):
-            users = UserModel.query.filter(UserModel.username.like(f'%{kwargs["username"]}%')).all()
+            users = search_users(kwargs["username"], prefix, limit)
         else:
-            users = UserModel.query.all()
+            users = UserModel.query.order_by(UserModel.id).limit(limit).all()
         return users, 200
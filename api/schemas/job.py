@@ -0,0 +1,24 @@
+from api import ma
+from api.models.job import JobModel
+
+
+# Сериализация ответа(response)
+class JobSchema(ma.SQLAlchemySchema):
+    class Meta:
+        model = JobModel
+
+    id = ma.auto_field()
+    name = ma.auto_field()
+    status = ma.auto_field()
+    attempts = ma.auto_field()
+    progress = ma.Raw(attribute="progress_data")
+    result = ma.Raw(attribute="result_data")
+    error = ma.auto_field()
+    created_at = ma.auto_field()
+    finished_at = ma.auto_field()
+    _links = ma.Hyperlinks({
+        'self': ma.URLFor('jobresource', values=dict(job_id="<id>")),
+    })
+
+
+job_schema = JobSchema()
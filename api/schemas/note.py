@@ -1,7 +1,9 @@
-from api import ma
+from api import ma, Config
+from marshmallow import validate
 from api.models.note import NoteModel
 from api.schemas.user import UserSchema
 from api.schemas.tag import TagSchema
+from api.schemas.page import page_schema
 
 
 #       schema        flask-restful
@@ -10,12 +12,13 @@ from api.schemas.tag import TagSchema
 class NoteSchema(ma.SQLAlchemySchema):
     class Meta:
         model = NoteModel
+        eager_load = ("author", "tag_links")  # связи для helpers.loading.load_for
 
     id = ma.auto_field()
     text = ma.auto_field()
     private = ma.auto_field()
     author = ma.Nested(UserSchema())
-    tags = ma.Nested(TagSchema(many=True))
+    tags = ma.Nested(TagSchema(many=True), attribute="registry_tags")  # имена тегов - из tag_registry
     _links = ma.Hyperlinks({
         'self': ma.URLFor('noteresource', values=dict(note_id="<id>")),
         'collection': ma.URLFor('noteslistresource')
@@ -23,6 +26,11 @@ class NoteSchema(ma.SQLAlchemySchema):
     archive = ma.auto_field()
 
 
+# Ответ на изменение тегов заметки: unknown_tags - id, для которых тегов не нашлось
+class NoteTagsSchema(NoteSchema):
+    unknown_tags = ma.List(ma.Int())
+
+
 class NoteRequestSchema(ma.SQLAlchemySchema):
     class Meta:
         model = NoteModel
@@ -37,5 +45,17 @@ class NoteEditSchema(ma.SQLAlchemySchema):
     text = ma.Str()
     private = ma.Bool()
 
+# Пакет операций /notes/batch:
+# {"operations": [{"op": "create", "text": ...}, {"op": "edit", "id": 1, ...}, {"op": "delete", "id": 2}]}
+class NoteBatchRequestSchema(ma.Schema):
+    operations = ma.List(ma.Dict(), required=True,
+                         validate=validate.Length(min=1, max=Config.MAX_BATCH_SIZE))
+
+
+class NoteBatchResultSchema(ma.Schema):
+    results = ma.List(ma.Dict())
+
+
 note_schema = NoteSchema()
 notes_schema = NoteSchema(many=True)
+NotesPageSchema = page_schema(NoteSchema, "NotesPage")
@@ -0,0 +1,10 @@
+from api import ma
+from marshmallow import fields
+
+
+# Страница keyset-пагинации: {"items": [...], "_links": {"self": ..., "next": ...}}
+def page_schema(item_schema, name):
+    return ma.Schema.from_dict({
+        "items": fields.Nested(item_schema, many=True),
+        "_links": fields.Dict(keys=fields.Str(), values=fields.Str(allow_none=True)),
+    }, name=name)
@@ -1,5 +1,6 @@
 from api import ma
 from api.models.tag import TagModel
+from api.schemas.page import page_schema
 
 
 # Сериализация ответа(response)
@@ -13,6 +14,12 @@ class TagSchema(ma.SQLAlchemyAutoSchema):
     })
 
 
+# Облако тегов: тег с числом заметок
+class TagCountSchema(TagSchema):
+    class Meta(TagSchema.Meta):
+        fields = ("id", "name", "notes_count", "_links")
+
+
 # Десериализация запроса(request)
 class TagRequestSchema(ma.SQLAlchemySchema):
     class Meta:
@@ -23,3 +30,4 @@ class TagRequestSchema(ma.SQLAlchemySchema):
 
 tag_schema = TagSchema()
 tags_schema = TagSchema(many=True)
+TagsPageSchema = page_schema(TagSchema, "TagsPage")
@@ -1,5 +1,7 @@
-from api import ma
+from api import ma, Config
+from marshmallow import validate
 from api.models.user import UserModel
+from api.schemas.page import page_schema
 
 
 #       schema        flask-restful
@@ -28,10 +30,23 @@ class UserRequestSchema(ma.SQLAlchemySchema):
     class Meta:
         model = UserModel
 
-    username = ma.Str(required=True)
+    # длины - как у колонок UserModel: иначе Postgres отклонит строку при вставке (DataError)
+    username = ma.Str(required=True, validate=validate.Length(max=32))
     password = ma.Str(required=True)
-    role = ma.Str()
+    role = ma.Str(validate=validate.Length(max=32))
+
+
+# /users/bulk: {"users": [{"username": ..., "password": ..., "role": ...}, ...]}
+class UserBulkRequestSchema(ma.Schema):
+    users = ma.List(ma.Dict(), required=True,
+                    validate=validate.Length(min=1, max=Config.USER_BULK_MAX_SIZE))
+
+
+class UserBulkResultSchema(ma.Schema):
+    created = ma.Int()
+    results = ma.List(ma.Dict())
 
 
 user_schema = UserSchema()
 users_schema = UserSchema(many=True)
+UsersPageSchema = page_schema(UserSchema, "UsersPage")
@@ -1,11 +1,30 @@
-from api import api, app, docs
+import csv
+import json
+import os
+import sys
+import time
+import click
+from api import api, app, db, docs, response_cache
 from api.resources import note
-from api.resources.user import UserResource, UsersListResource, UsersSearchResource
-from api.resources.auth import TokenResource
-from api.resources.tag import TagResource, TagListResource
-from api.resources.file import UploadPictureResource
+from api.resources.user import UserResource, UsersListResource, UsersSearchResource, UsersBulkResource
+from api.resources.auth import TokenResource, AuthCacheResource
+from api.resources.tag import TagResource, TagListResource, TagCloudResource
+from api.resources.file import UploadPictureResource, UploadJobResource
+from api.resources.job import JobResource
+from api.resources.metrics import PoolMetricsResource
 from config import Config
-from flask import render_template, send_from_directory
+from flask import abort, redirect, render_template, request, send_from_directory, url_for
+from flask.cli import AppGroup
+from api.models.blob import BlobModel
+from api.models.job import JobModel
+from api.models.note import NoteModel
+from api.models.archive import NoteArchiveModel
+from api.models.search import split_words
+from api.models.user_import import import_users
+from base64 import b64encode
+from helpers.database import capture_statements, explain
+from helpers.derivatives import variant_path
+from helpers.uploads import DIGEST_RE, send_blob
 
 # CRUD
 
@@ -17,14 +36,30 @@ api.add_resource(UsersListResource,
                  '/users')  # GET, POST
 api.add_resource(UserResource,
                  '/users/<int:user_id>')  # GET, PUT, DELETE
+api.add_resource(UsersBulkResource,
+                 '/users/bulk')  # POST
 
 
 api.add_resource(TokenResource,
                  '/auth/token')  # GET
+api.add_resource(AuthCacheResource,
+                 '/auth/cache')  # GET
+
+api.add_resource(JobResource,
+                 '/jobs/<int:job_id>')  # GET
+
+api.add_resource(PoolMetricsResource,
+                 '/metrics/pool')  # GET
 
 api.add_resource(note.NotesListResource,
                  '/notes',  # GET, POST
                  )
+api.add_resource(note.NotesBatchResource,
+                 '/notes/batch',  # POST
+                 )
+api.add_resource(note.NotesArchiveResource,
+                 '/notes/archive',  # GET
+                 )
 api.add_resource(note.NoteResource,
                  '/notes/<int:note_id>',  # GET, PUT, DELETE
                  )
@@ -33,6 +68,8 @@ api.add_resource(TagListResource,
                  '/tags')  # GET, POST
 api.add_resource(TagResource,
                  '/tags/<int:tag_id>')  # GET, PUT, DELETE
+api.add_resource(TagCloudResource,
+                 '/tags/cloud')  # GET
 
 api.add_resource(note.NoteSetTagsResource,
                  '/notes/<int:note_id>/tags')  # PUT, DELETE
@@ -40,26 +77,152 @@ api.add_resource(note.NoteSetTagsResource,
 api.add_resource(note.NoteFilterResource,
                  '/notes/public/filter') #GET
 
+api.add_resource(note.NoteSearchResource,
+                 '/notes/search') #GET
+
 api.add_resource(UsersSearchResource,
                  '/users/search') #GET
 
 docs.register(UserResource)
 docs.register(UsersListResource)
+docs.register(UsersBulkResource)
 docs.register(note.NoteResource)
 docs.register(note.NotesListResource)
+docs.register(note.NotesBatchResource)
+docs.register(note.NotesArchiveResource)
 docs.register(TagResource)
 docs.register(TagListResource)
+docs.register(TagCloudResource)
 docs.register(note.NoteSetTagsResource)
 docs.register(note.NoteFilterResource)
+docs.register(note.NoteSearchResource)
 docs.register(note.NoteToArchive)
 docs.register(note.NoteFromArchive)
 docs.register(UploadPictureResource)
+docs.register(UploadJobResource)
+docs.register(JobResource)
 docs.register(UsersSearchResource)
 
 
 @app.route('/uploads/<path:filename>')
 def download_file(filename):
-   return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+   if DIGEST_RE.match(filename):  # content-addressed blob
+      variant = request.args.get('variant')
+      blob = db.session.query(BlobModel.mimetype).filter_by(digest=filename).first()
+      if blob is None:  # blob удален (blobs-gc) - не отдаем ни оригинал, ни оставшиеся копии
+         abort(404)
+      # копии сохраняются в формате оригинала, тип у них тот же
+      mimetype = blob.mimetype
+      if variant is None:
+         return send_blob(filename, mimetype=mimetype)
+      if variant not in app.config['IMAGE_VARIANTS']:
+         abort(404)
+      if os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], variant_path(variant, filename))):
+         return send_blob(filename, variant_path(variant, filename), etag=f"{filename}-{variant}", mimetype=mimetype)
+      # копия еще не готова (или файл не изображение) - временно отдаем оригинал
+      return redirect(url_for('download_file', filename=filename))
+   return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True, conditional=True)
+
+
+@app.cli.command('blobs-gc')
+def blobs_gc():
+   """Удаляет загруженные файлы, на которые нет ссылок дольше BLOB_GC_GRACE секунд"""
+   print(f"Removed blobs: {BlobModel.collect_garbage()}")
+
+
+@app.cli.command('worker')
+@click.option('--once', is_flag=True, help="Выполнить готовые задачи и выйти")
+def worker(once):
+   """Выполняет фоновые задачи из очереди (api.models.job)"""
+   while True:
+      done = JobModel.run_pending()
+      db.session.remove()
+      if once:
+         print(f"Jobs done: {done}")
+         break
+      if not done:
+         time.sleep(app.config['JOB_POLL_INTERVAL'])
+
+
+users_cli = AppGroup('users', help="Пользователи")
+
+
+@users_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+              help="По умолчанию - по расширению файла")
+@click.option('--workers', type=int, help="Процессов хэширования паролей (USER_IMPORT_WORKERS)")
+@click.option('--batch-size', type=int, help="Пользователей в одной транзакции (USER_IMPORT_BATCH_SIZE)")
+def users_import(path, file_format, workers, batch_size):
+   """Создает пользователей из CSV (колонки username,password,role) или JSONL"""
+   file_format = file_format or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+   with open(path, newline='', encoding='utf-8') as f:
+      if file_format == 'csv':
+         rows = [{key: value for key, value in row.items() if value} for row in csv.DictReader(f)]
+      else:
+         rows = []
+         for number, line in enumerate(f, 1):
+            if not line.strip():
+               continue
+            try:
+               rows.append(json.loads(line))
+            except ValueError as error:
+               raise click.ClickException(f"{path}:{number}: {error}")
+   results = import_users(rows, batch_size=batch_size, workers=workers)
+   for number, result in enumerate(results, 1):
+      if result["status"] != 201:
+         print(f"#{number} {result['username']}: {result.get('error') or result.get('errors')}", file=sys.stderr)
+   created = sum(result["status"] == 201 for result in results)
+   print(f"Users created: {created}, skipped: {len(results) - created}")
+
+
+app.cli.add_command(users_cli)
+
+
+@app.cli.command('notes-archive-move')
+def notes_archive_move():
+   """Переносит заметки с флагом archive в холодное хранилище (для включения NOTE_COLD_STORAGE)"""
+   moved = 0
+   while True:
+      note_ids = [note_id for (note_id,) in db.session.query(NoteModel.id).filter(NoteModel.archive == True)
+                  .order_by(NoteModel.id).limit(NoteArchiveModel.CHUNK)]
+      if not note_ids:
+         break
+      NoteArchiveModel.move_to_archive(note_ids)
+      db.session.commit()
+      moved += len(note_ids)
+   print(f"Moved notes: {moved}")
+
+
+@app.cli.command('db-explain')
+@click.argument('paths', nargs=-1)
+def db_explain(paths):
+   """Печатает планы SQL-запросов, которые выполняют GET-эндпоинты (по умолчанию - основные)"""
+   note = NoteModel.query.order_by(NoteModel.id).first()
+   if note is None:
+      raise click.ClickException("Нужна хотя бы одна заметка: планы строятся на реальных данных")
+   author = note.author
+   token = author.generate_auth_token().decode('ascii')
+   headers = {'Authorization': 'Basic ' + b64encode(f"{token}:unused".encode('ascii')).decode('ascii')}
+   paths = paths or ['/notes', '/notes/archive', f'/notes/{note.id}', f'/notes/public/filter?username={author.username}',
+                     f'/notes/search?q={split_words(note.text)[0] if split_words(note.text) else "note"}',
+                     '/users', f'/users/search?username={author.username[:3]}', '/tags']
+   client = app.test_client()
+   cache_enabled, response_cache.enabled = response_cache.enabled, False
+   try:
+      for path in paths:
+         db.session.remove()  # запросы тестового клиента идут в этом же контексте - сбрасываем identity map
+         with capture_statements() as statements:
+            status = client.get(path, headers=headers).status_code
+         print(f"=== GET {path} ({status})")
+         with db.engine.connect() as connection:
+            for statement, parameters in statements:
+               print(" ".join(statement.split()))
+               for line in explain(connection, statement, parameters):
+                  print("    " + line)
+         print()
+   finally:
+      response_cache.enabled = cache_enabled
 
 
 if __name__ == '__main__':
@@ -0,0 +1,247 @@
+"""
+Нагрузочный прогон горячих эндпоинтов: WSGI-приложение вызывается в процессе через test_client
+на сгенерированном наборе данных (N пользователей, M заметок на пользователя, K тегов).
+
+Для каждого эндпоинта: пропускная способность, задержка p50/p95/p99, SQL-запросов на запрос
+и пик памяти. Результат - JSON (--output), который можно сравнить с прогоном другого коммита (--compare).
+
+Запуск: python -m benchmarks.api --users 1000 --notes 20 --tags 200 --requests 500 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from base64 import b64encode
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app
+from api import db
+from api.models.note import NoteModel, tags
+from api.models.tag import TagModel
+from api.models.user import UserModel
+
+PASSWORD = 'bench'
+INSERT_CHUNK = 400  # строк в одном INSERT, см. NoteModel.TAGS_INSERT_CHUNK
+
+
+def seed(users, notes_per_user, tags_count, tags_per_note):
+    """
+    Заполняет БД bulk-вставками; у всех пользователей пароль PASSWORD. Возвращает имена пользователей
+    """
+    password_hash = UserModel('seed', PASSWORD).password_hash  # хэшируем один раз
+    usernames = ['bench'] + [''.join(random.choices(string.ascii_lowercase, k=random.randint(4, 10))) + str(i)
+                             for i in range(1, users)]
+    db.session.bulk_insert_mappings(UserModel, [
+        {"username": username, "password_hash": password_hash, "role": "simple_user"} for username in usernames])
+    db.session.bulk_insert_mappings(TagModel, [{"name": f"tag{i}"} for i in range(tags_count)])
+    db.session.commit()
+    user_ids = [user_id for (user_id,) in db.session.query(UserModel.id).order_by(UserModel.id)]
+    tag_ids = [tag_id for (tag_id,) in db.session.query(TagModel.id)]
+    rows = [{"author_id": user_id, "text": f"note {i} of user {user_id}", "private": random.random() < 0.5}
+            for user_id in user_ids for i in range(notes_per_user)]
+    NoteModel.bulk_create(rows)
+    db.session.commit()
+    links = [{"note_model_id": row["id"], "tag_id": tag_id}
+             for row in rows for tag_id in random.sample(tag_ids, min(tags_per_note, len(tag_ids)))]
+    for start in range(0, len(links), INSERT_CHUNK):
+        db.session.execute(tags.insert().values(links[start:start + INSERT_CHUNK]))
+    db.session.commit()
+    return usernames, user_ids, tag_ids
+
+
+def scenarios(usernames, bench_note_ids, tag_ids, upload_size):
+    """
+    Эндпоинт --> функция, выполняющая один запрос через client
+    """
+    headers = {'Authorization': 'Basic ' + b64encode(f'bench:{PASSWORD}'.encode('ascii')).decode('ascii')}
+
+    def notes(client):
+        return client.get('/notes', headers=headers)
+
+    def public_filter(client):
+        return client.get(f'/notes/public/filter?username={random.choice(usernames)}')
+
+    def set_tags(client):
+        return client.put(f'/notes/{random.choice(bench_note_ids)}/tags', headers=headers,
+                          content_type='application/json',
+                          data=json.dumps({"tags": random.sample(tag_ids, min(3, len(tag_ids)))}))
+
+    def users_search(client):
+        name = random.choice(usernames)
+        start = random.randint(0, max(len(name) - 3, 0))
+        return client.get(f'/users/search?username={name[start:start + 3]}')
+
+    def auth_token(client):
+        return client.get('/auth/token', headers=headers)
+
+    def upload(client):
+        return client.put('/upload', headers=headers, content_type='application/octet-stream',
+                          data=os.urandom(upload_size))
+
+    return {
+        "GET /notes": notes,
+        "GET /notes/public/filter": public_filter,
+        "PUT /notes/<id>/tags": set_tags,
+        "GET /users/search": users_search,
+        "GET /auth/token": auth_token,
+        "PUT /upload": upload,
+    }
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+        event.listen(Engine, 'after_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+    def close(self):
+        event.remove(Engine, 'after_cursor_execute', self._count)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run_scenario(client, request, requests, warmup, counter):
+    for _ in range(warmup):
+        request(client)
+    latencies = []
+    statements = counter.count
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(requests):
+        request_start = time.perf_counter()
+        res = request(client)
+        latencies.append(time.perf_counter() - request_start)
+        errors += res.status_code >= 400
+    elapsed = time.perf_counter() - start
+    statements = counter.count - statements
+
+    # пик памяти - отдельным коротким прогоном: tracemalloc замедляет запросы
+    tracemalloc.start()
+    for _ in range(min(requests, 20)):
+        request(client)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        "latency_ms": {name: round(percentile(latencies, fraction) * 1000, 3)
+                       for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "latency_mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        "sql_statements_per_request": round(statements / requests, 2),
+        "peak_memory_kb": peak // 1024,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Печатает изменение p95 и пропускной способности относительно прошлого прогона
+    """
+    for name, result in results["endpoints"].items():
+        previous = baseline["endpoints"].get(name)
+        if previous is None:
+            continue
+        p95 = result["latency_ms"]["p95"] / previous["latency_ms"]["p95"] - 1
+        rps = result["throughput_rps"] / previous["throughput_rps"] - 1
+        print(f"{name:26} p95 {p95:+7.1%}  rps {rps:+7.1%}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--notes', type=int, default=20, help="заметок на пользователя")
+    parser.add_argument('--tags', type=int, default=100)
+    parser.add_argument('--tags-per-note', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=200, help="запросов на эндпоинт")
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--upload-size', type=int, default=64 * 1024, help="байт в одной загрузке")
+    parser.add_argument('--endpoint', action='append', help="только эти эндпоинты, например 'GET /notes'")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="файл для JSON, по умолчанию stdout")
+    parser.add_argument('--compare', help="JSON прошлого прогона")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    folder = tempfile.mkdtemp()
+    app.config.update({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(folder, 'bench.db'),
+        'UPLOAD_FOLDER': os.path.join(folder, 'upload'),
+    })
+    app.debug = False
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        usernames, user_ids, tag_ids = seed(args.users, args.notes, args.tags, args.tags_per_note)
+        bench_note_ids = [note_id for (note_id,) in
+                          db.session.query(NoteModel.id).filter(NoteModel.author_id == user_ids[0])]
+        db.session.remove()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        "python": platform.python_version(),
+        "dataset": {"users": args.users, "notes_per_user": args.notes, "tags": args.tags,
+                    "tags_per_note": args.tags_per_note},
+        "config": {key: app.config[key] for key in ('DATABASE_PROFILE', 'RESPONSE_CACHE_ENABLED',
+                                                    'FAST_SERIALIZER', 'METRICS_ENABLED')},
+        "endpoints": {},
+    }
+    counter = StatementCounter()
+    try:
+        for name, request in scenarios(usernames, bench_note_ids, tag_ids, args.upload_size).items():
+            if args.endpoint and name not in args.endpoint:
+                continue
+            result = run_scenario(client, request, args.requests, args.warmup, counter)
+            results["endpoints"][name] = result
+            print(f"{name:26} {result['throughput_rps']:>8.1f} req/s  p50 {result['latency_ms']['p50']:>8.2f} ms  "
+                  f"p99 {result['latency_ms']['p99']:>8.2f} ms  {result['sql_statements_per_request']:>5} sql/req",
+                  file=sys.stderr)
+    finally:
+        counter.close()
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        shutil.rmtree(folder)
+    # ru_maxrss - килобайты на Linux
+    results["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Пропускная способность создания заметок: N запросов POST /notes против одного POST /notes/batch.
+
+Запуск: python -m benchmarks.batch [число заметок]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from base64 import b64encode
+
+from app import app
+from api import db
+from api.models.user import UserModel
+
+
+def main(notes_count=1000):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    app.debug = False
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        UserModel(username='bench', password='bench').save()
+    headers = {'Authorization': 'Basic ' + b64encode(b'bench:bench').decode('ascii')}
+
+    start = time.perf_counter()
+    for i in range(notes_count):
+        client.post('/notes', headers=headers, content_type='application/json',
+                    data=json.dumps({"text": f"Note {i}"}))
+    single = time.perf_counter() - start
+
+    operations = [{"op": "create", "text": f"Note {i}"} for i in range(notes_count)]
+    start = time.perf_counter()
+    res = client.post('/notes/batch', headers=headers, content_type='application/json',
+                      data=json.dumps({"operations": operations}))
+    batch = time.perf_counter() - start
+    assert res.status_code == 200, res.data
+
+    print(f"POST /notes       {notes_count} notes: {single:.2f} s, {notes_count / single:.0f} notes/s")
+    print(f"POST /notes/batch {notes_count} notes: {batch:.2f} s, {notes_count / batch:.0f} notes/s")
+    with app.app_context():
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,61 @@
+"""
+Сравнение marshmallow (marshal_with) и helpers.serialization на странице заметок.
+
+Запуск: python -m benchmarks.serializer [число заметок] [повторы]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+from flask import jsonify
+
+from app import app
+from api import db
+from api.models.user import UserModel
+from api.models.note import NoteModel
+from api.models.tag import TagModel
+from api.schemas.note import NotesPageSchema, NoteSchema
+from helpers.loading import load_for
+from helpers.serialization import compile_schema, encode_json
+
+
+def seed(notes_count, authors=20, tags_count=5):
+    tags = [TagModel(name=f'tag{i}') for i in range(tags_count)]
+    db.session.add_all(tags)
+    users = [UserModel(username=f'user{i}', password='password') for i in range(authors)]
+    db.session.add_all(users)
+    db.session.flush()
+    for i in range(notes_count):
+        note = NoteModel(author_id=users[i % authors].id, text=f'Note {i}', private=False)
+        note.tags.extend(tags[:i % tags_count])
+        db.session.add(note)
+    db.session.commit()
+
+
+def main(notes_count=500, repeat=20):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    app.debug = False
+    with app.test_request_context('/notes/public/filter'):
+        db.create_all()
+        seed(notes_count)
+        notes = load_for(NoteSchema, NoteModel.query).all()
+        page = {"items": notes, "_links": {"self": "/notes/public/filter", "next": None}}
+        schema = NotesPageSchema()
+
+        def marshmallow_path():
+            return jsonify(schema.dump(page)).get_data()
+
+        def fast_path():
+            return encode_json(compile_schema(NotesPageSchema).dump(page))
+
+        assert marshmallow_path() == fast_path()
+        for name, func in (("marshmallow", marshmallow_path), ("fast", fast_path)):
+            best = min(timeit.repeat(func, number=1, repeat=repeat))
+            print(f"{name:12} {notes_count} notes: {best * 1000:.2f} ms")
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,56 @@
+"""
+Задержка поиска пользователей: LIKE '%...%' по таблице против индекса триграмм.
+
+Запуск: python -m benchmarks.user_search [число пользователей ...]
+"""
+import os
+import random
+import string
+import sys
+import tempfile
+import timeit
+
+from app import app
+from api import db
+from api.models.user import UserModel
+from api.models.search import search_users, username_index
+
+QUERIES = ['ale', 'xq', 'user12', 'zzzz']
+
+
+def seed(users_count):
+    random.seed(users_count)
+    password_hash = UserModel('seed', 'seed').password_hash
+    rows = []
+    for i in range(users_count):
+        name = ''.join(random.choices(string.ascii_lowercase, k=random.randint(4, 12)))
+        rows.append({"username": f"{name}{i}", "password_hash": password_hash, "role": "simple_user"})
+    db.session.bulk_insert_mappings(UserModel, rows)
+    db.session.commit()
+
+
+def main(*sizes):
+    app.debug = False
+    for users_count in sizes or (1000, 10000, 100000):
+        path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+        with app.app_context():
+            db.engine.dispose()
+            db.create_all()
+            seed(users_count)
+            username_index.clear()
+            search_users('warmup', False, 20)  # загрузка индекса
+
+            def like_scan(query):
+                return UserModel.query.filter(UserModel.username.like(f'%{query}%')).limit(20).all()
+
+            for name, func in (("like", like_scan), ("trigram", lambda query: search_users(query, False, 20)),
+                               ("prefix", lambda query: search_users(query, True, 20))):
+                best = min(timeit.repeat(lambda: [func(query) for query in QUERIES], number=1, repeat=5))
+                print(f"{name:8} {users_count:>7} users: {best * 1000 / len(QUERIES):.2f} ms/query")
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
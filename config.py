@@ -1,6 +1,7 @@
 import os
 from apispec import APISpec
 from apispec.ext.marshmallow import MarshmallowPlugin
+from sqlalchemy.pool import QueuePool
 
 base_dir = os.path.dirname(os.path.abspath(__file__))
 security_definitions = {
@@ -10,9 +11,42 @@ security_definitions = {
 }
 ma_plugin = MarshmallowPlugin()
 
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 30000))  # мс, дольше - запрос прерывается
+# Профили движка БД: параметры пула (SQLALCHEMY_ENGINE_OPTIONS) и PRAGMA для каждого соединения SQLite
+DATABASE_PROFILES = {
+    # один процесс разработчика: соединение на запрос, ожидание блокировки вместо "database is locked"
+    'sqlite-dev': {
+        'engine_options': {},
+        'sqlite_pragmas': {'busy_timeout': 5000},
+    },
+    # несколько воркеров на одном файле: WAL позволяет читать во время записи
+    'sqlite-wal': {
+        'engine_options': {'poolclass': QueuePool, 'pool_size': 5, 'max_overflow': 10,
+                           'connect_args': {'check_same_thread': False}},
+        'sqlite_pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000,
+                           'temp_store': 'MEMORY', 'cache_size': -16000},
+    },
+    # gunicorn с несколькими воркерами: на воркер pool_size + max_overflow соединений
+    'postgres-pooled': {
+        'engine_options': {'pool_size': 10, 'max_overflow': 20, 'pool_timeout': 10,
+                           'pool_recycle': 1800, 'pool_pre_ping': True,
+                           'connect_args': {'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'}},
+        'sqlite_pragmas': {},
+    },
+}
+
 class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(base_dir, 'base.db')
     TEST_DATABASE_URI = 'sqlite:///' + os.path.join(base_dir, 'test.db')
+    DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE') or \
+        ('postgres-pooled' if SQLALCHEMY_DATABASE_URI.startswith('postgres') else 'sqlite-dev')
+    SQLALCHEMY_ENGINE_OPTIONS = DATABASE_PROFILES[DATABASE_PROFILE]['engine_options']
+    SQLITE_PRAGMAS = DATABASE_PROFILES[DATABASE_PROFILE]['sqlite_pragmas']
+    # реплики для чтения в GET-запросах, через запятую; binds называются replica0, replica1, ...
+    REPLICA_DATABASE_URIS = [uri for uri in os.environ.get('REPLICA_DATABASE_URLS', '').split(',') if uri]
+    SQLALCHEMY_BINDS = {f'replica{index}': uri for index, uri in enumerate(REPLICA_DATABASE_URIS)}
+    REPLICA_MAX_LAG = 2  # секунд отставания, при большем чтение идет с основной БД
+    REPLICA_LAG_CHECK_INTERVAL = 5  # секунд между проверками отставания
     SQLALCHEMY_TRACK_MODIFICATIONS = False  # Зачем эта настройка: https://flask-sqlalchemy-russian.readthedocs.io/ru/latest/config.html#id2
     DEBUG = True
     PORT = 5000
@@ -32,7 +66,54 @@ class Config:
     APISPEC_SWAGGER_UI_URL = '/swagger-ui'  # URI UI of API Doc
     UPLOAD_FOLDER_NAME = 'upload'
     UPLOAD_FOLDER = os.path.join(base_dir, UPLOAD_FOLDER_NAME)
+    UPLOAD_MAX_SIZE = 512 * 1024 * 1024  # байт в одном файле
+    UPLOAD_CHUNK_SIZE = 64 * 1024  # байт, читаемых из запроса за раз
+    MAX_CONTENT_LENGTH = UPLOAD_MAX_SIZE + 1024 * 1024  # запас на заголовки multipart
+    # nginx: location /protected-uploads/ { internal; alias <UPLOAD_FOLDER>/; }
+    UPLOAD_ACCEL_REDIRECT_PREFIX = os.environ.get('UPLOAD_ACCEL_REDIRECT_PREFIX')
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+    BLOB_GC_GRACE = 24 * 3600  # секунд без ссылок, после которых flask blobs-gc удаляет файл
+    IMAGE_VARIANTS = {'thumb': 128, 'medium': 640}  # имя --> максимальная сторона в пикселях
+    DERIVATIVE_WORKERS = int(os.environ.get('DERIVATIVE_WORKERS', 2))  # процессов генерации копий
+    DERIVATIVE_MAX_PENDING = 64  # задач в очереди, сверх лимита новые отклоняются
+    DERIVATIVE_FAILED_TTL = 3600  # секунд хранения ошибок задач в памяти
+    DERIVATIVE_FAILED_MAX = 1000  # ошибок в памяти, сверх лимита удаляются самые старые
+    JOB_MAX_ATTEMPTS = 3  # попыток выполнить фоновую задачу
+    JOB_RETRY_DELAY = 10  # секунд до повтора, удваивается с каждой попыткой
+    JOB_VISIBILITY_TIMEOUT = 300  # секунд, после которых задачу упавшего воркера берет другой
+    JOB_POLL_INTERVAL = 1  # секунд между проверками пустой очереди
+    USER_DELETE_CHUNK_SIZE = 500  # заметок, удаляемых одной транзакцией
+    USER_DELETE_SYNC_MAX_NOTES = 1000  # больше заметок - удаление уходит в фоновую задачу
+    USER_IMPORT_WORKERS = int(os.environ.get('USER_IMPORT_WORKERS', os.cpu_count() or 1))  # процессов хэширования
+    USER_BULK_WORKERS = int(os.environ.get('USER_BULK_WORKERS', 2))  # процессов хэширования /users/bulk на воркер
+    USER_IMPORT_BATCH_SIZE = 500  # пользователей, вставляемых одной транзакцией
+    USER_BULK_MAX_SIZE = 1000  # пользователей в одном запросе /users/bulk, больше - через flask users import
+    # больше пользователей - /users/bulk уходит в фоновую задачу: хэш пароля ~0.5 с,
+    # синхронный запрос занимает веб-воркер на USER_BULK_SYNC_MAX_SIZE * 0.5 / USER_BULK_WORKERS секунд
+    USER_BULK_SYNC_MAX_SIZE = 20
+    # архивные заметки переносятся в таблицу note_archive (flask notes-archive-move для уже архивных)
+    NOTE_COLD_STORAGE = os.environ.get('NOTE_COLD_STORAGE', '').lower() in ('1', 'true', 'yes')
     LANGUAGES = ['en', 'ru']
+    PAGE_SIZE = 50  # размер страницы списков по умолчанию
+    MAX_PAGE_SIZE = 500
+    MAX_BATCH_SIZE = 1000  # операций в одном запросе /notes/batch
+    # конфигурация to_tsvector для полнотекстового поиска на Postgres; по ней же строится
+    # GIN-индекс ix_note_model_text_tsv, после смены индекс нужно пересоздать
+    SEARCH_TS_CONFIG = 'simple'
+    USER_SEARCH_INDEX_TTL = 300  # секунды до полной перезагрузки индекса имен (SQLite)
+    FAST_SERIALIZER = True  # списки сериализуются helpers.serialization вместо marshmallow
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+    METRICS_PATH = '/metrics'  # формат Prometheus
+    RESPONSE_CACHE_ENABLED = True  # кэш ответов публичных GET-эндпоинтов (helpers.response_cache)
+    RESPONSE_CACHE_TTL = 60  # секунды
+    RESPONSE_CACHE_SIZE = 1024
+    RESPONSE_CACHE_BACKEND = None  # путь к классу CacheBackend, например 'mymodule:RedisBackend'
+    AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 1024))  # 0 - кэш проверенных паролей отключен
+    AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', 300))  # секунды
+    AUTH_TOKEN_EXPIRATION = 600  # секунды
+    # True - токен несет id/role/username и проверяется без запроса к БД
+    AUTH_TOKEN_STATELESS = os.environ.get('AUTH_TOKEN_STATELESS', '').lower() in ('1', 'true', 'yes')
 
 #     MAIL_SERVER = 'smtp.googlemail.com'
 #     MAIL_PORT = 465
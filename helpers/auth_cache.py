@@ -0,0 +1,112 @@
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+
+class CredentialCache:
+    """
+    Кэш успешно проверенных пар (username, пароль) --> user id.
+
+    Пароль в кэше не хранится: ключом служит HMAC от пароля на SECRET_KEY.
+    Вместе с id запоминаются password_hash и role пользователя; при попадании
+    они сверяются с загруженной строкой, поэтому смена пароля или роли
+    (в том числе в другом воркере) автоматически делает запись недействительной.
+    """
+
+    def __init__(self, secret_key, maxsize=1024, ttl=300):
+        self.secret_key = secret_key.encode() if isinstance(secret_key, str) else secret_key
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, username, password):
+        digest = hmac.new(self.secret_key, password.encode('utf-8'), hashlib.sha256).hexdigest()
+        return username, digest
+
+    def lookup(self, username, password, user):
+        """
+        True, если пара уже проверялась и данные пользователя с тех пор не менялись
+        """
+        if not self.maxsize or user is None or password is None:
+            return False
+        key = self._key(username, password)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                user_id, password_hash, role, expires_at = entry
+                if expires_at > now and user_id == user.id \
+                        and password_hash == user.password_hash and role == user.role:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True
+                del self._entries[key]
+            self.misses += 1
+        return False
+
+    def store(self, username, password, user):
+        if not self.maxsize:
+            return
+        key = self._key(username, password)
+        with self._lock:
+            self._entries[key] = (user.id, user.password_hash, user.role, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username=None):
+        """
+        Удаляет записи пользователя username (или все записи, если username не задан)
+        """
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == username]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class TokenRevocationCache:
+    """
+    Отзыв stateless-токенов внутри процесса: user id --> момент отзыва.
+
+    Токен, выпущенный раньше момента отзыва, считается недействительным.
+    Записи старше максимального срока жизни токена больше не нужны и удаляются.
+    """
+
+    def __init__(self, max_token_age=600, maxsize=10000):
+        self.max_token_age = max_token_age
+        self.maxsize = maxsize
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, user_id):
+        now = time.time()
+        with self._lock:
+            self._revoked[user_id] = now
+            if len(self._revoked) > self.maxsize:
+                self._prune(now)
+
+    def is_revoked(self, user_id, issued_at):
+        revoked_at = self._revoked.get(user_id)
+        return revoked_at is not None and issued_at <= revoked_at
+
+    def _prune(self, now):
+        border = now - self.max_token_age
+        for user_id in [user_id for user_id, revoked_at in self._revoked.items() if revoked_at < border]:
+            del self._revoked[user_id]
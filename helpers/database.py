@@ -0,0 +1,181 @@
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app, has_request_context, request
+from flask_apispec.views import MethodResource
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.dml import UpdateBase
+
+logger = logging.getLogger(__name__)
+
+
+def init_sqlite_pragmas(app):
+    """
+    Выполняет SQLITE_PRAGMAS (профиль DATABASE_PROFILE) на каждом новом соединении SQLite
+    """
+    @event.listens_for(Engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in app.config['SQLITE_PRAGMAS'].items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+
+def pool_stats(engine):
+    """
+    Состояние пула соединений engine; у пулов без очереди (NullPool, StaticPool) - только класс
+    """
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__, "dialect": engine.dialect.name}
+    if hasattr(pool, 'checkedout'):
+        stats.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                     overflow=pool.overflow(), max_overflow=pool._max_overflow, timeout=pool.timeout())
+    return stats
+
+
+def replica_lag(engine):
+    """
+    Отставание реплики в секундах. Для СУБД без сведений о репликации (SQLite) - 0
+    """
+    if engine.dialect.name == 'postgresql':
+        with engine.connect() as connection:
+            return connection.execute(
+                "SELECT CASE WHEN pg_is_in_recovery() "
+                "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+                "ELSE 0 END").scalar()
+    return 0
+
+
+class ReplicaRouter:
+    """
+    Выбирает реплику для чтения: по кругу среди binds "replica*" из SQLALCHEMY_BINDS,
+    пропуская те, чье отставание больше REPLICA_MAX_LAG или которые недоступны.
+    Отставание (probe) проверяется не чаще раза в REPLICA_LAG_CHECK_INTERVAL секунд.
+    """
+
+    def __init__(self, probe=replica_lag):
+        self.probe = probe
+        self._lags = {}  # bind --> (отставание или None, время проверки)
+        self._next = itertools.count()
+        self._lock = threading.Lock()  # _lags и _next общие для потоков воркера
+
+    def replica_binds(self, app):
+        return sorted(bind for bind in app.config['SQLALCHEMY_BINDS'] or {} if bind.startswith('replica'))
+
+    def lag(self, bind, engine, interval):
+        with self._lock:
+            lag, checked_at = self._lags.get(bind, (None, None))
+        if checked_at is None or time.monotonic() - checked_at >= interval:
+            # probe - запрос к реплике, выполняется без блокировки
+            try:
+                lag = self.probe(engine)
+            except Exception:
+                logger.warning("Read replica %s is unavailable", bind, exc_info=True)
+                lag = None
+            with self._lock:
+                self._lags[bind] = (lag, time.monotonic())
+        return lag
+
+    def engine_for_read(self, db, app):
+        binds = self.replica_binds(app)
+        with self._lock:
+            start = next(self._next)
+        for offset in range(len(binds)):
+            bind = binds[(start + offset) % len(binds)]
+            engine = db.get_engine(app, bind=bind)
+            lag = self.lag(bind, engine, app.config['REPLICA_LAG_CHECK_INTERVAL'])
+            if lag is not None and lag <= app.config['REPLICA_MAX_LAG']:
+                return engine
+        return None
+
+    def reset(self):
+        with self._lock:
+            self._lags.clear()
+
+
+def reads_from_replica():
+    """
+    Читать с реплики можно в GET/HEAD-запросах к MethodResource
+    """
+    if not has_request_context() or request.method not in ('GET', 'HEAD'):
+        return False
+    view_class = getattr(current_app.view_functions.get(request.endpoint), 'view_class', None)
+    return view_class is not None and issubclass(view_class, MethodResource)
+
+
+class RoutingSession(SignallingSession):
+    """
+    Сессия, отправляющая чтения GET-обработчиков на реплику.
+    Реплика выбирается один раз на сессию (то есть на запрос), чтобы все чтения запроса
+    видели одно состояние данных; выбор сбрасывается в close() - его вызывает и db.session.remove().
+    После первой записи (flush или DML) сессия до конца запроса работает только с основной БД,
+    так что запрос видит собственные изменения.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if isinstance(clause, UpdateBase) or self._flushing:
+            self.info['primary'] = True
+        if not self.info.get('primary') and reads_from_replica() \
+                and not (mapper is not None and mapper.persist_selectable.info.get('bind_key')):
+            if 'replica' not in self.info:
+                state = get_state(self.app)
+                # None - подходящей реплики нет, до конца сессии читаем с основной БД
+                self.info['replica'] = state.db.router.engine_for_read(state.db, self.app)
+            if self.info['replica'] is not None:
+                return self.info['replica']
+        return super().get_bind(mapper, clause)
+
+    def close(self):
+        self.info.pop('replica', None)
+        self.info.pop('primary', None)
+        super().close()
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def __init__(self, *args, **kwargs):
+        self.router = ReplicaRouter()
+        super().__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+@contextmanager
+def capture_statements():
+    """
+    Собирает (statement, parameters) SELECT-запросов, выполненных внутри блока
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def explain(connection, statement, parameters):
+    """
+    План запроса строками: EXPLAIN QUERY PLAN на SQLite, EXPLAIN на Postgres
+    """
+    if connection.dialect.name == 'sqlite':
+        depth = {0: -1}
+        lines = []
+        for node_id, parent, _, detail in connection.execute("EXPLAIN QUERY PLAN " + statement, parameters):
+            depth[node_id] = depth.get(parent, -1) + 1
+            lines.append("  " * depth[node_id] + detail)
+        return lines
+    if connection.dialect.name == 'postgresql':
+        return [line for (line,) in connection.execute("EXPLAIN " + statement, parameters)]
+    return [f"EXPLAIN is not supported for {connection.dialect.name}"]
@@ -0,0 +1,161 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from helpers.uploads import blob_path
+
+try:
+    import PIL
+except ImportError:  # без Pillow уменьшенные копии не строятся, отдаются оригиналы
+    PIL = None
+
+
+def variant_path(variant, digest):
+    """
+    Путь уменьшенной копии относительно UPLOAD_FOLDER: variants/<variant>/ab/cd/abcd...
+    """
+    return os.path.join('variants', variant, blob_path(digest))
+
+
+def render_variants(source, targets):
+    """
+    Выполняется в процессе пула: сохраняет уменьшенные копии source.
+    targets - {путь: максимальная сторона}; каждый файл пишется атомарно
+    """
+    from PIL import Image
+    with Image.open(source) as image:
+        image.load()
+        for target, max_side in targets.items():
+            variant = image.copy()
+            variant.thumbnail((max_side, max_side), Image.LANCZOS)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.variant-')
+            try:
+                with os.fdopen(fd, 'wb') as output:
+                    variant.save(output, format=image.format or 'PNG')
+                os.replace(temp_path, target)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+    return sorted(targets)
+
+
+def is_image(path):
+    """
+    Проверяет, что Pillow распознает файл как изображение (читает только сам файл, без декодирования)
+    """
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except Exception:
+        return False
+    return True
+
+
+class DerivativePipeline:
+    """
+    Фоновая генерация уменьшенных копий изображений в пуле процессов.
+
+    Задача идентифицируется digest'ом blob'а: готовность видна по файлам на диске
+    (в том числе из других воркеров), очередь и ошибки - в памяти процесса.
+    Не больше max_pending задач одновременно; сверх лимита задачи отклоняются.
+    Файлы, которые не являются изображениями, в пул не попадают. Ошибки хранятся
+    DERIVATIVE_FAILED_TTL секунд и не больше DERIVATIVE_FAILED_MAX штук.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._jobs = {}  # digest --> {"status": ..., "error": ..., "future": ..., "failed_at": ...}
+        self._lock = threading.Lock()
+
+    def _pool(self, config):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=config['DERIVATIVE_WORKERS'])
+        return self._executor
+
+    def _evict_failed(self, config):
+        # вызывается под self._lock
+        failed = sorted((job["failed_at"], digest) for digest, job in self._jobs.items()
+                        if job["status"] == "failed")
+        expired = time.monotonic() - config['DERIVATIVE_FAILED_TTL']
+        excess = len(failed) - config['DERIVATIVE_FAILED_MAX']
+        for index, (failed_at, digest) in enumerate(failed):
+            if failed_at >= expired and index >= excess:
+                break
+            del self._jobs[digest]
+
+    def pending(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job["status"] in ("queued", "running"))
+
+    def submit(self, digest, mimetype=None):
+        """
+        Ставит задачу для blob'а digest. mimetype - сохраненный при загрузке тип: если он
+        известен и это не image/*, файл не открывается; иначе тип проверяется по содержимому.
+        Возвращает done / queued / running / rejected / unsupported / unavailable
+        """
+        config = current_app.config
+        if PIL is None or not config['IMAGE_VARIANTS']:
+            return "unavailable"
+        folder = config['UPLOAD_FOLDER']
+        targets = {os.path.join(folder, variant_path(variant, digest)): max_side
+                   for variant, max_side in config['IMAGE_VARIANTS'].items()}
+        if all(os.path.exists(target) for target in targets):
+            return "done"
+        source = os.path.join(folder, blob_path(digest))
+        if mimetype and mimetype != 'application/octet-stream' and not mimetype.startswith('image/') \
+                or not is_image(source):
+            return "unsupported"
+        with self._lock:
+            self._evict_failed(config)
+            job = self._jobs.get(digest)
+            if job is not None and job["status"] in ("queued", "running"):
+                return job["status"]
+            if sum(1 for job in self._jobs.values() if job["status"] in ("queued", "running")) \
+                    >= config['DERIVATIVE_MAX_PENDING']:
+                return "rejected"
+            future = self._pool(config).submit(render_variants, source, targets)
+            self._jobs[digest] = {"status": "queued", "error": None, "future": future, "failed_at": None}
+        future.add_done_callback(lambda future: self._finished(digest, future))
+        return "queued"
+
+    def _finished(self, digest, future):
+        with self._lock:
+            job = self._jobs[digest]
+            error = future.exception()
+            if error is None:
+                # готовые задачи видны по файлам, в памяти храним только ошибки
+                del self._jobs[digest]
+            else:
+                job.update(status="failed", error=str(error) or type(error).__name__, future=None,
+                           failed_at=time.monotonic())
+
+    def status(self, digest):
+        """
+        done / queued / running / failed (с текстом ошибки) или None, если задачи не было
+        """
+        config = current_app.config
+        with self._lock:
+            self._evict_failed(config)
+            job = self._jobs.get(digest)
+            if job is not None:
+                if job["status"] == "queued" and job["future"].running():
+                    job["status"] = "running"
+                return {"status": job["status"], "error": job["error"]}
+        folder = config['UPLOAD_FOLDER']
+        if config['IMAGE_VARIANTS'] and all(os.path.exists(os.path.join(folder, variant_path(variant, digest)))
+                                            for variant in config['IMAGE_VARIANTS']):
+            return {"status": "done", "error": None}
+        return None
+
+    def wait(self, digest, timeout=None):
+        with self._lock:
+            job = self._jobs.get(digest)
+        if job is not None and job["future"] is not None:
+            try:
+                job["future"].result(timeout)
+            except Exception:
+                pass
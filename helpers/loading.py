@@ -0,0 +1,13 @@
+from sqlalchemy.orm import selectinload
+
+
+def load_for(schema, query):
+    """
+    Добавляет в query eager-загрузку связей, которые затронет schema при сериализации.
+
+    Связи перечисляются в schema.Meta.eager_load; каждая загружается одним
+    SELECT ... WHERE id IN (...), поэтому число запросов на список не зависит от его длины.
+    """
+    model = schema.Meta.model
+    relationships = getattr(schema.Meta, "eager_load", ())
+    return query.options(*[selectinload(getattr(model, name)) for name in relationships])
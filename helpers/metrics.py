@@ -0,0 +1,170 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context, request
+from flask_apispec.wrapper import Wrapper
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+class Histogram:
+    """
+    Гистограмма Prometheus с метками: накопительные бакеты, сумма и число наблюдений
+    """
+
+    def __init__(self, name, documentation, buckets, labels):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labels = labels
+        self._values = {}  # значения меток --> [счетчики бакетов..., +Inf], сумма
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            counts, total = self._values.get(label_values) or ([0] * (len(self.buckets) + 1), 0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[label_values] = (counts, total + value)
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, (counts, total) in values:
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+@contextmanager
+def section(name):
+    """
+    Добавляет время блока к разделу name текущего запроса (auth, serialize, ...)
+    """
+    timings = g.get('request_metrics') if has_request_context() else None
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + time.perf_counter() - start
+
+
+class RequestMetrics:
+    """
+    Метрики запросов по эндпоинтам: время ответа, число и время SQL-запросов,
+    время сериализации и аутентификации, размер ответа.
+
+    Отдаются в формате Prometheus по METRICS_PATH и, при METRICS_SERVER_TIMING,
+    в заголовке Server-Timing каждого ответа. При METRICS_ENABLED = False
+    обработчики и события не регистрируются вовсе.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        labels = ("endpoint", "method")
+        self.duration = Histogram("http_request_duration_seconds", "Request wall time", TIME_BUCKETS, labels)
+        self.db_statements = Histogram("db_statements_per_request", "SQL statements per request",
+                                       COUNT_BUCKETS, labels)
+        self.db_time = Histogram("db_time_seconds", "Time in SQL statements per request", TIME_BUCKETS, labels)
+        self.serialize_time = Histogram("serialization_seconds", "Response serialization time per request",
+                                        TIME_BUCKETS, labels)
+        self.auth_time = Histogram("auth_seconds", "Authentication time per request", TIME_BUCKETS, labels)
+        self.response_size = Histogram("http_response_size_bytes", "Response body size", SIZE_BUCKETS, labels)
+        self.histograms = [self.duration, self.db_statements, self.db_time,
+                           self.serialize_time, self.auth_time, self.response_size]
+
+    def init_app(self, app):
+        """
+        Вызывается до остальных before_request, чтобы учитывать и ответы из кэша
+        """
+        if not app.config['METRICS_ENABLED']:
+            return
+        self.enabled = True
+        self.server_timing = app.config['METRICS_SERVER_TIMING']
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule(app.config['METRICS_PATH'], 'metrics', self._metrics_view)
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _instrument_marshal_with()
+
+    def _before_request(self):
+        g.request_metrics = {"start": time.perf_counter(), "db_statements": 0, "db": 0}
+
+    def _after_request(self, response):
+        timings = g.pop('request_metrics', None)
+        if timings is None:
+            return response
+        total = time.perf_counter() - timings["start"]
+        labels = (request.endpoint or "unknown", request.method)
+        self.duration.observe(labels, total)
+        self.db_statements.observe(labels, timings["db_statements"])
+        self.db_time.observe(labels, timings["db"])
+        self.serialize_time.observe(labels, timings.get("serialize", 0))
+        self.auth_time.observe(labels, timings.get("auth", 0))
+        size = response.content_length
+        if size is None and not response.direct_passthrough and not response.is_streamed:
+            size = len(response.get_data())
+        if size is not None:
+            self.response_size.observe(labels, size)
+        if self.server_timing:
+            parts = [f'db;dur={timings["db"] * 1000:.2f};desc="{timings["db_statements"]} queries"']
+            for name in ("auth", "serialize"):
+                if name in timings:
+                    parts.append(f"{name};dur={timings[name] * 1000:.2f}")
+            parts.append(f"total;dur={total * 1000:.2f}")
+            response.headers["Server-Timing"] = ", ".join(parts)
+        return response
+
+    def expose(self):
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.expose())
+        return "\n".join(lines) + "\n"
+
+    def _metrics_view(self):
+        return current_app.response_class(self.expose(), mimetype="text/plain; version=0.0.4")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'request_metrics' in g:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if starts and has_request_context() and 'request_metrics' in g:
+        timings = g.request_metrics
+        timings["db_statements"] += 1
+        timings["db"] += time.perf_counter() - starts.pop()
+
+
+def _instrument_marshal_with():
+    # marshal_with сериализует в Wrapper flask_apispec, вне кода обработчика
+    if getattr(Wrapper.marshal_result, 'instrumented', False):
+        return
+    marshal_result = Wrapper.marshal_result
+
+    def timed_marshal_result(self, result, status_code):
+        with section("serialize"):
+            return marshal_result(self, result, status_code)
+
+    timed_marshal_result.instrumented = True
+    Wrapper.marshal_result = timed_marshal_result
@@ -0,0 +1,70 @@
+from config import Config
+from flask import request, url_for
+from marshmallow import validate
+from webargs import fields
+
+# Параметры keyset-пагинации: limit - размер страницы, after - id последнего элемента предыдущей страницы
+pagination_args = {
+    "limit": fields.Int(load_default=Config.PAGE_SIZE,
+                        validate=validate.Range(min=1, max=Config.MAX_PAGE_SIZE),
+                        metadata={"description": f"Page size, {Config.PAGE_SIZE} by default, "
+                                                 f"at most {Config.MAX_PAGE_SIZE}"}),
+    "after": fields.Int(metadata={"description": "Cursor: return items with id greater than this value"}),
+}
+
+# Параметры пагинации для выдачи, упорядоченной не по id (например, по релевантности)
+offset_pagination_args = {
+    "limit": pagination_args["limit"],
+    "offset": fields.Int(load_default=0, validate=validate.Range(min=0),
+                         metadata={"description": "Number of items to skip"}),
+}
+
+
+def paginate(query, key, limit, after=None):
+    """
+    Возвращает одну страницу query, упорядоченного по возрастанию key,
+    в виде {"items": [...], "_links": {"self": ..., "next": ...}}.
+    В память загружается не больше limit + 1 строк независимо от размера таблицы.
+    """
+    if after is not None:
+        query = query.filter(key > after)
+    items = query.order_by(key).limit(limit + 1).all()
+    next_link = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_link = _page_url(after=getattr(items[-1], key.key), limit=limit)
+    return {
+        "items": items,
+        "_links": {
+            "self": _page_url(after=after, limit=limit),
+            "next": next_link,
+        }
+    }
+
+
+def paginate_offset(query, limit, offset=0):
+    """
+    То же, что paginate, но для уже упорядоченного query: страницы по limit/offset
+    """
+    items = query.offset(offset).limit(limit + 1).all()
+    next_link = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_link = _page_url(offset=offset + limit, limit=limit)
+    return {
+        "items": items,
+        "_links": {
+            "self": _page_url(offset=offset, limit=limit),
+            "next": next_link,
+        }
+    }
+
+
+def _page_url(**params):
+    values = request.args.to_dict()
+    for name, value in params.items():
+        if value is None:
+            values.pop(name, None)
+        else:
+            values[name] = value
+    return url_for(request.endpoint, **(request.view_args or {}), **values)
@@ -0,0 +1,152 @@
+import hashlib
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from flask import current_app, g, request
+from werkzeug.utils import import_string
+
+
+class CacheBackend(ABC):
+    """
+    Интерфейс хранилища кэша ответов. Для общего между воркерами кэша
+    (например, Redis) достаточно реализовать эти методы.
+    """
+
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    @abstractmethod
+    def set(self, key, value, ttl):
+        pass
+
+    @abstractmethod
+    def incr(self, key):
+        """Атомарно увеличивает счетчик key и возвращает новое значение"""
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+
+class LRUCacheBackend(CacheBackend):
+    """
+    Кэш в памяти процесса с вытеснением давно неиспользуемых записей и TTL
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._counters = {}  # счетчики не вытесняются, иначе сбросились бы версии
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+def cached_resource(*namespaces):
+    """
+    Помечает ресурс: его GET-ответы кэшируются и сбрасываются
+    при изменении данных любого из namespaces
+    """
+    def decorator(cls):
+        cls.cache_namespaces = namespaces
+        return cls
+    return decorator
+
+
+class ResponseCache:
+    """
+    Кэш готовых ответов публичных GET-эндпоинтов с сильными ETag.
+
+    Ключ: эндпоинт + путь с query string + язык (flask_babel) + версии namespaces.
+    invalidate(namespace) увеличивает версию, и старые записи больше не находятся.
+    При совпадении If-None-Match отвечает 304 без запроса к БД и сериализации.
+    """
+
+    def __init__(self, backend=None, ttl=60, locale_selector=None):
+        self.backend = backend or LRUCacheBackend()
+        self.ttl = ttl
+        self.enabled = True
+        self.locale_selector = locale_selector
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['RESPONSE_CACHE_ENABLED']
+        self.ttl = config['RESPONSE_CACHE_TTL']
+        if config['RESPONSE_CACHE_BACKEND']:
+            self.backend = import_string(config['RESPONSE_CACHE_BACKEND'])()
+        else:
+            self.backend = LRUCacheBackend(maxsize=config['RESPONSE_CACHE_SIZE'])
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            self.backend.incr(f"version:{namespace}")
+
+    def _namespaces(self, app_view):
+        view_class = getattr(app_view, 'view_class', None)
+        return getattr(view_class, 'cache_namespaces', None)
+
+    def _key(self, namespaces):
+        versions = self.backend.get_many([f"version:{namespace}" for namespace in namespaces])
+        locale = self.locale_selector() if self.locale_selector else ''
+        return "|".join([request.endpoint, request.full_path, str(locale)] + [str(version or 0) for version in versions])
+
+    def _before_request(self):
+        if not self.enabled or request.method != 'GET':
+            return None
+        namespaces = self._namespaces(current_app.view_functions.get(request.endpoint))
+        if not namespaces:
+            return None
+        g.response_cache_key = key = self._key(namespaces)
+        cached = self.backend.get(key)
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        body, etag, mimetype = cached
+        response = current_app.response_class(body, mimetype=mimetype)
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    def _after_request(self, response):
+        key = g.get('response_cache_key')
+        if key is None or response.status_code != 200 or response.direct_passthrough:
+            return response
+        if response.get_etag()[0] is None:  # ответ еще не из кэша
+            body = response.get_data()
+            etag = hashlib.sha1(body).hexdigest()
+            self.backend.set(key, (body, etag, response.mimetype), self.ttl)
+            response.set_etag(etag)
+            response.make_conditional(request)
+        return response
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
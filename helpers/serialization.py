@@ -0,0 +1,204 @@
+import re
+from flask import current_app, json, request, url_for
+from flask_marshmallow.fields import Hyperlinks, URLFor, _tpl
+from marshmallow import fields, missing
+from helpers.metrics import section
+
+try:
+    import orjson
+except ImportError:  # без orjson ответы кодируются через flask.json
+    orjson = None
+
+
+def fast_response(schema, result, code=200):
+    """
+    Сериализует result по schema без marshmallow и возвращает готовый Response.
+
+    Ответ совпадает байт в байт с тем, что вернул бы marshal_with(schema).
+    При FAST_SERIALIZER = False возвращает (result, code) для обычного marshal_with.
+    """
+    if not current_app.config['FAST_SERIALIZER']:
+        return result, code
+    with section("serialize"):
+        body = encode_json(compile_schema(schema).dump(result))
+    response = current_app.response_class(body, mimetype=current_app.config["JSONIFY_MIMETYPE"])
+    response.status_code = code
+    return response
+
+
+def encode_json(data):
+    """
+    То же, что тело flask.jsonify(data), но через orjson, когда это дает тот же результат
+    """
+    config = current_app.config
+    pretty = config["JSONIFY_PRETTYPRINT_REGULAR"] or current_app.debug
+    if orjson is not None and not pretty:
+        try:
+            body = orjson.dumps(data, option=orjson.OPT_SORT_KEYS if config["JSON_SORT_KEYS"] else 0)
+        except TypeError:
+            body = None
+        # экранирование символов у orjson и json отличается - такие ответы кодируем через flask.json
+        if body is not None and b'\\u' not in body and b'\x7f' not in body \
+                and (body.isascii() or not config["JSON_AS_ASCII"]):
+            return body + b"\n"
+    if pretty:
+        return json.dumps(data, indent=2, separators=(", ", ": ")) + "\n"
+    return json.dumps(data, indent=None, separators=(",", ":")) + "\n"
+
+
+_compiled = {}
+
+
+def compile_schema(schema):
+    """
+    Возвращает (и кэширует) скомпилированный сериализатор для класса или экземпляра схемы
+    """
+    compiled = _compiled.get(schema)
+    if compiled is None:
+        instance = schema() if isinstance(schema, type) else schema
+        compiled = _compiled[schema] = CompiledSchema(instance)
+    return compiled
+
+
+class CompiledSchema:
+    """
+    План сериализации схемы: список (ключ, атрибут, функция), построенный один раз
+    по schema.dump_fields. Поля без быстрого пути сериализуются самим marshmallow.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.many = schema.many
+        self.plan = [self._compile_field(name, field) for name, field in schema.dump_fields.items()]
+        self.fallback = any(schema._hooks[hook] for hook in
+                            (("pre_dump", False), ("pre_dump", True), ("post_dump", False), ("post_dump", True)))
+
+    def dump(self, obj, many=None, context=None):
+        many = self.many if many is None else many
+        if self.fallback:
+            return self.schema.dump(obj, many=many)
+        if context is None:
+            # состояние запроса читаем один раз на весь ответ, а не на каждую ссылку
+            context = (id(current_app.url_map), request.script_root)
+        if many:
+            return [self._dump_one(item, context) for item in obj]
+        return self._dump_one(obj, context)
+
+    def _dump_one(self, obj, context):
+        result = {}
+        is_dict = isinstance(obj, dict)
+        for key, attribute, serialize in self.plan:
+            if attribute is None:
+                value = serialize(obj, context)
+            else:
+                value = obj.get(attribute, missing) if is_dict else getattr(obj, attribute, missing)
+                if value is missing:
+                    continue
+                value = serialize(value, context)
+            if value is not missing:
+                result[key] = value
+        return result
+
+    def _compile_field(self, name, field):
+        key = field.data_key or name
+        attribute = field.attribute or name
+        if field.dump_default is not missing:
+            return key, None, self._generic(name, field)
+        field_type = type(field)
+        if field_type is fields.Integer and not field.as_string:
+            return key, attribute, _serialize_int
+        if field_type is fields.String:
+            return key, attribute, _serialize_str
+        if field_type is fields.Boolean:
+            return key, attribute, lambda value, context: _serialize_bool(field, value, attribute)
+        if field_type is fields.Nested:
+            nested = CompiledSchema(field.schema)
+            many = field.schema.many or field.many
+            return key, attribute, lambda value, context: \
+                None if value is None else nested.dump(value, many=many, context=context)
+        if field_type is Hyperlinks:
+            return key, None, _compile_links(field.schema)
+        return key, None, self._generic(name, field)
+
+    def _generic(self, name, field):
+        accessor = self.schema.get_attribute
+        return lambda obj, context: field.serialize(name, obj, accessor=accessor)
+
+
+def _serialize_int(value, context):
+    return None if value is None else int(value)
+
+
+def _serialize_str(value, context):
+    return None if value is None else str(value)
+
+
+def _serialize_bool(field, value, attribute):
+    if value is None or type(value) is bool:
+        return value
+    return field._serialize(value, attribute, None)
+
+
+def _compile_links(links):
+    """
+    Компилирует словарь Hyperlinks: URLFor заменяются шаблонами маршрутов
+    """
+    if isinstance(links, dict):
+        compiled = [(key, _compile_links(value)) for key, value in links.items()]
+        return lambda obj, context: {key: build(obj, context) for key, build in compiled}
+    if isinstance(links, (list, tuple)):
+        compiled = [_compile_links(value) for value in links]
+        return lambda obj, context: [build(obj, context) for build in compiled]
+    if isinstance(links, URLFor):
+        return _compile_url(links)
+    return lambda obj, context: links
+
+
+def _compile_url(field):
+    attributes = {}
+    static = {}
+    for name, attr_tpl in field.values.items():
+        attr_name = _tpl(str(attr_tpl))
+        if attr_name and "." not in attr_name:
+            attributes[name] = attr_name
+        elif attr_name:
+            return lambda obj, context: field.serialize(None, obj)
+        else:
+            static[name] = attr_tpl
+    templates = {}  # (url_map, script_root) --> шаблон
+
+    def build(obj, context):
+        params = {}
+        for name, attr_name in attributes.items():
+            value = obj.get(attr_name, missing) if isinstance(obj, dict) else getattr(obj, attr_name, missing)
+            if value is None:
+                return None
+            if type(value) is not int:  # шаблон подходит только для int-параметров
+                return field.serialize(None, obj)
+            params[name] = value
+        template = templates.get(context, missing)
+        if template is missing:
+            template = templates[context] = _url_template(field.endpoint, tuple(attributes), static)
+        if template is None:
+            return url_for(field.endpoint, **static, **params)
+        return "".join(str(params[part]) if index % 2 else part for index, part in enumerate(template))
+
+    return build
+
+
+_MARKER_BASE = 987654321000
+
+
+def _url_template(endpoint, names, static):
+    """
+    Шаблон URL маршрута: чередование литералов и имен параметров, построенный
+    одним вызовом url_for с числами-маркерами вместо значений
+    """
+    markers = {str(_MARKER_BASE + index): name for index, name in enumerate(names)}
+    url = url_for(endpoint, **static, **{name: int(marker) for marker, name in markers.items()})
+    if not markers:
+        return [url]
+    template = re.split("(" + "|".join(markers) + ")", url)
+    if sorted(template[1::2]) != sorted(markers):  # маркер не попал в URL или встретился дважды
+        return None
+    return [markers[part] if index % 2 else part for index, part in enumerate(template)]
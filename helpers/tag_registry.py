@@ -0,0 +1,87 @@
+import threading
+from collections import namedtuple
+from flask import g, has_request_context
+
+# тег из реестра: сериализуется TagSchema так же, как TagModel
+Tag = namedtuple("Tag", ("id", "name"))
+
+
+class TagRegistry:
+    """
+    Реестр тегов id <--> name в памяти процесса.
+
+    Версия реестра хранится в БД и увеличивается в той же транзакции, что и изменение тегов.
+    В запросе она сверяется один раз, при первом обращении к реестру; если версия
+    изменилась (например, тег правили в другом воркере), реестр перечитывается.
+    Вне запроса (CLI, `flask worker`) версия сверяется при каждом обращении.
+    """
+
+    def __init__(self, load_version, load_tags):
+        self._load_version = load_version  # () --> версия в БД
+        self._load_tags = load_tags  # () --> [(id, name), ...]
+        self.version = None
+        self.by_id = {}
+        self.by_name = {}
+        self.reloads = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """
+        Реестр будет перечитан при следующем обращении
+        """
+        self.version = None
+        if has_request_context():
+            g.pop('tag_registry_checked', None)
+
+    def _fresh(self):
+        if self.version is not None and has_request_context() and g.get('tag_registry_checked'):
+            return
+        version = self._load_version()
+        if version != self.version:
+            self.reload(version)
+        if has_request_context():
+            g.tag_registry_checked = True
+
+    def reload(self, version=None):
+        # версию читаем до тегов: если теги изменят между запросами, версия окажется старой
+        # и реестр перечитается при следующей проверке
+        if version is None:
+            version = self._load_version()
+        tags = [Tag(tag_id, name) for tag_id, name in self._load_tags()]
+        with self._lock:
+            self.by_id = {tag.id: tag for tag in tags}
+            self.by_name = {tag.name: tag for tag in tags}
+            self.version = version
+            self.reloads += 1
+
+    def get(self, tag_id):
+        self._fresh()
+        return self.by_id.get(tag_id)
+
+    def known(self, tag_ids):
+        """
+        Множество id из tag_ids, для которых есть теги
+        """
+        self._fresh()
+        by_id = self.by_id
+        return {tag_id for tag_id in tag_ids if tag_id in by_id}
+
+    def resolve(self, tag_ids):
+        """
+        Теги по списку id в том же порядке. Если id нет в реестре (тег вставили в обход ORM),
+        реестр перечитывается (в запросе - не больше одного раза); id, которых нет и в БД, пропускаются
+        """
+        if not tag_ids:  # заметка без тегов - версию не сверяем
+            return []
+        self._fresh()
+        by_id = self.by_id
+        if any(tag_id not in by_id for tag_id in tag_ids) \
+                and not (has_request_context() and g.get('tag_registry_reloaded')):
+            self.reload()
+            by_id = self.by_id
+            if has_request_context():
+                g.tag_registry_reloaded = True
+        return [by_id[tag_id] for tag_id in tag_ids if tag_id in by_id]
+
+    def stats(self):
+        return {"version": self.version, "size": len(self.by_id), "reloads": self.reloads}
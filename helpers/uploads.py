@@ -0,0 +1,104 @@
+import hashlib
+import os
+import re
+import tempfile
+from flask import abort, current_app, request, send_file
+from werkzeug.utils import safe_join
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+BLOB_MAX_AGE = 365 * 24 * 60 * 60  # секунды
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def receive_stream(stream):
+    """
+    Пишет stream во временный файл в UPLOAD_FOLDER кусками по UPLOAD_CHUNK_SIZE, считая sha256 на лету.
+
+    Превышение UPLOAD_MAX_SIZE прерывает запись сразу, временный файл удаляется.
+    Возвращает (путь временного файла, sha256, размер).
+    """
+    config = current_app.config
+    folder = config['UPLOAD_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as target:
+            while True:
+                chunk = stream.read(config['UPLOAD_CHUNK_SIZE'])
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > config['UPLOAD_MAX_SIZE']:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                target.write(chunk)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size
+
+
+def blob_path(digest):
+    """
+    Путь blob'а относительно UPLOAD_FOLDER: ab/cd/abcd... (два уровня по 256 каталогов)
+    """
+    return os.path.join(digest[:2], digest[2:4], digest)
+
+
+def store_blob(temp_path, digest):
+    """
+    Атомарно переносит временный файл на место blob'а digest.
+    Если такое содержимое уже хранится, временный файл просто удаляется
+    """
+    target = os.path.join(current_app.config['UPLOAD_FOLDER'], blob_path(digest))
+    if os.path.exists(target):
+        os.unlink(temp_path)
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(temp_path, target)
+    return True
+
+
+def send_blob(digest, relative_path=None, etag=None, mimetype=None):
+    """
+    Отдает blob digest: Range/206, 304 по ETag и неизменяемый Cache-Control,
+    ведь содержимое по этому адресу никогда не меняется.
+    relative_path и etag задают производный от blob'а файл (например, уменьшенную копию),
+    mimetype - сохраненный при загрузке тип (BlobModel.mimetype); если он неизвестен,
+    файл отдается как application/octet-stream.
+
+    При UPLOAD_ACCEL_REDIRECT_PREFIX тело отдает nginx (X-Accel-Redirect), при
+    USE_X_SENDFILE - Apache/lighttpd (X-Sendfile), и воркер освобождается сразу.
+    Иначе файл отдается через wsgi.file_wrapper (sendfile в gunicorn).
+    """
+    config = current_app.config
+    relative_path = relative_path or blob_path(digest)
+    path = safe_join(config['UPLOAD_FOLDER'], relative_path)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    size = os.path.getsize(path)
+    mimetype = mimetype or 'application/octet-stream'
+    accel_prefix = config['UPLOAD_ACCEL_REDIRECT_PREFIX']
+    if accel_prefix:
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + relative_path.replace(os.sep, '/')
+        response.headers.add('Content-Disposition', 'attachment', filename=digest)
+    else:
+        response = send_file(path, mimetype=mimetype, as_attachment=True, attachment_filename=digest,
+                             add_etags=False, conditional=False)
+    response.set_etag(etag or digest)
+    response.cache_control.public = True
+    response.cache_control.max_age = BLOB_MAX_AGE
+    response.cache_control.immutable = True
+    response.expires = None
+    if accel_prefix:  # Range и проверку условий выполнит nginx
+        return response.make_conditional(request)
+    response = response.make_conditional(request, accept_ranges=True, complete_length=size)
+    if response.status_code == 304:
+        response.headers.pop('X-Sendfile', None)
+    return response
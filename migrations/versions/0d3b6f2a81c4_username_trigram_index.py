@@ -0,0 +1,29 @@
+"""username trigram index
+
+Revision ID: 0d3b6f2a81c4
+Revises: c5e1a9d04b7f
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0d3b6f2a81c4'
+down_revision = 'c5e1a9d04b7f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # на SQLite используется индекс в памяти процесса (api.models.search.TrigramIndex)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE INDEX IF NOT EXISTS ix_user_model_username_trgm ON user_model "
+                   "USING gin (username gin_trgm_ops)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_user_model_username_trgm")
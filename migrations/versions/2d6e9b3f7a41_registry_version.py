@@ -0,0 +1,28 @@
+"""registry version counters for in-process caches
+
+Revision ID: 2d6e9b3f7a41
+Revises: 8f4c1a7e2b90
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2d6e9b3f7a41'
+down_revision = '8f4c1a7e2b90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('registry_version',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('registry_version')
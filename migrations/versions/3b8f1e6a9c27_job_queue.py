@@ -0,0 +1,45 @@
+"""background job queue
+
+Revision ID: 3b8f1e6a9c27
+Revises: 7a9e4c1d2f60
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8f1e6a9c27'
+down_revision = '7a9e4c1d2f60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=16), server_default='queued', nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('run_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('result', sa.Text(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_job_run_at'), 'job', ['run_at'], unique=False)
+    op.create_index(op.f('ix_job_status'), 'job', ['status'], unique=False)
+    op.create_index(op.f('ix_job_user_id'), 'job', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_job_user_id'), table_name='job')
+    op.drop_index(op.f('ix_job_status'), table_name='job')
+    op.drop_index(op.f('ix_job_run_at'), table_name='job')
+    op.drop_table('job')
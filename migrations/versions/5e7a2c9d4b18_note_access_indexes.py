@@ -0,0 +1,29 @@
+"""note access indexes
+
+Revision ID: 5e7a2c9d4b18
+Revises: 9c2d7b4e1a35
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e7a2c9d4b18'
+down_revision = '9c2d7b4e1a35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_note_model_author_id_id', 'note_model', ['author_id', 'id'], unique=False)
+    op.create_index('ix_note_model_public_author_id_id', 'note_model', ['author_id', 'id'], unique=False,
+                    sqlite_where=sa.text('private = 0'), postgresql_where=sa.text('private = false'))
+    op.create_index('ix_tags_note_model_id_tag_id', 'tags', ['note_model_id', 'tag_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tags_note_model_id_tag_id', table_name='tags')
+    op.drop_index('ix_note_model_public_author_id_id', table_name='note_model')
+    op.drop_index('ix_note_model_author_id_id', table_name='note_model')
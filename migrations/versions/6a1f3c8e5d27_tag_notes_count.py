@@ -0,0 +1,52 @@
+"""tag notes_count maintained by triggers on tags
+
+Revision ID: 6a1f3c8e5d27
+Revises: 2d6e9b3f7a41
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a1f3c8e5d27'
+down_revision = '2d6e9b3f7a41'
+branch_labels = None
+depends_on = None
+
+TAG_COUNT_DDL = {
+    'sqlite': [
+        "CREATE TRIGGER IF NOT EXISTS tags_notes_count_ai AFTER INSERT ON tags BEGIN "
+        "UPDATE tag SET notes_count = notes_count + 1 WHERE id = new.tag_id; END",
+        "CREATE TRIGGER IF NOT EXISTS tags_notes_count_ad AFTER DELETE ON tags BEGIN "
+        "UPDATE tag SET notes_count = notes_count - 1 WHERE id = old.tag_id; END",
+    ],
+    'postgresql': [
+        "CREATE OR REPLACE FUNCTION tags_notes_count() RETURNS trigger AS $$ BEGIN "
+        "IF TG_OP = 'INSERT' THEN UPDATE tag SET notes_count = notes_count + 1 WHERE id = NEW.tag_id; "
+        "ELSE UPDATE tag SET notes_count = notes_count - 1 WHERE id = OLD.tag_id; END IF; "
+        "RETURN NULL; END $$ LANGUAGE plpgsql",
+        "CREATE TRIGGER tags_notes_count AFTER INSERT OR DELETE ON tags "
+        "FOR EACH ROW EXECUTE PROCEDURE tags_notes_count()",
+    ],
+}
+
+
+def upgrade():
+    op.add_column('tag', sa.Column('notes_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute("UPDATE tag SET notes_count = (SELECT count(*) FROM tags WHERE tags.tag_id = tag.id)")
+    for statement in TAG_COUNT_DDL.get(op.get_bind().dialect.name, []):
+        op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS tags_notes_count_ai")
+        op.execute("DROP TRIGGER IF EXISTS tags_notes_count_ad")
+    elif dialect == 'postgresql':
+        op.execute("DROP TRIGGER IF EXISTS tags_notes_count ON tags")
+        op.execute("DROP FUNCTION IF EXISTS tags_notes_count()")
+    with op.batch_alter_table('tag') as batch_op:
+        batch_op.drop_column('notes_count')
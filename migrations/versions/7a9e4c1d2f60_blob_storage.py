@@ -0,0 +1,47 @@
+"""content-addressed blob storage
+
+Revision ID: 7a9e4c1d2f60
+Revises: 0d3b6f2a81c4
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a9e4c1d2f60'
+down_revision = '0d3b6f2a81c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('blob',
+    sa.Column('digest', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('mimetype', sa.String(length=128), nullable=True),
+    sa.Column('ref_count', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('digest')
+    )
+    op.create_table('blob_ref',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('blob_digest', sa.String(length=64), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('note_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['blob_digest'], ['blob.digest'], ),
+    sa.ForeignKeyConstraint(['note_id'], ['note_model.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user_model.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_blob_ref_blob_digest'), 'blob_ref', ['blob_digest'], unique=False)
+    op.create_index(op.f('ix_blob_ref_note_id'), 'blob_ref', ['note_id'], unique=False)
+    op.create_index(op.f('ix_blob_ref_user_id'), 'blob_ref', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_blob_ref_user_id'), table_name='blob_ref')
+    op.drop_index(op.f('ix_blob_ref_note_id'), table_name='blob_ref')
+    op.drop_index(op.f('ix_blob_ref_blob_digest'), table_name='blob_ref')
+    op.drop_table('blob_ref')
+    op.drop_table('blob')
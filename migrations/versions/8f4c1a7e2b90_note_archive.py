@@ -0,0 +1,76 @@
+"""note archive: active-note indexes and cold storage tables
+
+Revision ID: 8f4c1a7e2b90
+Revises: 5e7a2c9d4b18
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f4c1a7e2b90'
+down_revision = '5e7a2c9d4b18'
+branch_labels = None
+depends_on = None
+
+SQLITE_FTS_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS note_fts_ai AFTER INSERT ON note_model BEGIN "
+    "INSERT INTO note_fts(rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS note_fts_ad AFTER DELETE ON note_model BEGIN "
+    "INSERT INTO note_fts(note_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS note_fts_au AFTER UPDATE OF text ON note_model BEGIN "
+    "INSERT INTO note_fts(note_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO note_fts(rowid, text) VALUES (new.id, new.text); END",
+]
+
+
+def set_sqlite_autoincrement(enabled):
+    # пересоздание таблицы удаляет ее триггеры, а частичные индексы вернулись бы полными
+    with op.batch_alter_table('note_model', recreate='always',
+                              table_kwargs={'sqlite_autoincrement': enabled}):
+        pass
+    for statement in SQLITE_FTS_TRIGGERS:
+        op.execute(statement)
+
+
+def upgrade():
+    op.drop_index('ix_note_model_public_author_id_id', table_name='note_model')
+    if op.get_bind().dialect.name == 'sqlite':
+        set_sqlite_autoincrement(True)
+    op.create_index('ix_note_model_active_author_id_id', 'note_model', ['author_id', 'id'], unique=False,
+                    sqlite_where=sa.text('archive = 0'), postgresql_where=sa.text('archive = false'))
+    op.create_index('ix_note_model_public_author_id_id', 'note_model', ['author_id', 'id'], unique=False,
+                    sqlite_where=sa.text('private = 0 AND archive = 0'),
+                    postgresql_where=sa.text('private = false AND archive = false'))
+    op.create_table('note_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=True),
+    sa.Column('text', sa.String(length=255), nullable=False),
+    sa.Column('private', sa.Boolean(), nullable=False),
+    sa.Column('blob_refs', sa.Text(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['author_id'], ['user_model.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('note_archive_tags',
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.Column('note_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['note_id'], ['note_archive.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('tag_id', 'note_id')
+    )
+    op.create_index('ix_note_archive_tags_note_id_tag_id', 'note_archive_tags', ['note_id', 'tag_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_note_archive_tags_note_id_tag_id', table_name='note_archive_tags')
+    op.drop_table('note_archive_tags')
+    op.drop_table('note_archive')
+    op.drop_index('ix_note_model_public_author_id_id', table_name='note_model')
+    op.drop_index('ix_note_model_active_author_id_id', table_name='note_model')
+    if op.get_bind().dialect.name == 'sqlite':
+        set_sqlite_autoincrement(False)
+    op.create_index('ix_note_model_public_author_id_id', 'note_model', ['author_id', 'id'], unique=False,
+                    sqlite_where=sa.text('private = 0'), postgresql_where=sa.text('private = false'))
@@ -0,0 +1,25 @@
+"""job progress
+
+Revision ID: 9c2d7b4e1a35
+Revises: 3b8f1e6a9c27
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2d7b4e1a35'
+down_revision = '3b8f1e6a9c27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('job', sa.Column('progress', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('job') as batch_op:
+        batch_op.drop_column('progress')
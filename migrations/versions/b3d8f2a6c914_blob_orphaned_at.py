@@ -0,0 +1,33 @@
+"""blob orphaned_at for the garbage collection grace period
+
+Revision ID: b3d8f2a6c914
+Revises: 6a1f3c8e5d27
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d8f2a6c914'
+down_revision = '6a1f3c8e5d27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('blob') as batch_op:
+        batch_op.add_column(sa.Column('orphaned_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_blob_orphaned_at'), ['orphaned_at'], unique=False)
+    # до этой ревизии анонимные загрузки оставались без ссылок: не отличить их от освобожденных,
+    # поэтому всем blob'ам без ссылок выдаем анонимную ссылку - файлы не пропадут
+    op.execute("INSERT INTO blob_ref (blob_digest, user_id, note_id) "
+               "SELECT digest, NULL, NULL FROM blob WHERE ref_count <= 0")
+    op.execute("UPDATE blob SET ref_count = 1 WHERE ref_count <= 0")
+
+
+def downgrade():
+    with op.batch_alter_table('blob') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_blob_orphaned_at'))
+        batch_op.drop_column('orphaned_at')
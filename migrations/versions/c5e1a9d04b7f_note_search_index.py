@@ -0,0 +1,47 @@
+"""note full-text search index
+
+Revision ID: c5e1a9d04b7f
+Revises: 4214461f0b7c
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from config import Config
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e1a9d04b7f'
+down_revision = '4214461f0b7c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5(text, content='note_model', content_rowid='id')")
+        op.execute("CREATE TRIGGER IF NOT EXISTS note_fts_ai AFTER INSERT ON note_model BEGIN "
+                   "INSERT INTO note_fts(rowid, text) VALUES (new.id, new.text); END")
+        op.execute("CREATE TRIGGER IF NOT EXISTS note_fts_ad AFTER DELETE ON note_model BEGIN "
+                   "INSERT INTO note_fts(note_fts, rowid, text) VALUES ('delete', old.id, old.text); END")
+        op.execute("CREATE TRIGGER IF NOT EXISTS note_fts_au AFTER UPDATE OF text ON note_model BEGIN "
+                   "INSERT INTO note_fts(note_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+                   "INSERT INTO note_fts(rowid, text) VALUES (new.id, new.text); END")
+        # индексируем уже существующие заметки
+        op.execute("INSERT INTO note_fts(note_fts) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        # выражение должно совпадать с search_notes, иначе Postgres не использует индекс
+        op.execute("CREATE INDEX IF NOT EXISTS ix_note_model_text_tsv ON note_model "
+                   f"USING gin (to_tsvector('{Config.SEARCH_TS_CONFIG}', text))")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS note_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS note_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS note_fts_ai")
+        op.execute("DROP TABLE IF EXISTS note_fts")
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_note_model_text_tsv")
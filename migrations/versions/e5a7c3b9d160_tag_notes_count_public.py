@@ -0,0 +1,97 @@
+"""tag notes_count counts only public active notes
+
+Revision ID: e5a7c3b9d160
+Revises: b3d8f2a6c914
+Create Date: 2026-10-17 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a7c3b9d160'
+down_revision = 'b3d8f2a6c914'
+branch_labels = None
+depends_on = None
+
+PUBLIC_ACTIVE = "note_model.private = false AND note_model.archive = false"
+
+TAG_COUNT_DDL = {
+    'sqlite': [
+        "CREATE TRIGGER IF NOT EXISTS tags_notes_count_ai AFTER INSERT ON tags "
+        "WHEN EXISTS (SELECT 1 FROM note_model WHERE id = new.note_model_id AND private = 0 AND archive = 0) BEGIN "
+        "UPDATE tag SET notes_count = notes_count + 1 WHERE id = new.tag_id; END",
+        "CREATE TRIGGER IF NOT EXISTS tags_notes_count_ad AFTER DELETE ON tags "
+        "WHEN EXISTS (SELECT 1 FROM note_model WHERE id = old.note_model_id AND private = 0 AND archive = 0) BEGIN "
+        "UPDATE tag SET notes_count = notes_count - 1 WHERE id = old.tag_id; END",
+        "CREATE TRIGGER IF NOT EXISTS note_model_notes_count_au AFTER UPDATE OF private, archive ON note_model "
+        "WHEN (old.private = 0 AND old.archive = 0) <> (new.private = 0 AND new.archive = 0) BEGIN "
+        "UPDATE tag SET notes_count = notes_count + CASE WHEN new.private = 0 AND new.archive = 0 THEN 1 ELSE -1 END "
+        "WHERE id IN (SELECT tag_id FROM tags WHERE note_model_id = new.id); END",
+        "CREATE TRIGGER IF NOT EXISTS note_model_notes_count_ad AFTER DELETE ON note_model "
+        "WHEN old.private = 0 AND old.archive = 0 BEGIN "
+        "UPDATE tag SET notes_count = notes_count - 1 "
+        "WHERE id IN (SELECT tag_id FROM tags WHERE note_model_id = old.id); END",
+    ],
+    'postgresql': [
+        "CREATE OR REPLACE FUNCTION tags_notes_count() RETURNS trigger AS $$ BEGIN "
+        "IF TG_OP = 'INSERT' THEN UPDATE tag SET notes_count = notes_count + 1 WHERE id = NEW.tag_id "
+        "AND EXISTS (SELECT 1 FROM note_model WHERE id = NEW.note_model_id AND NOT private AND NOT archive); "
+        "ELSE UPDATE tag SET notes_count = notes_count - 1 WHERE id = OLD.tag_id "
+        "AND EXISTS (SELECT 1 FROM note_model WHERE id = OLD.note_model_id AND NOT private AND NOT archive); END IF; "
+        "RETURN NULL; END $$ LANGUAGE plpgsql",
+        "CREATE OR REPLACE FUNCTION note_model_notes_count() RETURNS trigger AS $$ BEGIN "
+        "IF TG_OP = 'UPDATE' THEN "
+        "IF (NOT OLD.private AND NOT OLD.archive) <> (NOT NEW.private AND NOT NEW.archive) THEN "
+        "UPDATE tag SET notes_count = notes_count + CASE WHEN NOT NEW.private AND NOT NEW.archive THEN 1 ELSE -1 END "
+        "WHERE id IN (SELECT tag_id FROM tags WHERE note_model_id = NEW.id); END IF; "
+        "ELSIF NOT OLD.private AND NOT OLD.archive THEN "
+        "UPDATE tag SET notes_count = notes_count - 1 WHERE id IN (SELECT tag_id FROM tags WHERE note_model_id = OLD.id); "
+        "END IF; RETURN NULL; END $$ LANGUAGE plpgsql",
+        "CREATE TRIGGER note_model_notes_count AFTER UPDATE OF private, archive OR DELETE ON note_model "
+        "FOR EACH ROW EXECUTE PROCEDURE note_model_notes_count()",
+    ],
+}
+
+# триггеры ревизии 6a1f3c8e5d27: считают все связи
+OLD_TAG_COUNT_DDL = {
+    'sqlite': [
+        "CREATE TRIGGER IF NOT EXISTS tags_notes_count_ai AFTER INSERT ON tags BEGIN "
+        "UPDATE tag SET notes_count = notes_count + 1 WHERE id = new.tag_id; END",
+        "CREATE TRIGGER IF NOT EXISTS tags_notes_count_ad AFTER DELETE ON tags BEGIN "
+        "UPDATE tag SET notes_count = notes_count - 1 WHERE id = old.tag_id; END",
+    ],
+    'postgresql': [
+        "CREATE OR REPLACE FUNCTION tags_notes_count() RETURNS trigger AS $$ BEGIN "
+        "IF TG_OP = 'INSERT' THEN UPDATE tag SET notes_count = notes_count + 1 WHERE id = NEW.tag_id; "
+        "ELSE UPDATE tag SET notes_count = notes_count - 1 WHERE id = OLD.tag_id; END IF; "
+        "RETURN NULL; END $$ LANGUAGE plpgsql",
+    ],
+}
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS tags_notes_count_ai")
+        op.execute("DROP TRIGGER IF EXISTS tags_notes_count_ad")
+    op.execute("UPDATE tag SET notes_count = (SELECT count(*) FROM tags JOIN note_model "
+               "ON note_model.id = tags.note_model_id WHERE tags.tag_id = tag.id AND " + PUBLIC_ACTIVE + ")")
+    for statement in TAG_COUNT_DDL.get(dialect, []):
+        op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS tags_notes_count_ai")
+        op.execute("DROP TRIGGER IF EXISTS tags_notes_count_ad")
+        op.execute("DROP TRIGGER IF EXISTS note_model_notes_count_au")
+        op.execute("DROP TRIGGER IF EXISTS note_model_notes_count_ad")
+    elif dialect == 'postgresql':
+        op.execute("DROP TRIGGER IF EXISTS note_model_notes_count ON note_model")
+        op.execute("DROP FUNCTION IF EXISTS note_model_notes_count()")
+    op.execute("UPDATE tag SET notes_count = (SELECT count(*) FROM tags WHERE tags.tag_id = tag.id)")
+    for statement in OLD_TAG_COUNT_DDL.get(dialect, []):
+        op.execute(statement)
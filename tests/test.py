@@ -1,12 +1,52 @@
+import hashlib
+import io
 import json
-from api import db
+import os
+import re
+import shutil
+import tempfile
+import threading
+from api import db, credential_cache, response_cache, derivatives, request_metrics
 from app import app
-from unittest import TestCase
-from api.models.user import UserModel
-from api.models.note import NoteModel
+from unittest import TestCase, mock
+from api.models.user import UserModel, TokenUser
+from api.models.note import NoteModel, tags
+from api.models.tag import TagModel, RegistryVersionModel, tag_registry
+from api.models.blob import BlobModel, BlobRefModel
+from api.models.archive import NoteArchiveModel
+from api.models.job import JobModel, task
+from api.models.user_deletion import delete_user
+from api.models.user_import import password_hasher
 from api.schemas.user import UserSchema
 from base64 import b64encode
-from config import Config
+from config import Config, DATABASE_PROFILES
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event
+from helpers.database import pool_stats, replica_lag
+from api.models.search import TrigramIndex, search_notes
+from helpers.derivatives import variant_path
+from helpers.uploads import blob_path
+
+
+@contextmanager
+def assert_num_queries(test, expected):
+    """
+    Проверяет, что внутри блока выполнено ровно expected SQL-запросов
+    """
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    test.assertEqual(len(statements), expected, "\n".join(statements))
 
 
 class TestUsers(TestCase):
@@ -76,8 +116,8 @@ class TestUsers(TestCase):
         res = self.client.get('/users')
         data = json.loads(res.data)
         self.assertEqual(res.status_code, 200)
-        self.assertEqual(data[0]["username"], 'admin')
-        self.assertEqual(data[1]["username"], users_data[0]["username"])
+        self.assertEqual(data["items"][0]["username"], 'admin')
+        self.assertEqual(data["items"][1]["username"], users_data[0]["username"])
 
     def test_user_not_found(self):
         """
@@ -103,6 +143,49 @@ class TestUsers(TestCase):
         self.assertIn('admin', data['error'])
 
 
+    def test_users_search(self):
+        for username in ['alexander', 'Alexey', 'sasha', 'al', 'mary']:
+            UserModel(username=username, password='password').save()
+
+        res = self.client.get('/users/search?username=LEX')
+        self.assertEqual([user["username"] for user in json.loads(res.data)], ['alexander', 'Alexey'])
+
+        res = self.client.get('/users/search?username=al&prefix=true&limit=2')
+        self.assertEqual([user["username"] for user in json.loads(res.data)], ['al', 'alexander'])
+
+        res = self.client.get('/users/search?username=a')
+        self.assertEqual(len(json.loads(res.data)), 6)
+
+        # переименование попадает в индекс
+        user = UserModel.query.filter_by(username='mary').first()
+        user.username = 'maria_lex'
+        user.save()
+        res = self.client.get('/users/search?username=lex')
+        self.assertIn('maria_lex', [user["username"] for user in json.loads(res.data)])
+        res = self.client.get('/users/search?username=mary')
+        self.assertEqual(json.loads(res.data), [])
+
+    def test_trigram_index_reload(self):
+        """
+        Перечитывание индекса не блокирует поиск, изменения во время перечитывания не теряются
+        """
+        index = TrigramIndex(ttl=0)
+        index.ensure_loaded(lambda: [(1, 'alexander')])
+        found = []
+
+        def rows_loader():
+            # поиск из другого потока идет по старому индексу, не дожидаясь перечитывания
+            thread = threading.Thread(target=lambda: found.append(index.search_substring('lex', 10)))
+            thread.start()
+            thread.join(5)
+            index.add(3, 'Alexey')  # пользователя создали после чтения строк
+            return [(1, 'alexander'), (2, 'al')]
+
+        index.ensure_loaded(rows_loader)
+        self.assertEqual(found, [[1]])
+        self.assertEqual(index.search_substring('lex', 10), [1, 3])
+        self.assertEqual(index.search_prefix('al', 10), [2, 1, 3])
+
     def test_edit_user(self):
         """
         Редактирование пользователя
@@ -130,13 +213,244 @@ class TestUsers(TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertIs(None, user)
 
+    def test_delete_user_background(self):
+        """
+        Удаление пользователя фоновой задачей
+        """
+        user = UserModel(username='alex', password='alex')
+        user.save()
+        user_id = user.id
+        tag = TagModel(name='shared')
+        tag.save()
+        tag_id = tag.id
+        for i in range(5):
+            note = NoteModel(author_id=user_id, text=f"note {i}")
+            note.save()
+            note.add_tags([tag_id])
+        self.app.config['USER_DELETE_CHUNK_SIZE'] = 2
+        res = self.client.delete(f'/users/{user_id}?background=true', headers=self.headers)
+        job = json.loads(res.data)
+        self.assertEqual(res.status_code, 202)
+        self.assertTrue(res.headers['Location'].endswith(job["_links"]["self"]))
+        self.assertEqual(job["status"], "queued")
+        self.assertIsNotNone(UserModel.query.get(user_id))
+
+        with self.app.app_context():  # как в `flask worker`
+            self.assertEqual(JobModel.run_pending(), 1)
+        self.assertIsNone(UserModel.query.get(user_id))
+        job = json.loads(self.client.get(res.headers['Location'], headers=self.headers).data)
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["result"], {"deleted": True, "deleted_notes": 5})
+        self.assertEqual(job["progress"], {"deleted_notes": 5, "total_notes": 5})
+        self.assertEqual(NoteModel.query.filter_by(author_id=user_id).count(), 0)
+        self.assertEqual(db.session.query(tags).count(), 0)
+        # теги общие и не удаляются вместе с заметками
+        self.assertIsNotNone(TagModel.query.get(tag_id))
+
+    def test_delete_user_concurrently(self):
+        """
+        Пользователя удалили параллельно, пока удалялись его заметки
+        """
+        user = UserModel(username='alex', password='alex')
+        user.save()
+        user_id = user.id
+        NoteModel.bulk_create([{"author_id": user_id, "text": "note"}])
+        db.session.commit()
+
+        def progress(deleted, total):
+            db.session.execute(UserModel.__table__.delete().where(UserModel.id == user_id))
+
+        with self.app.app_context():
+            self.assertIsNone(delete_user(user_id, progress=progress))
+        self.assertIsNone(UserModel.query.get(user_id))
+
+    def test_delete_user_with_many_notes(self):
+        """
+        Пользователь с большим числом заметок удаляется в фоне
+        """
+        user = UserModel(username='alex', password='alex')
+        user.save()
+        user_id = user.id
+        NoteModel.bulk_create([{"author_id": user_id, "text": f"note {i}"} for i in range(3)])
+        db.session.commit()
+        self.app.config['USER_DELETE_SYNC_MAX_NOTES'] = 2
+        res = self.client.delete(f'/users/{user_id}', headers=self.headers)
+        self.assertEqual(res.status_code, 202)
+        self.assertIsNotNone(UserModel.query.get(user_id))
+
+    def test_users_bulk(self):
+        """
+        Массовое создание: занятые и повторяющиеся имена отсеиваются, остальные создаются порциями
+        """
+        self.app.config['USER_IMPORT_BATCH_SIZE'] = 2
+        users = [
+            {"username": "ivan", "password": "ivan"},
+            {"username": "admin", "password": "admin"},
+            {"username": "maria", "password": "maria", "role": "admin"},
+            {"username": "ivan", "password": "other"},
+            {"username": "petr"},
+            {"username": "olga", "password": "olga"},
+            {"username": "x" * 33, "password": "long"},
+        ]
+        res = self.client.post('/users/bulk', headers=self.headers, data=json.dumps({"users": users}),
+                               content_type='application/json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json["created"], 3)
+        self.assertEqual([result["status"] for result in res.json["results"]], [201, 409, 201, 409, 422, 201, 422])
+        self.assertIn("password", res.json["results"][4]["errors"])
+        self.assertIn("username", res.json["results"][6]["errors"])
+
+        with self.app.app_context():
+            maria = UserModel.query.get(res.json["results"][2]["id"])
+            self.assertEqual(maria.role, "admin")
+            self.assertTrue(maria.verify_password("maria"))
+        res = self.client.get('/users/search?username=olg')
+        self.assertEqual([user["username"] for user in res.json], ['olga'])
+
+        # пул хэширования создается один раз и общий для запросов
+        executor = password_hasher._executor
+        self.assertIsNotNone(executor)
+        res = self.client.post('/users/bulk', headers=self.headers, content_type='application/json',
+                               data=json.dumps({"users": [{"username": "anna", "password": "anna"},
+                                                          {"username": "oleg", "password": "oleg"}]}))
+        self.assertEqual(res.json["created"], 2)
+        self.assertIs(password_hasher._executor, executor)
+
+        res = self.client.post('/users/bulk', data=json.dumps({"users": users}), content_type='application/json')
+        self.assertEqual(res.status_code, 401)
+
+    def test_users_bulk_concurrent_insert(self):
+        """
+        Имя заняли параллельно и после повторной проверки: строка получает 409, остальные создаются
+        """
+        users = [{"username": "ivan", "password": "ivan"}, {"username": "admin", "password": "admin"},
+                 {"username": "olga", "password": "olga"}]
+        # проверка занятых имен "не видит" admin - как если бы его вставили параллельно
+        with mock.patch('api.models.user_import.existing_usernames', side_effect=lambda usernames: set()):
+            res = self.client.post('/users/bulk', headers=self.headers, data=json.dumps({"users": users}),
+                                   content_type='application/json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([result["status"] for result in res.json["results"]], [201, 409, 201])
+        self.assertEqual(res.json["created"], 2)
+
+    def test_users_bulk_background(self):
+        """
+        Большой /users/bulk уходит в фоновую задачу, пароли в задаче после выполнения не хранятся
+        """
+        self.app.config['USER_BULK_SYNC_MAX_SIZE'] = 1
+        users = [{"username": "ivan", "password": "ivan"}, {"username": "admin", "password": "admin"}]
+        res = self.client.post('/users/bulk', headers=self.headers, data=json.dumps({"users": users}),
+                               content_type='application/json')
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(json.loads(res.data)["status"], "queued")
+        self.assertIsNone(UserModel.query.filter_by(username='ivan').first())
+
+        with self.app.app_context():  # как в `flask worker`
+            self.assertEqual(JobModel.run_pending(), 1)
+        job = json.loads(self.client.get(res.headers['Location'], headers=self.headers).data)
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["result"]["created"], 1)
+        self.assertEqual([result["status"] for result in job["result"]["results"]], [201, 409])
+        self.assertEqual(job["progress"], {"inserted": 1, "total": 1})
+        with self.app.app_context():
+            self.assertEqual(JobModel.query.get(job["id"]).payload, '{}')
+            self.assertTrue(UserModel.query.filter_by(username='ivan').first().verify_password('ivan'))
+
+    def test_users_import_cli(self):
+        folder = tempfile.mkdtemp()
+        try:
+            csv_path = os.path.join(folder, 'users.csv')
+            with open(csv_path, 'w') as f:
+                f.write("username,password,role\nivan,ivan,\nmaria,maria,admin\nadmin,admin,\n")
+            jsonl_path = os.path.join(folder, 'users.jsonl')
+            with open(jsonl_path, 'w') as f:
+                f.write('{"username": "petr", "password": "petr"}\n\n{"username": "maria", "password": "x"}\n')
+            runner = self.app.test_cli_runner()
+            # два процесса хэширования - путь через пул
+            result = runner.invoke(args=['users', 'import', csv_path, '--workers', '2'])
+            self.assertIsNone(result.exception)
+            self.assertIn("Users created: 2, skipped: 1", result.output)
+            result = runner.invoke(args=['users', 'import', jsonl_path])
+            self.assertIn("Users created: 1, skipped: 1", result.output)
+        finally:
+            shutil.rmtree(folder)
+        with self.app.app_context():
+            self.assertEqual(sorted(user.username for user in UserModel.query),
+                             ['admin', 'ivan', 'maria', 'petr'])
+            self.assertEqual(UserModel.query.filter_by(username='maria').first().role, 'admin')
+            self.assertTrue(UserModel.query.filter_by(username='ivan').first().verify_password('ivan'))
+
     def tearDown(self):
+        self.app.config.update({
+            'USER_DELETE_CHUNK_SIZE': Config.USER_DELETE_CHUNK_SIZE,
+            'USER_DELETE_SYNC_MAX_NOTES': Config.USER_DELETE_SYNC_MAX_NOTES,
+            'USER_IMPORT_BATCH_SIZE': Config.USER_IMPORT_BATCH_SIZE,
+            'USER_BULK_SYNC_MAX_SIZE': Config.USER_BULK_SYNC_MAX_SIZE,
+        })
         with self.app.app_context():
             # drop all tables
             db.session.remove()
             db.drop_all()
 
 
+flaky_calls = []
+
+
+@task("tests.flaky")
+def flaky_task(job, fail_times):
+    flaky_calls.append(job.attempts)
+    if len(flaky_calls) <= fail_times:
+        raise RuntimeError("temporary failure")
+    return len(flaky_calls)
+
+
+class TestJobs(TestCase):
+    def setUp(self):
+        self.app = app
+        self.app.config.update({
+            'SQLALCHEMY_DATABASE_URI': Config.TEST_DATABASE_URI
+        })
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        flaky_calls.clear()
+
+    def test_retry(self):
+        job_id = JobModel.enqueue("tests.flaky", {"fail_times": 1}).id
+        self.assertEqual(JobModel.run_pending(), 1)
+        job = JobModel.query.get(job_id)
+        self.assertEqual(job.status, "queued")
+        self.assertIn("temporary failure", job.error)
+        # повтор отложен на JOB_RETRY_DELAY
+        self.assertEqual(JobModel.run_pending(), 0)
+
+        job.run_at = datetime.utcnow()
+        db.session.commit()
+        self.assertEqual(JobModel.run_pending(), 1)
+        job = JobModel.query.get(job_id)
+        self.assertEqual((job.status, job.attempts, job.result_data), ("done", 2, 2))
+
+    def test_failed_after_max_attempts(self):
+        job_id = JobModel.enqueue("tests.flaky", {"fail_times": 5}, max_attempts=1).id
+        JobModel.run_pending()
+        self.assertEqual(JobModel.query.get(job_id).status, "failed")
+
+    def test_visibility_timeout(self):
+        job_id = JobModel.enqueue("tests.flaky", {"fail_times": 0}).id
+        self.assertEqual(JobModel.claim().id, job_id)
+        # задача захвачена и невидима, пока не истек locked_until
+        self.assertIsNone(JobModel.claim())
+        JobModel.query.get(job_id).locked_until = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        job = JobModel.claim()
+        self.assertEqual((job.id, job.attempts), (job_id, 2))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+
 class TestNotes(TestCase):
     def setUp(self):
         self.app = app
@@ -197,7 +511,362 @@ class TestNotes(TestCase):
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
-        self.assertEqual(len(data), 2)
+        self.assertEqual(len(data["items"]), 2)
+
+    def test_get_notes_pagination(self):
+        for i in range(5):
+            note = NoteModel(author_id=self.user.id, text=f'Test note {i}')
+            note.save()
+
+        res = self.client.get('/notes?limit=2', headers=self.headers)
+        data = json.loads(res.data)
+        self.assertEqual([note["text"] for note in data["items"]], ['Test note 0', 'Test note 1'])
+
+        texts = []
+        next_link = data["_links"]["next"]
+        while next_link:
+            data = json.loads(self.client.get(next_link, headers=self.headers).data)
+            texts.extend(note["text"] for note in data["items"])
+            next_link = data["_links"]["next"]
+        self.assertEqual(texts, ['Test note 2', 'Test note 3', 'Test note 4'])
+
+    def test_get_notes_limit_too_large(self):
+        res = self.client.get(f'/notes?limit={Config.MAX_PAGE_SIZE + 1}', headers=self.headers)
+        self.assertEqual(res.status_code, 422)
+
+    def create_public_notes_with_tags(self, authors):
+        tags = [TagModel(name=f'tag{i}') for i in range(2)]
+        for tag in tags:
+            tag.save()
+        for i in range(authors):
+            user = UserModel(username=f'user{i}', password='password')
+            user.save()
+            note = NoteModel(author_id=user.id, text=f'Note {i}', private=False)
+            note.tags.extend(tags)
+            note.save()
+
+    def test_filter_notes_query_count(self):
+        """
+        Число SQL-запросов списка заметок не зависит от числа авторов и тегов
+        """
+        self.create_public_notes_with_tags(authors=5)
+        self.client.get('/notes/public/filter?limit=1')  # загружаем реестр тегов
+        # заметки + связи с тегами + авторы + версия реестра тегов
+        with assert_num_queries(self, 4):
+            res = self.client.get('/notes/public/filter')
+        data = json.loads(res.data)
+        self.assertEqual(len(data["items"]), 5)
+        self.assertEqual([tag["name"] for tag in data["items"][0]["tags"]], ['tag0', 'tag1'])
+
+    def test_get_notes_query_count(self):
+        for i in range(5):
+            note = NoteModel(author_id=self.user.id, text=f'Test note {i}')
+            note.save()
+        self.client.get('/notes', headers=self.headers)  # прогреваем кэш паролей
+        # пользователь + заметки + автор + теги
+        with assert_num_queries(self, 4):
+            self.client.get('/notes', headers=self.headers)
+
+    def test_fast_serializer_matches_marshmallow(self):
+        """
+        Быстрый сериализатор отдает те же байты, что и marshal_with
+        """
+        self.create_public_notes_with_tags(authors=3)
+        note = NoteModel(author_id=self.user.id, text='Заметка "с" юникодом\n', private=False)
+        note.save()
+        for debug in (True, False):
+            self.app.debug = debug
+            responses = []
+            for fast in (True, False):
+                self.app.config['FAST_SERIALIZER'] = fast
+                responses.append(self.client.get('/notes/public/filter?limit=3').data)
+                responses.append(self.client.get('/notes/public/filter?after=3').data)
+            self.assertEqual(responses[:2], responses[2:])
+
+    def test_set_note_tags_bulk(self):
+        tags = [TagModel(name=f'tag{i}') for i in range(30)]
+        for tag in tags:
+            tag.save()
+        all_ids = [tag.id for tag in tags]
+        note = NoteModel(author_id=self.user.id, text='Test note 1')
+        note.save()
+        self.client.get('/notes', headers=self.headers)  # прогреваем кэш паролей
+        with self.app.app_context():
+            tag_registry.reload()  # как после первого запроса воркера
+
+        tag_ids = all_ids[:20]
+        # теги проверяются и сериализуются по реестру, в БД - только версия реестра
+        with assert_num_queries(self, 8):
+            res = self.client.put(f'/notes/{note.id}/tags', headers=self.headers,
+                                  data=json.dumps({"tags": tag_ids + [tag_ids[0], 999]}),
+                                  content_type='application/json')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(len(data["tags"]), 20)
+        self.assertEqual(data["unknown_tags"], [999])
+
+        # повторная привязка не нарушает первичный ключ таблицы tags
+        res = self.client.put(f'/notes/{note.id}/tags', headers=self.headers,
+                              data=json.dumps({"tags": [all_ids[0], all_ids[25]]}),
+                              content_type='application/json')
+        self.assertEqual(len(json.loads(res.data)["tags"]), 21)
+
+        res = self.client.delete(f'/notes/{note.id}/tags', headers=self.headers,
+                                 data=json.dumps({"tags": tag_ids[:10] + [998]}),
+                                 content_type='application/json')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["tags"]), 11)
+        self.assertEqual(data["unknown_tags"], [998])
+
+    def test_tag_registry(self):
+        """
+        Теги заметок берутся из реестра в памяти; изменения тегов (в том числе
+        в другом воркере) видны уже в следующем запросе
+        """
+        tag = TagModel(name='old')
+        tag.save()
+        note = NoteModel(author_id=self.user.id, text='Test note 1')
+        note.save()
+        note.add_tags([tag.id])
+        note_id, tag_id = note.id, tag.id
+        self.client.get(f'/notes/{note_id}', headers=self.headers)
+
+        with assert_num_queries(self, 4) as statements:
+            res = self.client.get(f'/notes/{note_id}', headers=self.headers)
+        self.assertEqual(res.json["tags"][0]["name"], 'old')
+        self.assertFalse([statement for statement in statements if re.search(r'\bFROM tag\b', statement)])
+
+        # другой воркер переименовал тег
+        with self.app.app_context():
+            db.session.execute("UPDATE tag SET name = 'other' WHERE id = :id", {"id": tag_id})
+            RegistryVersionModel.bump(db.session.connection(), "tags")
+            db.session.commit()
+        res = self.client.get(f'/notes/{note_id}', headers=self.headers)
+        self.assertEqual(res.json["tags"][0]["name"], 'other')
+
+        res = self.client.put(f'/tags/{tag_id}', headers=self.headers, data=json.dumps({"name": "new"}),
+                              content_type='application/json')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(self.client.get(f'/notes/{note_id}', headers=self.headers).json["tags"][0]["name"], 'new')
+        self.assertEqual(self.client.get(f'/tags/{tag_id}').json["name"], 'new')
+
+        self.client.delete(f'/tags/{tag_id}', headers=self.headers)
+        self.assertEqual(self.client.get(f'/notes/{note_id}', headers=self.headers).json["tags"], [])
+        self.assertEqual(self.client.get(f'/tags/{tag_id}').status_code, 404)
+
+    def test_note_tags_chunks(self):
+        """
+        add_tags/remove_tags делят списки id на порции по TAGS_INSERT_CHUNK
+        """
+        tag_ids = []
+        for name in ('a', 'b', 'c', 'd', 'e'):
+            tag = TagModel(name=name)
+            tag.save()
+            tag_ids.append(tag.id)
+        note = NoteModel(author_id=self.user.id, text='note')
+        note.save()
+        note_id = note.id
+        in_lists = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if 'tag_id IN' in statement:
+                in_lists.append(len(parameters) - 1)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            with mock.patch.object(NoteModel, 'TAGS_INSERT_CHUNK', 2):
+                self.assertEqual(note.add_tags(tag_ids[:3]), [])
+                # существующие связи находятся во всех порциях, дубликатов нет
+                self.assertEqual(note.add_tags(tag_ids), [])
+                self.assertEqual(note.remove_tags(tag_ids[1:]), [])
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        self.assertEqual(in_lists, [2, 1, 2, 2, 1, 2, 2])
+        linked = db.session.query(tags.c.tag_id).filter(tags.c.note_model_id == note_id).all()
+        self.assertEqual(linked, [(tag_ids[0],)])
+
+    def test_notes_tag_filter(self):
+        """
+        /notes?tags_all=&tags_any=&tags_none= - одним запросом к заметкам
+        """
+        tag_ids = []
+        for name in ('a', 'b', 'c'):
+            tag = TagModel(name=name)
+            tag.save()
+            tag_ids.append(tag.id)
+        a, b, c = tag_ids
+        notes = {}
+        for text, note_tags in (('ab', [a, b]), ('a', [a]), ('bc', [b, c]), ('none', [])):
+            note = NoteModel(author_id=self.user.id, text=text)
+            note.save()
+            note.add_tags(note_tags)
+        other = UserModel(username='alex', password='alex')
+        other.save()
+        for text, private in (('alex public', False), ('alex private', True)):
+            note = NoteModel(author_id=other.id, text=text, private=private)
+            note.save()
+            note.add_tags([a])
+
+        def texts(query):
+            res = self.client.get(f'/notes?{query}', headers=self.headers)
+            self.assertEqual(res.status_code, 200)
+            return [note["text"] for note in res.json["items"]]
+
+        self.assertEqual(texts(f'tags_all={a},{b}'), ['ab'])
+        self.assertEqual(texts(f'tags_any={a},{c}'), ['ab', 'a', 'bc'])
+        self.assertEqual(texts(f'tags_none={a}'), ['bc', 'none'])
+        self.assertEqual(texts(f'tags_any={b}&tags_none={c}'), ['ab'])
+        self.assertEqual(texts(f'tags_all={a}&include_public=true'), ['ab', 'a', 'alex public'])
+        self.assertEqual(texts(f'tags_all={a},999'), [])
+
+        res = self.client.get(f'/notes?tags_any={a},{b},{c}&limit=2', headers=self.headers)
+        self.assertEqual([note["text"] for note in res.json["items"]], ['ab', 'a'])
+        res = self.client.get(res.json["_links"]["next"], headers=self.headers)
+        self.assertEqual([note["text"] for note in res.json["items"]], ['bc'])
+
+        # заметки + связи с тегами + авторы + версия реестра тегов (пароль уже в кэше)
+        with assert_num_queries(self, 5):
+            self.client.get(f'/notes?tags_all={a}&tags_none={c}', headers=self.headers)
+
+    def test_tag_notes_count(self):
+        """
+        notes_count тегов - число публичных неархивных заметок, меняется вместе со связями,
+        приватностью и архивом заметок и отдается /tags/cloud
+        """
+        tags = [TagModel(name=name) for name in ('a', 'b')]
+        for tag in tags:
+            tag.save()
+        a, b = [tag.id for tag in tags]
+        note_ids = []
+        for tag_ids, private in (([a, b], False), ([a], False), ([a], False), ([a, b], True)):
+            note = NoteModel(author_id=self.user.id, text='note', private=private)
+            note.save()
+            note.add_tags(tag_ids)
+            note_ids.append(note.id)
+
+        def cloud(query=''):
+            return [(tag["name"], tag["notes_count"]) for tag in self.client.get('/tags/cloud' + query).json]
+
+        # приватная заметка не учитывается
+        self.assertEqual(cloud(), [('a', 3), ('b', 1)])
+
+        self.client.delete(f'/notes/{note_ids[0]}/tags', headers=self.headers, data=json.dumps({"tags": [a]}),
+                           content_type='application/json')
+        self.client.post('/notes/batch', headers=self.headers, content_type='application/json',
+                         data=json.dumps({"operations": [{"op": "delete", "id": note_ids[1]}]}))
+        self.assertEqual(cloud('?limit=1'), [('a', 1)])
+
+        # архив флагом и холодное хранилище вычитают теги заметки, восстановление возвращает
+        self.client.delete(f'/notes/{note_ids[2]}/archive', headers=self.headers)
+        self.assertEqual(cloud(), [('b', 1), ('a', 0)])
+        self.client.put(f'/notes/{note_ids[2]}/restore', headers=self.headers)
+        self.app.config['NOTE_COLD_STORAGE'] = True
+        self.client.delete(f'/notes/{note_ids[0]}/archive', headers=self.headers)
+        self.assertEqual(cloud(), [('a', 1), ('b', 0)])
+        self.client.put(f'/notes/{note_ids[0]}/restore', headers=self.headers)
+        self.assertEqual(cloud(), [('a', 1), ('b', 1)])
+
+        # публикация приватной заметки прибавляет ее теги, скрытие - вычитает
+        with self.app.app_context():
+            note = NoteModel.query.get(note_ids[3])
+            note.private = False
+            note.save()
+        self.assertEqual(cloud(), [('a', 2), ('b', 2)])
+        with self.app.app_context():
+            note = NoteModel.query.get(note_ids[0])
+            note.private = True
+            note.save()
+        self.assertEqual(cloud(), [('a', 2), ('b', 1)])
+
+    def test_notes_batch(self):
+        """
+        Пакетное создание/редактирование/удаление заметок
+        """
+        user_alex = UserModel(username='alex', password='alex')
+        user_alex.save()
+        notes = [NoteModel(author_id=self.user.id, text='Test note 1'),
+                 NoteModel(author_id=self.user.id, text='Test note 2'),
+                 NoteModel(author_id=user_alex.id, text='Alex note 1')]
+        for note in notes:
+            note.save()
+        own_1, own_2, alien = [note.id for note in notes]
+
+        operations = [
+            {"op": "create", "text": "Batch note 1", "private": False},
+            {"op": "create", "private": False},
+            {"op": "edit", "id": own_1, "text": "Edited note"},
+            {"op": "delete", "id": own_2},
+            {"op": "delete", "id": own_2},
+            {"op": "delete", "id": alien},
+            {"op": "move", "id": own_1},
+            {"op": "delete", "id": True},
+        ]
+        res = self.client.post('/notes/batch', headers=self.headers,
+                               data=json.dumps({"operations": operations}),
+                               content_type='application/json')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([result["status"] for result in data["results"]], [201, 422, 200, 200, 404, 403, 422, 422])
+        self.assertIn("text", data["results"][1]["errors"])
+        self.assertIn("id", data["results"][7]["errors"])
+
+        created = NoteModel.query.get(data["results"][0]["id"])
+        self.assertEqual(created.text, "Batch note 1")
+        self.assertEqual(NoteModel.query.get(own_1).text, "Edited note")
+        self.assertIsNone(NoteModel.query.get(own_2))
+        self.assertIsNotNone(NoteModel.query.get(alien))
+
+    def test_search_notes(self):
+        """
+        Полнотекстовый поиск учитывает приватность и архив
+        """
+        user_alex = UserModel(username='alex', password='alex')
+        user_alex.save()
+        notes_data = [
+            (self.user.id, 'Купить молоко и хлеб', True, False),
+            (self.user.id, 'Молоко закончилось', False, True),
+            (user_alex.id, 'Alex: молоко', False, False),
+            (user_alex.id, 'Alex private молоко', True, False),
+            (user_alex.id, 'Nothing here', False, False),
+        ]
+        for author_id, text, private, archive in notes_data:
+            NoteModel(author_id=author_id, text=text, private=private, archive=archive).save()
+
+        res = self.client.get('/notes/search?q=молоко')
+        texts = [note["text"] for note in json.loads(res.data)["items"]]
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(texts, ['Alex: молоко'])
+
+        res = self.client.get('/notes/search?q=МОЛОКО&archive=true', headers=self.headers)
+        texts = {note["text"] for note in json.loads(res.data)["items"]}
+        self.assertEqual(texts, {'Купить молоко и хлеб', 'Молоко закончилось', 'Alex: молоко'})
+
+        res = self.client.get('/notes/search?q=молоко хлеб', headers=self.headers)
+        texts = [note["text"] for note in json.loads(res.data)["items"]]
+        self.assertEqual(texts, ['Купить молоко и хлеб'])
+
+        # изменение и удаление заметки попадают в индекс
+        note = NoteModel.query.filter_by(text='Nothing here').first()
+        note.text = 'Теперь молоко'
+        note.save()
+        NoteModel.query.filter_by(text='Alex: молоко').first().delete()
+        res = self.client.get('/notes/search?q=молоко&limit=1')
+        data = json.loads(res.data)
+        self.assertEqual([note["text"] for note in data["items"]], ['Теперь молоко'])
+        self.assertIsNone(data["_links"]["next"])
+
+    def test_search_notes_like_fallback(self):
+        """
+        Поиск подстрок на прочих СУБД экранирует спецсимволы LIKE
+        """
+        for text in ('скидка 50% на всё', 'скидка 500 на всё', 'file_name', 'filename'):
+            NoteModel(author_id=self.user.id, text=text).save()
+        with mock.patch.object(db.engine.dialect, 'name', 'mysql'):
+            texts = [note.text for note in search_notes(NoteModel.query, ['50%'])]
+            self.assertEqual(texts, ['скидка 50% на всё'])
+            texts = [note.text for note in search_notes(NoteModel.query, ['file_'])]
+            self.assertEqual(texts, ['file_name'])
 
     def test_get_note_by_id(self):
         notes_data = [
@@ -280,9 +949,9 @@ class TestNotes(TestCase):
         res = self.client.get('/notes', headers=self.headers)
         data = json.loads(res.data)
 
-        self.assertFalse(data[0]["private"])
-        self.assertTrue(data[1]["private"])
-        self.assertTrue(data[2]["private"])
+        self.assertFalse(data["items"][0]["private"])
+        self.assertTrue(data["items"][1]["private"])
+        self.assertTrue(data["items"][2]["private"])
 
     def test_edit_note(self):
         """
@@ -358,8 +1027,704 @@ class TestNotes(TestCase):
         res = self.client.delete('/notes/3', headers=self.headers)
         self.assertEqual(res.status_code, 404)
 
+    def test_archived_notes_listing(self):
+        """
+        Архивные заметки не попадают в /notes и отдаются /notes/archive
+        """
+        active = NoteModel(author_id=self.user.id, text='Active note')
+        active.save()
+        archived = NoteModel(author_id=self.user.id, text='Archived note', private=False, archive=True)
+        archived.save()
+        username = self.user.username
+
+        res = self.client.get('/notes', headers=self.headers)
+        self.assertEqual([note["text"] for note in res.json["items"]], ['Active note'])
+        res = self.client.get('/notes/archive', headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([note["text"] for note in res.json["items"]], ['Archived note'])
+        res = self.client.get(f'/notes/public/filter?username={username}')
+        self.assertEqual(res.json["items"], [])
+
+    def test_cold_storage_archive_restore(self):
+        """
+        С NOTE_COLD_STORAGE заметка переносится в note_archive и возвращается с тем же id и тегами
+        """
+        self.app.config['NOTE_COLD_STORAGE'] = True
+        user_id = self.user.id
+        note = NoteModel(author_id=user_id, text='Cold note')
+        note.save()
+        tag = TagModel(name='cold')
+        tag.save()
+        note.add_tags([tag.id])
+        note_id, tag_id = note.id, tag.id
+        UserModel(username='alex', password='alex').save()
+        alex_headers = {'Authorization': 'Basic ' + b64encode(b"alex:alex").decode('utf-8')}
+
+        # переносить и возвращать можно только свои заметки
+        self.assertEqual(self.client.delete(f'/notes/{note_id}/archive').status_code, 401)
+        self.assertEqual(self.client.delete(f'/notes/{note_id}/archive', headers=alex_headers).status_code, 403)
+        res = self.client.delete(f'/notes/{note_id}/archive', headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.json["archive"])
+        self.assertEqual([t["id"] for t in res.json["tags"]], [tag_id])
+        with self.app.app_context():
+            self.assertIsNone(NoteModel.query.get(note_id))
+            self.assertIsNotNone(NoteArchiveModel.query.get(note_id))
+        res = self.client.get('/notes/archive', headers=self.headers)
+        self.assertEqual([n["id"] for n in res.json["items"]], [note_id])
+        res = self.client.get('/notes', headers=self.headers)
+        self.assertEqual(res.json["items"], [])
+
+        # id архивной заметки не переиспользуется новой
+        new_note = NoteModel(author_id=user_id, text='New note')
+        new_note.save()
+        self.assertNotEqual(new_note.id, note_id)
+
+        self.assertEqual(self.client.put(f'/notes/{note_id}/restore').status_code, 401)
+        self.assertEqual(self.client.put(f'/notes/{note_id}/restore', headers=alex_headers).status_code, 403)
+        with self.app.app_context():
+            self.assertIsNotNone(NoteArchiveModel.query.get(note_id))
+        res = self.client.put(f'/notes/{note_id}/restore', headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(res.json["archive"])
+        self.assertEqual([t["id"] for t in res.json["tags"]], [tag_id])
+        with self.app.app_context():
+            self.assertIsNone(NoteArchiveModel.query.get(note_id))
+
     def tearDown(self):
+        self.app.debug = Config.DEBUG
+        self.app.config['NOTE_COLD_STORAGE'] = Config.NOTE_COLD_STORAGE
+        self.app.config['FAST_SERIALIZER'] = Config.FAST_SERIALIZER
         with self.app.app_context():
             # drop all tables
             db.session.remove()
             db.drop_all()
+
+
+class TestResponseCache(TestCase):
+    def setUp(self):
+        self.app = app
+        self.app.config.update({
+            'SQLALCHEMY_DATABASE_URI': Config.TEST_DATABASE_URI
+        })
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+        user_data = {
+            "username": 'admin',
+            'password': 'admin',
+            "role": "admin",
+        }
+        user = UserModel(**user_data)
+        user.save()
+        self.headers = {
+            'Authorization': 'Basic ' + b64encode(
+                f"{user_data['username']}:{user_data['password']}".encode('ascii')).decode('utf-8')
+        }
+
+    def test_cached_response_and_etag(self):
+        TagModel(name='tag1').save()
+        res = self.client.get('/tags')
+        etag = res.headers['ETag']
+        self.assertEqual(res.status_code, 200)
+
+        with assert_num_queries(self, 0):
+            cached = self.client.get('/tags')
+            not_modified = self.client.get('/tags', headers={'If-None-Match': etag})
+        self.assertEqual(cached.data, res.data)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.data, b'')
+
+    def test_save_invalidates_cache(self):
+        TagModel(name='tag1').save()
+        etag = self.client.get('/tags').headers['ETag']
+        self.client.post('/tags', headers=self.headers,
+                         data=json.dumps({"name": "tag2"}), content_type='application/json')
+        res = self.client.get('/tags', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([tag["name"] for tag in json.loads(res.data)["items"]], ['tag1', 'tag2'])
+
+    def test_cache_key_includes_language(self):
+        misses = response_cache.misses
+        self.client.get('/users/1', headers={'Accept-Language': 'en'})
+        self.client.get('/users/1', headers={'Accept-Language': 'en'})
+        self.client.get('/users/1', headers={'Accept-Language': 'ru'})
+        self.assertEqual(response_cache.misses, misses + 2)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+
+class TestUpload(TestCase):
+    def setUp(self):
+        self.app = app
+        self.upload_folder = tempfile.mkdtemp()
+        self.app.config.update({
+            'SQLALCHEMY_DATABASE_URI': Config.TEST_DATABASE_URI,
+            'UPLOAD_FOLDER': self.upload_folder,
+        })
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+    def auth_headers(self, username, password):
+        UserModel(username=username, password=password).save()
+        return {
+            'Authorization': 'Basic ' + b64encode(f"{username}:{password}".encode('ascii')).decode('utf-8')
+        }
+
+    def test_upload_multipart(self):
+        content = b'\x89PNG' + b'0' * 200000
+        res = self.client.put('/upload', data={"image": (io.BytesIO(content), 'picture.png')},
+                              content_type='multipart/form-data')
+        data = json.loads(res.data)
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["sha256"], digest)
+        self.assertEqual(data["size"], len(content))
+        self.assertEqual(data["url"], f'/uploads/{digest}')
+        with open(os.path.join(self.upload_folder, digest[:2], digest[2:4], digest), 'rb') as f:
+            self.assertEqual(f.read(), content)
+        res = self.client.get(data["url"])
+        self.assertEqual(res.data, content)
+        self.assertEqual(res.mimetype, 'image/png')
+
+        self.app.config['UPLOAD_ACCEL_REDIRECT_PREFIX'] = '/protected-uploads/'
+        self.assertEqual(self.client.get(data["url"]).mimetype, 'image/png')
+
+    def test_upload_deduplicated(self):
+        """
+        Одинаковые файлы разных пользователей хранятся один раз
+        """
+        content = b'0123456789' * 10000
+        urls = []
+        for username in ('alex', 'ivan'):
+            res = self.client.put('/upload', data=content, content_type='application/octet-stream',
+                                  headers=self.auth_headers(username, 'password'))
+            self.assertEqual(res.status_code, 200)
+            urls.append(json.loads(res.data)["url"])
+        self.assertEqual(urls[0], urls[1])
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertEqual(BlobModel.query.get(digest).ref_count, 2)
+        self.assertEqual(os.listdir(self.upload_folder), [digest[:2]])
+
+        UserModel.query.filter_by(username='alex').first().delete()
+        self.assertEqual(BlobModel.query.get(digest).ref_count, 1)
+
+    def test_blobs_gc_grace(self):
+        """
+        Сборщик мусора не трогает анонимные загрузки и blob'ы, оставшиеся без ссылок недавно
+        """
+        anonymous = b'anonymous' * 1000
+        self.client.put('/upload', data=anonymous, content_type='application/octet-stream')
+        owned = b'owned' * 1000
+        self.client.put('/upload', data=owned, content_type='application/octet-stream',
+                        headers=self.auth_headers('alex', 'password'))
+        anonymous_digest = hashlib.sha256(anonymous).hexdigest()
+        owned_digest = hashlib.sha256(owned).hexdigest()
+        UserModel.query.filter_by(username='alex').first().delete()
+        self.assertEqual(BlobModel.query.get(owned_digest).ref_count, 0)
+
+        with self.app.app_context():
+            self.assertEqual(BlobModel.collect_garbage(), 0)
+        self.assertEqual(self.client.get(f'/uploads/{owned_digest}').status_code, 200)
+
+        self.app.config['BLOB_GC_GRACE'] = -1
+        with self.app.app_context():
+            self.assertEqual(BlobModel.collect_garbage(), 1)
+        self.assertIsNone(BlobModel.query.get(owned_digest))
+        self.assertFalse(os.path.exists(os.path.join(self.upload_folder, blob_path(owned_digest))))
+        self.assertEqual(BlobModel.query.get(anonymous_digest).ref_count, 1)
+        self.assertEqual(self.client.get(f'/uploads/{anonymous_digest}').status_code, 200)
+
+    def test_blobs_gc_during_upload(self):
+        """
+        blobs-gc удалил прежний blob, пока шла повторная загрузка того же файла: файл не теряется
+        """
+        content = b'again' * 1000
+        digest = hashlib.sha256(content).hexdigest()
+        self.client.put('/upload', data=content, content_type='application/octet-stream',
+                        headers=self.auth_headers('alex', 'password'))
+        UserModel.query.filter_by(username='alex').first().delete()
+        self.app.config['BLOB_GC_GRACE'] = -1
+        get_or_create = BlobModel.get_or_create
+
+        def collect_first(*args):
+            self.assertEqual(BlobModel.collect_garbage(), 1)
+            return get_or_create(*args)
+
+        with mock.patch.object(BlobModel, 'get_or_create', side_effect=collect_first):
+            res = self.client.put('/upload', data=content, content_type='application/octet-stream')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.client.get(f'/uploads/{digest}').data, content)
+        self.assertEqual(os.listdir(os.path.join(self.upload_folder, digest[:2], digest[2:4])), [digest])
+
+    def test_blobs_gc_cold_storage(self):
+        """
+        Файлы заметки в холодном хранилище не собираются, пока заметку не удалят из архива
+        """
+        self.app.config.update({'NOTE_COLD_STORAGE': True, 'BLOB_GC_GRACE': -1})
+        headers = self.auth_headers('alex', 'password')
+        user_id = UserModel.query.filter_by(username='alex').first().id
+        note = NoteModel(author_id=user_id, text='Cold note')
+        note.save()
+        note_id = note.id
+        content = b'cold' * 1000
+        digest = hashlib.sha256(content).hexdigest()
+        self.client.put(f'/upload?note_id={note_id}', data=content, content_type='application/octet-stream',
+                        headers=headers)
+        self.assertEqual(self.client.delete(f'/notes/{note_id}/archive', headers=headers).status_code, 200)
+
+        with self.app.app_context():
+            self.assertEqual(BlobModel.collect_garbage(), 0)
+            self.assertEqual(BlobModel.query.get(digest).ref_count, 1)
+        self.assertEqual(self.client.get(f'/uploads/{digest}').status_code, 200)
+
+        self.assertEqual(self.client.put(f'/notes/{note_id}/restore', headers=headers).status_code, 200)
+        self.assertEqual(BlobRefModel.query.filter_by(note_id=note_id).count(), 1)
+        self.assertEqual(self.client.delete(f'/notes/{note_id}/archive', headers=headers).status_code, 200)
+
+        # удаление пользователя удаляет архивную заметку и освобождает ее ссылки
+        with self.app.app_context():
+            delete_user(user_id)
+            self.assertEqual(BlobModel.query.get(digest).ref_count, 0)
+            self.assertEqual(BlobModel.collect_garbage(), 1)
+        self.assertEqual(self.client.get(f'/uploads/{digest}').status_code, 404)
+
+    def test_download_blob(self):
+        content = bytes(range(256)) * 100
+        url = json.loads(self.client.put('/upload', data=content,
+                                         content_type='application/octet-stream').data)["url"]
+        res = self.client.get(url)
+        etag = res.headers['ETag']
+        self.assertEqual(res.data, content)
+        self.assertEqual(res.mimetype, 'application/octet-stream')  # тип при загрузке неизвестен
+        self.assertIn('immutable', res.headers['Cache-Control'])
+        self.assertEqual(etag, f'"{hashlib.sha256(content).hexdigest()}"')
+
+        res = self.client.get(url, headers={'Range': 'bytes=100-199'})
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res.data, content[100:200])
+
+        res = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+        self.app.config['UPLOAD_ACCEL_REDIRECT_PREFIX'] = '/protected-uploads/'
+        res = self.client.get(url)
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertEqual(res.headers['X-Accel-Redirect'], f'/protected-uploads/{digest[:2]}/{digest[2:4]}/{digest}')
+        self.assertEqual(res.data, b'')
+
+    def test_image_variants(self):
+        from PIL import Image
+        picture = io.BytesIO()
+        Image.new('RGB', (1000, 500), 'red').save(picture, format='PNG')
+        data = json.loads(self.client.put('/upload', data={"image": (io.BytesIO(picture.getvalue()), 'picture.png')},
+                                          content_type='multipart/form-data').data)
+        digest = data["sha256"]
+        self.assertIn(data["derivatives"]["status"], ("queued", "running"))
+        self.assertEqual(self.client.get(f'/uploads/{digest}?variant=unknown').status_code, 404)
+        derivatives.wait(digest, timeout=30)
+
+        res = self.client.get(data["derivatives"]["job"])
+        job = json.loads(res.data)
+        self.assertEqual(job["status"], "done")
+        res = self.client.get(job["variants"]["thumb"])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['ETag'], f'"{digest}-thumb"')
+        self.assertEqual(Image.open(io.BytesIO(res.data)).size, (128, 64))
+
+    def test_blobs_gc_variants(self):
+        """
+        Сборщик мусора удаляет и уменьшенные копии, удаленный blob больше не отдается
+        """
+        from PIL import Image
+        picture = io.BytesIO()
+        Image.new('RGB', (300, 200), 'blue').save(picture, format='PNG')
+        data = json.loads(self.client.put('/upload', data={"image": (io.BytesIO(picture.getvalue()), 'picture.png')},
+                                          content_type='multipart/form-data',
+                                          headers=self.auth_headers('alex', 'password')).data)
+        digest = data["sha256"]
+        derivatives.wait(digest, timeout=30)
+        self.assertEqual(self.client.get(f'/uploads/{digest}?variant=thumb').status_code, 200)
+        thumb = os.path.join(self.upload_folder, variant_path('thumb', digest))
+        self.assertTrue(os.path.isfile(thumb))
+
+        UserModel.query.filter_by(username='alex').first().delete()
+        self.app.config['BLOB_GC_GRACE'] = -1
+        with self.app.app_context():
+            self.assertEqual(BlobModel.collect_garbage(), 1)
+        self.assertFalse(os.path.exists(thumb))
+        self.assertEqual(self.client.get(f'/uploads/{digest}?variant=thumb').status_code, 404)
+        self.assertEqual(self.client.get(f'/uploads/{digest}').status_code, 404)
+
+    def test_image_variants_back_pressure(self):
+        content = b'not an image'
+        res = json.loads(self.client.put('/upload', data=content, content_type='application/octet-stream').data)
+        digest = res["sha256"]
+        # не изображение - в пул не отправляется
+        self.assertEqual(res["derivatives"]["status"], "unsupported")
+        self.assertEqual(self.client.post(f'/upload/jobs/{digest}').status_code, 422)
+        self.assertEqual(self.client.get(f'/upload/jobs/{digest}').status_code, 404)
+        # копии нет - перенаправление на оригинал
+        self.assertEqual(self.client.get(f'/uploads/{digest}?variant=thumb').status_code, 302)
+
+        from PIL import Image
+        picture = io.BytesIO()
+        Image.new('RGB', (10, 10), 'red').save(picture, format='PNG')
+        self.app.config['IMAGE_VARIANTS'] = {'broken': 0}  # thumbnail((0, 0)) падает в пуле
+        digest = json.loads(self.client.put('/upload', data=picture.getvalue(),
+                                            content_type='application/octet-stream').data)["sha256"]
+        derivatives.wait(digest, timeout=30)
+        self.assertEqual(json.loads(self.client.get(f'/upload/jobs/{digest}').data)["status"], "failed")
+
+        self.app.config['DERIVATIVE_MAX_PENDING'] = 0
+        res = self.client.post(f'/upload/jobs/{digest}')
+        self.assertEqual(res.status_code, 503)
+        self.assertIn('Retry-After', res.headers)
+
+        # ошибки не копятся в памяти
+        self.app.config['DERIVATIVE_FAILED_TTL'] = -1
+        self.assertEqual(self.client.get(f'/upload/jobs/{digest}').status_code, 404)
+
+    def test_upload_too_large(self):
+        self.app.config.update({'UPLOAD_MAX_SIZE': 1000, 'MAX_CONTENT_LENGTH': None})
+        res = self.client.put('/upload', data=b'0' * 5000, content_type='application/octet-stream')
+        self.assertEqual(res.status_code, 413)
+        # временный файл удален, итоговый не создан
+        self.assertEqual(os.listdir(self.upload_folder), [])
+
+    def tearDown(self):
+        self.app.config.update({
+            'UPLOAD_FOLDER': Config.UPLOAD_FOLDER,
+            'UPLOAD_MAX_SIZE': Config.UPLOAD_MAX_SIZE,
+            'MAX_CONTENT_LENGTH': Config.MAX_CONTENT_LENGTH,
+            'UPLOAD_ACCEL_REDIRECT_PREFIX': Config.UPLOAD_ACCEL_REDIRECT_PREFIX,
+            'DERIVATIVE_MAX_PENDING': Config.DERIVATIVE_MAX_PENDING,
+            'DERIVATIVE_FAILED_TTL': Config.DERIVATIVE_FAILED_TTL,
+            'IMAGE_VARIANTS': Config.IMAGE_VARIANTS,
+            'BLOB_GC_GRACE': Config.BLOB_GC_GRACE,
+            'NOTE_COLD_STORAGE': Config.NOTE_COLD_STORAGE,
+        })
+        shutil.rmtree(self.upload_folder)
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+
+class TestDatabaseProfiles(TestCase):
+    def setUp(self):
+        self.app = app
+        self.app.config.update({
+            'SQLALCHEMY_DATABASE_URI': Config.TEST_DATABASE_URI
+        })
+        self.client = self.app.test_client()
+        self.folder = tempfile.mkdtemp()
+
+    def test_sqlite_pragmas(self):
+        with self.app.app_context():
+            self.assertEqual(db.session.execute("PRAGMA busy_timeout").scalar(), 5000)
+            db.session.remove()
+
+    def test_sqlite_wal_profile(self):
+        profile = DATABASE_PROFILES['sqlite-wal']
+        self.app.config['SQLITE_PRAGMAS'] = profile['sqlite_pragmas']
+        engine = create_engine('sqlite:///' + os.path.join(self.folder, 'wal.db'), **profile['engine_options'])
+        with engine.connect() as connection:
+            self.assertEqual(connection.execute("PRAGMA journal_mode").scalar(), "wal")
+            stats = pool_stats(engine)
+            self.assertEqual((stats["pool"], stats["size"], stats["checked_out"]), ("QueuePool", 5, 1))
+        self.assertEqual(pool_stats(engine)["checked_out"], 0)
+        engine.dispose()
+
+    def test_pool_metrics(self):
+        with self.app.app_context():
+            db.create_all()
+            UserModel(username='admin', password='admin', role='admin').save()
+        headers = {'Authorization': 'Basic ' + b64encode(b"admin:admin").decode('utf-8')}
+        res = self.client.get('/metrics/pool', headers=headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)["dialect"], "sqlite")
+
+    def test_db_explain(self):
+        with self.app.app_context():
+            db.create_all()
+            user = UserModel(username='alex', password='alex')
+            user.save()
+            NoteModel.bulk_create([{"author_id": user.id, "text": f"note {i}", "private": i % 2 == 0}
+                                   for i in range(20)])
+            db.session.commit()
+            # при равной оценке SQLite берет индекс, созданный последним; create_all создает индексы
+            # в произвольном порядке, поэтому пересоздаем частичный индекс последним, как в миграциях
+            index = next(index for index in NoteModel.__table__.indexes
+                         if index.name == 'ix_note_model_public_author_id_id')
+            index.drop(db.engine)
+            index.create(db.engine)
+            result = self.app.test_cli_runner().invoke(args=['db-explain'])
+        self.assertIsNone(result.exception)
+        self.assertIn("=== GET /notes/public/filter?username=alex (200)", result.output)
+        self.assertIn("USING INDEX ix_note_model_author_id_id", result.output)
+        self.assertIn("USING INDEX ix_note_model_public_author_id_id", result.output)
+        self.assertIn("USING COVERING INDEX ix_tags_note_model_id_tag_id", result.output)
+
+    def tearDown(self):
+        self.app.config['SQLITE_PRAGMAS'] = Config.SQLITE_PRAGMAS
+        shutil.rmtree(self.folder)
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+
+class TestReadReplica(TestCase):
+    def setUp(self):
+        self.app = app
+        self.folder = tempfile.mkdtemp()
+        self.app.config.update({
+            'SQLALCHEMY_DATABASE_URI': Config.TEST_DATABASE_URI,
+            'SQLALCHEMY_BINDS': {'replica0': 'sqlite:///' + os.path.join(self.folder, 'replica.db')},
+        })
+        self.client = self.app.test_client()
+        response_cache.enabled = False
+        db.router.reset()
+        with self.app.app_context():
+            db.create_all()
+            db.metadata.create_all(db.get_engine(self.app, bind='replica0'))
+            # реплика еще не получила тег, созданный на основной БД
+            TagModel(name='primary').save()
+            db.get_engine(self.app, bind='replica0').execute(TagModel.__table__.insert().values(name='replica'))
+            UserModel(username='admin', password='admin', role='admin').save()
+            db.get_engine(self.app, bind='replica0').execute(
+                UserModel.__table__.insert().values(username='admin', password_hash=UserModel.query.get(1).password_hash,
+                                                    role='admin'))
+        self.headers = {'Authorization': 'Basic ' + b64encode(b"admin:admin").decode('utf-8')}
+
+    def tag_names(self):
+        return [tag["name"] for tag in json.loads(self.client.get('/tags').data)["items"]]
+
+    def test_get_reads_replica(self):
+        self.assertEqual(self.tag_names(), ['replica'])
+        res = self.client.post('/tags', data=json.dumps({"name": "new"}), content_type='application/json',
+                               headers=self.headers)
+        self.assertEqual(res.status_code, 201)
+        with self.app.app_context():
+            self.assertEqual([tag.name for tag in TagModel.query.order_by(TagModel.id)], ['primary', 'new'])
+
+    def test_read_after_write_uses_primary(self):
+        with self.app.test_request_context('/tags/1'):
+            self.app.preprocess_request()
+            self.assertEqual(TagModel.query.get(1).name, 'replica')
+            db.session.add(TagModel(name='new'))
+            db.session.flush()
+            self.assertEqual(TagModel.query.get(1).name, 'primary')
+            db.session.rollback()
+            db.session.remove()
+
+    def test_session_pins_one_replica(self):
+        """
+        Все чтения одного запроса идут на одну реплику, следующий запрос берет следующую
+        """
+        self.app.config['SQLALCHEMY_BINDS'] = dict(self.app.config['SQLALCHEMY_BINDS'],
+                                                   replica1='sqlite:///' + os.path.join(self.folder, 'replica1.db'))
+        with self.app.app_context():
+            replica1 = db.get_engine(self.app, bind='replica1')
+            db.metadata.create_all(replica1)
+            replica1.execute(TagModel.__table__.insert().values(name='replica1'))
+        try:
+            seen = set()
+            for i in range(2):
+                with self.app.test_request_context('/tags/1'):
+                    self.app.preprocess_request()
+                    names = {db.session.query(TagModel.name).filter_by(id=1).scalar() for j in range(4)}
+                    self.assertEqual(len(names), 1)
+                    seen.update(names)
+                    db.session.remove()
+            self.assertEqual(seen, {'replica', 'replica1'})
+        finally:
+            replica1.dispose()
+
+    def test_tag_registry_reads_primary(self):
+        """
+        Реестр тегов сверяет версию и читается с основной БД и в GET-запросах
+        """
+        tag_registry.invalidate()
+        self.assertEqual(json.loads(self.client.get('/tags/1').data)["name"], 'primary')
+        self.assertEqual(tag_registry.stats()["version"], 1)
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        db.router.probe = lambda engine: 60
+        try:
+            self.assertEqual(self.tag_names(), ['primary'])
+        finally:
+            db.router.probe = replica_lag
+
+    def tearDown(self):
+        response_cache.enabled = Config.RESPONSE_CACHE_ENABLED
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.get_engine(self.app, bind='replica0').dispose()
+        self.app.config['SQLALCHEMY_BINDS'] = Config.SQLALCHEMY_BINDS
+        shutil.rmtree(self.folder)
+
+
+class TestRequestMetrics(TestCase):
+    def setUp(self):
+        self.app = app
+        self.app.config.update({
+            'SQLALCHEMY_DATABASE_URI': Config.TEST_DATABASE_URI
+        })
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.create_all()
+            UserModel(username='admin', password='admin', role='admin').save()
+        self.headers = {'Authorization': 'Basic ' + b64encode(b"admin:admin").decode('utf-8')}
+
+    def test_prometheus_histograms(self):
+        self.client.get('/notes', headers=self.headers)
+        metrics = self.client.get('/metrics').data.decode()
+        labels = 'endpoint="noteslistresource",method="GET"'
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}}', metrics)
+        self.assertIn(f'db_statements_per_request_bucket{{{labels},le="+Inf"}}', metrics)
+        self.assertIn(f'auth_seconds_sum{{{labels}}}', metrics)
+        self.assertIn(f'serialization_seconds_sum{{{labels}}}', metrics)
+        self.assertIn(f'http_response_size_bytes_count{{{labels}}}', metrics)
+
+    def test_server_timing(self):
+        self.assertNotIn('Server-Timing', self.client.get('/notes', headers=self.headers).headers)
+        request_metrics.server_timing = True
+        try:
+            res = self.client.get('/notes', headers=self.headers)
+        finally:
+            request_metrics.server_timing = Config.METRICS_SERVER_TIMING
+        timing = res.headers['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[0-9.]+;desc="[1-9][0-9]* queries", auth;dur=[0-9.]+, '
+                                 r'serialize;dur=[0-9.]+, total;dur=[0-9.]+$')
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+
+class TestAuthCache(TestCase):
+    def setUp(self):
+        self.app = app
+        self.app.config.update({
+            'SQLALCHEMY_DATABASE_URI': Config.TEST_DATABASE_URI
+        })
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+        user_data = {
+            "username": 'admin',
+            'password': 'admin',
+            "role": "admin",
+        }
+        self.create_and_auth_user(user_data)
+        credential_cache.invalidate()
+
+    def create_and_auth_user(self, user_data):
+        user = UserModel(**user_data)
+        user.save()
+        self.user = user
+        self.headers = {
+            'Authorization': 'Basic ' + b64encode(
+                f"{user_data['username']}:{user_data['password']}".encode('ascii')).decode('utf-8')
+        }
+
+    def test_repeat_auth_hits_cache(self):
+        hits = credential_cache.hits
+        self.client.get('/notes', headers=self.headers)
+        self.client.get('/notes', headers=self.headers)
+        res = self.client.get('/auth/cache', headers=self.headers)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["hits"], hits + 2)
+
+    def test_password_change_invalidates_cache(self):
+        self.client.get('/notes', headers=self.headers)
+        self.user.hash_password('new_password')
+        self.user.save()
+        res = self.client.get('/notes', headers=self.headers)
+        self.assertEqual(res.status_code, 401)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+
+class TestStatelessToken(TestCase):
+    def setUp(self):
+        self.app = app
+        self.app.config.update({
+            'SQLALCHEMY_DATABASE_URI': Config.TEST_DATABASE_URI,
+            'AUTH_TOKEN_STATELESS': True,
+        })
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+        user_data = {
+            "username": 'admin',
+            'password': 'admin',
+            "role": "admin",
+        }
+        self.create_and_auth_user(user_data)
+
+    def create_and_auth_user(self, user_data):
+        user = UserModel(**user_data)
+        user.save()
+        self.user = user
+        self.headers = {
+            'Authorization': 'Basic ' + b64encode(
+                f"{user_data['username']}:{user_data['password']}".encode('ascii')).decode('utf-8')
+        }
+
+    def get_token(self):
+        res = self.client.get('/auth/token', headers=self.headers)
+        return json.loads(res.data)["token"]
+
+    def token_headers(self):
+        token = self.get_token()
+        return {
+            'Authorization': 'Basic ' + b64encode(f"{token}:".encode('ascii')).decode('utf-8')
+        }
+
+    def test_token_carries_claims(self):
+        token = self.get_token()
+        with self.app.app_context():
+            user = UserModel.verify_auth_token(token)
+        self.assertIsInstance(user, TokenUser)
+        self.assertEqual(user.role, "admin")
+        self.assertEqual(user.username, "admin")
+
+    def test_token_user_loads_row_lazily(self):
+        headers = self.token_headers()
+        note = NoteModel(author_id=self.user.id, text='Test note 1')
+        note.save()
+        res = self.client.get('/notes', headers=headers)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["items"]), 1)
+
+    def test_role_change_revokes_token(self):
+        headers = self.token_headers()
+        self.user.role = "simple_user"
+        self.user.save()
+        res = self.client.get('/auth/token', headers=headers)
+        self.assertEqual(res.status_code, 401)
+
+    def tearDown(self):
+        self.app.config['AUTH_TOKEN_STATELESS'] = False
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()